@@ -0,0 +1,32 @@
+"""Add moderation leases
+
+Revision ID: 4f2a9c7d1e36
+Revises: cca5bae1b378
+Create Date: 2023-08-14 19:02:41.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2a9c7d1e36'
+down_revision = 'cca5bae1b378'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('recipes', sa.Column('lease_owner_id', sa.Uuid(), nullable=True))
+    op.add_column('recipes', sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ix_recipes_pending_date_created', 'recipes', ['date_created'],
+        postgresql_where=sa.text('status = 1'),
+        sqlite_where=sa.text('status = 1')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_recipes_pending_date_created', table_name='recipes')
+    op.drop_column('recipes', 'lease_expires_at')
+    op.drop_column('recipes', 'lease_owner_id')
@@ -0,0 +1,40 @@
+"""Add recipe LSH index
+
+Revision ID: 5e8b2d6f0c41
+Revises: 9d2c4e7f1a83
+Create Date: 2023-09-04 10:12:53.204718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8b2d6f0c41'
+down_revision = '9d2c4e7f1a83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # filled by `python -m recipe.duplicates` for the existing recipes
+    op.create_table('recipe_signatures',
+    sa.Column('recipe_id', sa.Uuid(), nullable=False),
+    sa.Column('source_hash', sa.String(), nullable=False),
+    sa.Column('signature', sa.LargeBinary(), nullable=False),
+    sa.Column('date_computed', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('recipe_id')
+    )
+    op.create_table('recipe_lsh_buckets',
+    sa.Column('band', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.String(), nullable=False),
+    sa.Column('recipe_id', sa.Uuid(), nullable=False),
+    sa.PrimaryKeyConstraint('band', 'bucket', 'recipe_id')
+    )
+    op.create_index('ix_recipe_lsh_buckets_recipe_id', 'recipe_lsh_buckets', ['recipe_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_recipe_lsh_buckets_recipe_id', table_name='recipe_lsh_buckets')
+    op.drop_table('recipe_lsh_buckets')
+    op.drop_table('recipe_signatures')
@@ -0,0 +1,27 @@
+"""Add bookmark feed index
+
+Revision ID: 7b1d3e9a5c20
+Revises: 4f2a9c7d1e36
+Create Date: 2023-08-16 21:47:09.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b1d3e9a5c20'
+down_revision = '4f2a9c7d1e36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_bookmarked_recipes_user_id_date_added', 'bookmarked_recipes',
+        ['user_id', 'date_added', 'recipe_id']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_bookmarked_recipes_user_id_date_added', table_name='bookmarked_recipes')
@@ -0,0 +1,31 @@
+"""Add recipe attachments
+
+Revision ID: 9d2c4e7f1a83
+Revises: e3a7b9d51c04
+Create Date: 2023-09-02 11:20:37.846105
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2c4e7f1a83'
+down_revision = 'e3a7b9d51c04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('recipe_attachments',
+    sa.Column('recipe_id', sa.Uuid(), nullable=False),
+    sa.Column('sha256', sa.String(), nullable=False),
+    sa.Column('content_type', sa.String(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('date_added', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('recipe_id', 'sha256')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('recipe_attachments')
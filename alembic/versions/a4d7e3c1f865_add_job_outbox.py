@@ -0,0 +1,41 @@
+"""Add job outbox
+
+Revision ID: a4d7e3c1f865
+Revises: f27c8a1d5e90
+Create Date: 2023-08-28 10:37:02.114863
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d7e3c1f865'
+down_revision = 'f27c8a1d5e90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('job_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('run_after', sa.DateTime(), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('date_failed', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_job_outbox_due_run_after', 'job_outbox', ['run_after'],
+        postgresql_where=sa.text('date_failed IS NULL'),
+        sqlite_where=sa.text('date_failed IS NULL')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_job_outbox_due_run_after', table_name='job_outbox')
+    op.drop_table('job_outbox')
@@ -0,0 +1,56 @@
+"""Add recipe popularity counters
+
+Revision ID: b3e58f0a6d14
+Revises: 7b1d3e9a5c20
+Create Date: 2023-08-18 17:25:43.871390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e58f0a6d14'
+down_revision = '7b1d3e9a5c20'
+branch_labels = None
+depends_on = None
+
+FEED_INDEXES = {
+    'ix_recipes_approved_rating': ['rating', 'date_created'],
+    'ix_recipes_approved_date_created': ['date_created'],
+    'ix_recipes_approved_bookmark_count': ['bookmark_count', 'date_created'],
+    'ix_recipes_approved_rating_count': ['rating_count', 'date_created'],
+}
+
+
+def upgrade() -> None:
+    op.add_column('recipes', sa.Column('bookmark_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('recipes', sa.Column('rating_count', sa.Integer(), server_default='0', nullable=False))
+
+    # the primary keys lead with `user_id`, and the counts are by `recipe_id`
+    op.create_index('ix_bookmarked_recipes_recipe_id', 'bookmarked_recipes', ['recipe_id'])
+    op.create_index('ix_rated_recipes_recipe_id', 'rated_recipes', ['recipe_id'])
+
+    op.execute(
+        'UPDATE recipes SET '
+        'bookmark_count = (SELECT count(*) FROM bookmarked_recipes WHERE bookmarked_recipes.recipe_id = recipes.id), '
+        'rating_count = (SELECT count(*) FROM rated_recipes WHERE rated_recipes.recipe_id = recipes.id)'
+    )
+
+    for name, columns in FEED_INDEXES.items():
+        op.create_index(
+            name, 'recipes', columns,
+            postgresql_where=sa.text('status = 2'),
+            sqlite_where=sa.text('status = 2')
+        )
+
+
+def downgrade() -> None:
+    for name in FEED_INDEXES:
+        op.drop_index(name, table_name='recipes')
+
+    op.drop_index('ix_rated_recipes_recipe_id', table_name='rated_recipes')
+    op.drop_index('ix_bookmarked_recipes_recipe_id', table_name='bookmarked_recipes')
+
+    op.drop_column('recipes', 'rating_count')
+    op.drop_column('recipes', 'bookmark_count')
@@ -0,0 +1,33 @@
+"""Add rendered sources
+
+Revision ID: c58e1f3a9d27
+Revises: a4d7e3c1f865
+Create Date: 2023-08-29 16:05:41.382517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c58e1f3a9d27'
+down_revision = 'a4d7e3c1f865'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('rendered_sources',
+    sa.Column('source_hash', sa.String(), nullable=False),
+    sa.Column('html', sa.String(), nullable=False),
+    sa.Column('date_rendered', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('source_hash')
+    )
+
+    # filled by `python -m recipe.render`, the recipes are rendered on the fly until then
+    op.add_column('recipes', sa.Column('source_hash', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('recipes', 'source_hash')
+    op.drop_table('rendered_sources')
@@ -0,0 +1,45 @@
+"""Add trending scores
+
+Revision ID: d91c4a7e2b58
+Revises: b3e58f0a6d14
+Create Date: 2023-08-21 12:08:36.557012
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd91c4a7e2b58'
+down_revision = 'b3e58f0a6d14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('recipe_activity',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('recipe_id', sa.Uuid(), nullable=False),
+    sa.Column('weight', sa.Float(), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('recipe_trending',
+    sa.Column('recipe_id', sa.Uuid(), nullable=False),
+    sa.Column('log_score', sa.Float(), nullable=False),
+    sa.Column('date_updated', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('recipe_id')
+    )
+    op.create_index('ix_recipe_trending_log_score', 'recipe_trending', ['log_score'])
+
+    # the existing bookmarks are the initial activity (the ratings have no dates)
+    op.execute(
+        'INSERT INTO recipe_activity (recipe_id, weight, date_created) '
+        'SELECT recipe_id, 1.0, date_added FROM bookmarked_recipes ORDER BY date_added'
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_recipe_trending_log_score', table_name='recipe_trending')
+    op.drop_table('recipe_trending')
+    op.drop_table('recipe_activity')
@@ -0,0 +1,34 @@
+"""Add recipe versions
+
+Revision ID: e3a7b9d51c04
+Revises: c58e1f3a9d27
+Create Date: 2023-08-31 12:44:09.527316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a7b9d51c04'
+down_revision = 'c58e1f3a9d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('recipes', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+    op.create_table('recipe_versions',
+    sa.Column('recipe_id', sa.Uuid(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('snapshot', sa.Boolean(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('recipe_id', 'version')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('recipe_versions')
+    op.drop_column('recipes', 'version')
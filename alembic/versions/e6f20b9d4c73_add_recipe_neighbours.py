@@ -0,0 +1,31 @@
+"""Add recipe neighbours
+
+Revision ID: e6f20b9d4c73
+Revises: d91c4a7e2b58
+Create Date: 2023-08-23 20:41:15.309846
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6f20b9d4c73'
+down_revision = 'd91c4a7e2b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('recipe_neighbours',
+    sa.Column('recipe_id', sa.Uuid(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('neighbour_id', sa.Uuid(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('date_computed', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('recipe_id', 'rank')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('recipe_neighbours')
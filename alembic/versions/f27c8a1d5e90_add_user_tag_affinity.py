@@ -0,0 +1,45 @@
+"""Add user tag affinity
+
+Revision ID: f27c8a1d5e90
+Revises: e6f20b9d4c73
+Create Date: 2023-08-25 18:12:50.731024
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f27c8a1d5e90'
+down_revision = 'e6f20b9d4c73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_recipes_tags_tag_id', 'recipes_tags', ['tag_id', 'recipe_id'])
+
+    op.create_table('user_tag_affinity',
+    sa.Column('user_id', sa.Uuid(), nullable=False),
+    sa.Column('tag_id', sa.Uuid(), nullable=False),
+    sa.Column('weight', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id', 'tag_id')
+    )
+
+    # the bookmarks weigh 1, the ratings of 4 and 5 weigh score / 5 (see `recipe.affinity`)
+    op.execute(
+        'INSERT INTO user_tag_affinity (user_id, tag_id, weight) '
+        'SELECT interactions.user_id, recipes_tags.tag_id, SUM(interactions.weight) '
+        'FROM ('
+        'SELECT user_id, recipe_id, 1.0 AS weight FROM bookmarked_recipes '
+        'UNION ALL '
+        'SELECT user_id, recipe_id, score / 5.0 AS weight FROM rated_recipes WHERE score >= 4'
+        ') AS interactions '
+        'JOIN recipes_tags ON recipes_tags.recipe_id = interactions.recipe_id '
+        'GROUP BY interactions.user_id, recipes_tags.tag_id'
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_tag_affinity')
+    op.drop_index('ix_recipes_tags_tag_id', table_name='recipes_tags')
@@ -0,0 +1,141 @@
+"""
+Throughput of serving the recipe photos (`GET /attachment/{sha256}`)
+from a `gunicorn` started for the benchmark, with and without
+`sendfile()`.
+
+    python -m benchmarks.attachments --photos 20 --size 1048576 --requests 500
+
+Reports the requests and megabytes per second of whole photos and of
+`Range` requests of `--range` bytes, over `--concurrency` keep-alive
+connections.
+"""
+
+from sqlalchemy import create_engine
+
+from recipe.attachments import AttachmentStore
+from recipe.database.database import init_db
+
+from .run import use_benchmark_secret
+
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from threading import local
+from time import perf_counter, sleep
+import argparse
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _wait_until_up(port: int, timeout: float = 30):
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            sleep(0.1)
+    raise TimeoutError(f'gunicorn didn\'t start on port {port}')
+
+def store_photos(directory: str, photos: int, size: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    store = AttachmentStore(directory)
+    return [store.save(io.BytesIO(b'\xff\xd8\xff\xe0' + rng.randbytes(size - 4)), size)[0] for _ in range(photos)]
+
+def measure(port: int, digests: list[str], requests: int, concurrency: int, range_size: int | None, seed: int) -> dict[str, float]:
+    rng = random.Random(seed)
+    paths = [f'/attachment/{rng.choice(digests)}' for _ in range(requests)]
+    headers = {} if range_size is None else {'Range': f'bytes=0-{range_size - 1}'}
+    connections = local()
+
+    def fetch(path: str) -> int:
+        conn = getattr(connections, 'conn', None)
+        if conn is None:
+            conn = connections.conn = HTTPConnection('127.0.0.1', port)
+
+        conn.request('GET', path, headers=headers)
+        resp = conn.getresponse()
+        if resp.status not in (200, 206):
+            raise RuntimeError(f'GET {path}: {resp.status}')
+        return len(resp.read())
+
+    start = perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        received = sum(executor.map(fetch, paths))
+    elapsed = perf_counter() - start
+
+    return {
+        'requests_per_s': round(requests / elapsed, 1),
+        'mb_per_s': round(received / elapsed / 1e6, 1)
+    }
+
+def serve(directory: str, digests: list[str], args: argparse.Namespace, sendfile: bool) -> dict[str, dict[str, float]]:
+    port = _free_port()
+    env = {
+        **os.environ,
+        'RECIPE_ATTACHMENT_DIR': directory,
+        'RECIPE_JOBS_WORKERS': '0',
+        'RECIPE_ACCESS_LOG_SAMPLE': '0'
+    }
+    command = [
+        sys.executable, '-m', 'gunicorn',
+        '--bind', f'127.0.0.1:{port}',
+        '--workers', str(args.workers),
+        '--worker-class', 'gthread',
+        '--threads', str(args.concurrency),
+        '--log-level', 'warning',
+        f'recipe.app:create_app("sqlite:///{os.path.join(directory, "attachments.db")}")'
+    ]
+    if not sendfile:
+        command.insert(3, '--no-sendfile')
+
+    server = subprocess.Popen(command, env=env)
+    try:
+        _wait_until_up(port)
+        return {
+            'whole': measure(port, digests, args.requests, args.concurrency, None, args.seed),
+            'range': measure(port, digests, args.requests, args.concurrency, args.range, args.seed)
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.attachments')
+    parser.add_argument('--photos', type=int, default=20)
+    parser.add_argument('--size', type=int, default=1024 * 1024, help='bytes of every photo')
+    parser.add_argument('--range', type=int, default=64 * 1024, help='bytes of the `Range` requests')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+    use_benchmark_secret() # the workers inherit it
+
+    with tempfile.TemporaryDirectory() as directory:
+        init_db(create_engine(f'sqlite:///{os.path.join(directory, "attachments.db")}'))
+        digests = store_photos(directory, args.photos, args.size, args.seed)
+
+        results = {
+            'photos': args.photos,
+            'photo_bytes': args.size,
+            'range_bytes': args.range,
+            'sendfile': serve(directory, digests, args, sendfile=True),
+            'no_sendfile': serve(directory, digests, args, sendfile=False)
+        }
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
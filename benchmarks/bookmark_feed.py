@@ -0,0 +1,111 @@
+"""
+Latency of the bookmark feed (`GET /bookmark`) as a user's bookmarks
+accumulate: the first page, the last page by `page` (offset), and the
+last page by the `after` cursor (keyset).
+
+    python -m benchmarks.bookmark_feed --sizes 10,100,1000,5000
+
+The first page and the keyset pages should stay flat: they only read
+one page of the `(user_id, date_added, recipe_id)` index. The offset
+pages still have to skip over the preceding bookmarks.
+"""
+
+from sqlalchemy import create_engine, delete, insert, select
+
+from recipe.app import create_app
+from recipe.database.models import Authority, BookmarkedRecipe
+from recipe.resources.bookmark import encode_cursor
+from recipe.security import authorize_user
+
+from .dataset import DatasetSize, generate_dataset
+from .run import percentile, use_benchmark_secret
+
+from datetime import datetime, timedelta
+from falcon.testing import TestClient
+from time import perf_counter
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+
+PAGE_SIZE: int = 20
+
+def _add_bookmarks(engine, user_id, recipe_ids, rng: random.Random):
+    now = datetime(2023, 8, 1)
+    with engine.begin() as conn:
+        conn.execute(delete(BookmarkedRecipe.__table__).where(BookmarkedRecipe.user_id == user_id))
+        conn.execute(insert(BookmarkedRecipe.__table__), [
+            {'user_id': user_id, 'recipe_id': recipe_id, 'date_added': now - timedelta(seconds=rng.randint(0, 10 ** 8))}
+            for recipe_id in recipe_ids
+        ])
+
+def _last_page_cursor(engine, user_id, n: int) -> str:
+    # the last bookmark of the next to last page
+    with engine.connect() as conn:
+        date_added, recipe_id = conn.execute(select(BookmarkedRecipe.date_added, BookmarkedRecipe.recipe_id)
+                                             .where(BookmarkedRecipe.user_id == user_id)
+                                             .order_by(BookmarkedRecipe.date_added.desc(), BookmarkedRecipe.recipe_id.desc())
+                                             .offset((math.ceil(n / PAGE_SIZE) - 1) * PAGE_SIZE - 1)
+                                             .limit(1)).one()
+    return encode_cursor(date_added, recipe_id)
+
+def _measure(client: TestClient, token: str, params: dict, requests: int) -> float:
+    headers = {'Authorization': 'Bearer ' + token}
+    client.simulate_get('/bookmark', params=params, headers=headers)
+
+    latencies = []
+    for _ in range(requests):
+        start = perf_counter()
+        resp = client.simulate_get('/bookmark', params=params, headers=headers)
+        latencies.append(perf_counter() - start)
+        assert resp.status_code == 200, resp.text
+
+    return round(percentile(sorted(latencies), 50) * 1000, 3)
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bookmark_feed')
+    parser.add_argument('--sizes', default='10,100,1000,5000', help='bookmarks per user')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+    use_benchmark_secret()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_url = f'sqlite:///{os.path.join(directory, "bookmark_feed.db")}'
+        engine = create_engine(db_url)
+
+        # enough approved recipes (80%) for the largest set of bookmarks
+        dataset = generate_dataset(engine, DatasetSize(users=len(sizes) + 10, recipes=max(sizes) * 3 // 2), args.seed)
+
+        for user_id, size in zip(dataset.user_ids, sizes):
+            _add_bookmarks(engine, user_id, rng.sample(dataset.approved_recipe_ids, size), rng)
+
+        client = TestClient(create_app(db_url))
+
+        results = {}
+        for user_id, size in zip(dataset.user_ids, sizes):
+            token = authorize_user(user_id, Authority.USER)
+            last_page = math.ceil(size / PAGE_SIZE)
+
+            results[str(size)] = {
+                'first_page_p50_ms': _measure(client, token, {'elements': PAGE_SIZE}, args.requests),
+                'last_page_offset_p50_ms': _measure(client, token, {'elements': PAGE_SIZE, 'page': last_page}, args.requests),
+                'last_page_keyset_p50_ms': _measure(
+                    client, token,
+                    {'elements': PAGE_SIZE, 'after': _last_page_cursor(engine, user_id, size)} if last_page > 1 else {'elements': PAGE_SIZE},
+                    args.requests
+                )
+            }
+
+    json.dump({'requests': args.requests, 'bookmarks_per_user': results}, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
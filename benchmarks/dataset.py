@@ -0,0 +1,205 @@
+"""
+Reproducible synthetic dataset for the benchmarks.
+
+Everything is derived from a single seed, so two runs with the same
+sizes and seed produce identical databases (ids included).
+"""
+
+from sqlalchemy import Engine, insert
+
+from recipe.database.models import (
+    OrmBase, User, UserPassword, Recipe, Tag, RecipesTags,
+    BookmarkedRecipe, RatedRecipe, Authority, Status
+)
+from recipe.seed import random_markdown
+from recipe.affinity import rebuild_affinity
+from recipe.render import backfill_rendered
+from recipe.duplicates import backfill_duplicates
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from itertools import accumulate
+from uuid import UUID
+import bisect
+import random
+
+import bcrypt
+
+BENCHMARK_PASSWORD: str = 'benchmark-password'
+INSERT_CHUNK_SIZE: int = 5000
+
+TAG_WORDS = (
+    'dessert breakfast lunch dinner vegan vegetarian soup salad pasta baking '
+    'grill quick easy spicy sweet healthy italian french asian mexican russian '
+    'holiday party kids budget seafood meat chicken cake bread snack drink'
+).split()
+
+@dataclass
+class DatasetSize:
+    users: int = 200
+    recipes: int = 2000
+    tags: int = 150
+    ratings_per_user: int = 20
+    bookmarks_per_user: int = 15
+    tags_per_recipe: int = 3
+    zipf_exponent: float = 1.1
+
+@dataclass
+class Dataset:
+    """Ids of the generated entities, used by the scenarios to build requests"""
+
+    seed: int
+    size: DatasetSize
+    user_ids: list[UUID] = field(default_factory=list)
+    usernames: list[str] = field(default_factory=list)
+    approved_recipe_ids: list[UUID] = field(default_factory=list)
+    pending_recipe_ids: list[UUID] = field(default_factory=list)
+    tag_texts: list[str] = field(default_factory=list)
+
+class ZipfSampler:
+    """Samples ranks `0..n-1` with probability proportional to `1 / (rank + 1) ** s`"""
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        self.cumulative = list(accumulate(1 / (rank + 1) ** s for rank in range(n)))
+
+    def sample(self) -> int:
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+    def sample_distinct(self, k: int) -> list[int]:
+        k = min(k, len(self.cumulative))
+        chosen: set[int] = set()
+        while len(chosen) < k:
+            chosen.add(self.sample())
+        return list(chosen)
+
+def random_uuid(rng: random.Random) -> UUID:
+    return UUID(int=rng.getrandbits(128), version=4)
+
+def _insert_chunked(engine: Engine, table, rows: list[dict]):
+    with engine.begin() as conn:
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            conn.execute(insert(table), rows[start:start + INSERT_CHUNK_SIZE])
+
+def generate_dataset(engine: Engine, size: DatasetSize, seed: int, render: bool = True, index_duplicates: bool = True) -> Dataset:
+    """
+    Drop and re-create all tables of the given database and fill it with
+    synthetic data. Never point this at a database you care about.
+    With `render`, the Markdown of the recipes is rendered too, and with
+    `index_duplicates`, the recipes are indexed for the near-duplicates.
+    """
+
+    rng = random.Random(seed)
+    dataset = Dataset(seed=seed, size=size)
+
+    OrmBase.metadata.drop_all(engine)
+    OrmBase.metadata.create_all(engine)
+
+    now = datetime(2023, 8, 1)
+
+    # Users. All of them share one password, so it is hashed only once.
+    hashed_password = bcrypt.hashpw(BENCHMARK_PASSWORD.encode('utf-8'), bcrypt.gensalt())
+
+    users, passwords = [], []
+    for i in range(size.users):
+        user_id = random_uuid(rng)
+        username = f'bench_user_{i}'
+        users.append({
+            'id': user_id,
+            'username': username,
+            'first_name': 'Bench',
+            'last_name': f'User {i}',
+            'date_registered': now - timedelta(days=rng.randint(0, 1000)),
+            'role': Authority.MODERATOR | Authority.USER if i == 0 else Authority.USER
+        })
+        passwords.append({'user_id': user_id, 'hashed_password': hashed_password})
+        dataset.user_ids.append(user_id)
+        dataset.usernames.append(username)
+
+    _insert_chunked(engine, User.__table__, users)
+    _insert_chunked(engine, UserPassword.__table__, passwords)
+
+    # Tags follow a Zipfian distribution: a few are on most recipes
+    tags = []
+    for i in range(size.tags):
+        text = TAG_WORDS[i % len(TAG_WORDS)] + ('' if i < len(TAG_WORDS) else str(i // len(TAG_WORDS)))
+        tags.append({'id': random_uuid(rng), 'text': text})
+        dataset.tag_texts.append(text)
+
+    _insert_chunked(engine, Tag.__table__, tags)
+
+    # Recipes
+    recipes = []
+    for i in range(size.recipes):
+        recipe_id = random_uuid(rng)
+        created = now - timedelta(minutes=rng.randint(0, 60 * 24 * 1000))
+        roll = rng.random()
+        status = Status.APPROVED if roll < 0.8 else Status.PENDING if roll < 0.95 else Status.DENIED
+
+        recipes.append({
+            'id': recipe_id,
+            'source': random_markdown(rng),
+            'author_id': rng.choice(dataset.user_ids),
+            'date_created': created,
+            'date_edited': created,
+            'rating': 0,
+            'status': status
+        })
+
+        if status == Status.APPROVED:
+            dataset.approved_recipe_ids.append(recipe_id)
+        elif status == Status.PENDING:
+            dataset.pending_recipe_ids.append(recipe_id)
+
+    tag_sampler = ZipfSampler(size.tags, size.zipf_exponent, rng)
+    recipes_tags = []
+    for recipe in recipes:
+        for tag_index in tag_sampler.sample_distinct(rng.randint(1, size.tags_per_recipe * 2 - 1)):
+            recipes_tags.append({'recipe_id': recipe['id'], 'tag_id': tags[tag_index]['id']})
+
+    # Ratings and bookmarks: popular recipes attract most of the activity
+    popularity = ZipfSampler(len(dataset.approved_recipe_ids), size.zipf_exponent, rng)
+
+    ratings = []
+    scores: dict[UUID, list[float]] = {}
+    for user_id in dataset.user_ids:
+        for recipe_index in popularity.sample_distinct(size.ratings_per_user):
+            recipe_id = dataset.approved_recipe_ids[recipe_index]
+            score = float(rng.randint(1, 5))
+            ratings.append({'user_id': user_id, 'recipe_id': recipe_id, 'score': score})
+            scores.setdefault(recipe_id, []).append(score)
+
+    bookmarks = []
+    for user_id in dataset.user_ids:
+        for recipe_index in popularity.sample_distinct(size.bookmarks_per_user):
+            bookmarks.append({
+                'user_id': user_id,
+                'recipe_id': dataset.approved_recipe_ids[recipe_index],
+                'date_added': now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            })
+
+    bookmark_counts: dict[UUID, int] = {}
+    for bookmark in bookmarks:
+        bookmark_counts[bookmark['recipe_id']] = bookmark_counts.get(bookmark['recipe_id'], 0) + 1
+
+    for recipe in recipes:
+        recipe_scores = scores.get(recipe['id'])
+        if recipe_scores:
+            recipe['rating'] = sum(recipe_scores) / len(recipe_scores)
+        recipe['rating_count'] = len(recipe_scores or ())
+        recipe['bookmark_count'] = bookmark_counts.get(recipe['id'], 0)
+
+    _insert_chunked(engine, Recipe.__table__, recipes)
+    _insert_chunked(engine, RecipesTags.__table__, recipes_tags)
+    _insert_chunked(engine, RatedRecipe.__table__, ratings)
+    _insert_chunked(engine, BookmarkedRecipe.__table__, bookmarks)
+
+    rebuild_affinity(engine)
+
+    if render:
+        backfill_rendered(engine)
+
+    if index_duplicates:
+        backfill_duplicates(engine)
+
+    return dataset
@@ -0,0 +1,98 @@
+"""Ways of sending a `BenchmarkRequest` to the application"""
+
+from falcon.testing import TestClient
+
+from .scenarios import BenchmarkRequest
+
+from http.client import HTTPConnection
+from threading import Thread, local
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+from socketserver import ThreadingMixIn
+import json
+
+def _headers(request: BenchmarkRequest) -> dict[str, str]:
+    headers = {}
+    if request.token is not None:
+        headers['Authorization'] = 'Bearer ' + request.token
+    if request.json is not None:
+        headers['Content-Type'] = 'application/json'
+    return headers
+
+class InProcessDriver:
+    """Calls the WSGI application directly, without any networking"""
+
+    def __init__(self, app):
+        self.client = TestClient(app)
+
+    def send(self, request: BenchmarkRequest) -> int:
+        resp = self.client.simulate_request(
+            request.method,
+            request.path,
+            headers=_headers(request),
+            json=request.json
+        )
+        return resp.status_code
+
+    def close(self):
+        pass
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class HTTPDriver:
+    """
+    Sends real HTTP requests. Either to the given `url` of an already
+    running server (e.g. gunicorn), or to a local `wsgiref` server
+    started for the application.
+    """
+
+    def __init__(self, app=None, url: str | None = None):
+        self.server = None
+
+        if url is None:
+            self.server = make_server('127.0.0.1', 0, app, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+            Thread(target=self.server.serve_forever, daemon=True).start()
+            self.host, self.port = self.server.server_address
+        else:
+            host_port = url.split('://', 1)[-1].rstrip('/')
+            self.host, _, port = host_port.partition(':')
+            self.port = int(port or 80)
+
+        self._local = local()
+
+    def _connection(self) -> HTTPConnection:
+        # one connection per benchmark thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = HTTPConnection(self.host, self.port)
+            self._local.conn = conn
+        return conn
+
+    def send(self, request: BenchmarkRequest) -> int:
+        body = json.dumps(request.json).encode('utf-8') if request.json is not None else None
+        conn = self._connection()
+
+        try:
+            conn.request(request.method, request.path, body=body, headers=_headers(request))
+            resp = conn.getresponse()
+            resp.read()
+        except (ConnectionError, OSError):
+            # the server closed the connection (`wsgiref` speaks HTTP/1.0), reconnect once
+            conn.close()
+            conn.request(request.method, request.path, body=body, headers=_headers(request))
+            resp = conn.getresponse()
+            resp.read()
+
+        if resp.getheader('Connection', '').lower() == 'close' or resp.version == 10:
+            conn.close()
+
+        return resp.status
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
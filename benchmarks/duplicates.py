@@ -0,0 +1,105 @@
+"""
+Cost of the near-duplicate detection (`recipe.duplicates`) against the
+catalog size, on the synthetic dataset.
+
+    python -m benchmarks.duplicates --sizes 1000,5000,20000 --reposts 100
+
+For every size, reports the indexing throughput of the backfill, the time
+to find the near-duplicates of a page of `--page` recipes, and how many
+of `--reposts` reposts of random recipes, with a few words changed, are
+found, along with the false positives among the original recipes.
+"""
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from recipe.database.models import Recipe
+from recipe.duplicates import index_recipe, near_duplicates, backfill_duplicates
+from recipe.render import source_hash
+from recipe.seed import WORDS
+from recipe.validation import RecipeCreate
+
+from .dataset import DatasetSize, generate_dataset
+
+from time import perf_counter
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+def repost(source: str, rng: random.Random, edits: int) -> str:
+    """`source` with `edits` words replaced"""
+    words = source.split(' ')
+    for _ in range(edits):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return ' '.join(words)
+
+def measure(directory: str, size: int, args: argparse.Namespace) -> dict[str, float]:
+    rng = random.Random(args.seed)
+    engine = create_engine(f'sqlite:///{os.path.join(directory, f"duplicates_{size}.db")}')
+    generate_dataset(engine, DatasetSize(users=max(size // 10, 10), recipes=size), args.seed, render=False, index_duplicates=False)
+
+    start = perf_counter()
+    backfill_duplicates(engine)
+    index_s = perf_counter() - start
+
+    with Session(engine) as db:
+        recipes = db.execute(select(Recipe.id, Recipe.source, Recipe.author_id)).all()
+
+        originals = rng.sample(recipes, args.reposts)
+        reposts = {}
+        for original in originals:
+            recipe = Recipe(RecipeCreate(source=repost(original.source, rng, args.edits), author_id=original.author_id))
+            db.add(recipe)
+            db.flush()
+
+            index_recipe(db, recipe.id, recipe.source, source_hash(recipe.source))
+            reposts[recipe.id] = original.id
+        db.commit()
+
+        # the moderation queue, a page at a time
+        repost_ids = list(reposts)
+        query_ms = []
+        found = 0
+        for page in range(0, len(repost_ids), args.page):
+            start = perf_counter()
+            duplicates = near_duplicates(db, repost_ids[page:page + args.page])
+            query_ms.append((perf_counter() - start) * 1000)
+
+            found += sum(reposts[repost_id] in {duplicate['id'] for duplicate in found_duplicates}
+                         for repost_id, found_duplicates in duplicates.items())
+
+        sample = [recipe.id for recipe in rng.sample(recipes, min(args.page, len(recipes)))]
+        false_positives = sum(
+            len([duplicate for duplicate in found_duplicates if duplicate['id'] not in reposts])
+            for found_duplicates in near_duplicates(db, sample).values()
+        )
+
+    engine.dispose()
+    return {
+        'index_recipes_per_s': round(size / index_s, 1),
+        'page_query_ms': round(sorted(query_ms)[len(query_ms) // 2], 3),
+        'reposts_found': f'{found}/{len(reposts)}',
+        'false_positives_per_page': false_positives
+    }
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.duplicates')
+    parser.add_argument('--sizes', default='1000,5000,20000', help='recipes in the catalog')
+    parser.add_argument('--reposts', type=int, default=100)
+    parser.add_argument('--edits', type=int, default=3, help='words replaced in a repost')
+    parser.add_argument('--page', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {str(size): measure(directory, size, args) for size in [int(size) for size in args.sizes.split(',')]}
+
+    json.dump({'page': args.page, 'edits': args.edits, 'recipes': results}, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
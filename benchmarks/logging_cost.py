@@ -0,0 +1,101 @@
+"""
+Per-request logging cost on the request thread, in the old mode
+(`logging.basicConfig(level=logging.DEBUG)`, synchronous writes) and
+in the new one (`configure_logging`, queue + listener thread).
+
+    python -m benchmarks.logging_cost --requests 20000
+
+Both modes write into a real file, so the I/O is included. For the new
+mode, the time the listener needs to drain the queue afterwards is
+reported separately: it is spent off the request path.
+"""
+
+from recipe.log import configure_logging, flush_logging, request_id, request_route, access_logger
+
+from time import perf_counter
+from uuid import uuid4
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+
+def _log_request(i: int, access_log: bool = True):
+    """What a typical request logs: a debug line, and the access log line"""
+    logging.debug(f'Loading the recipes page {i % 5 + 1}')
+    if access_log:
+        access_logger.info(f'GET /recipe?page={i % 5 + 1} 200', extra={
+            'method': 'GET',
+            'path': '/recipe',
+            'status': 200,
+            'duration_ms': 12.5
+        })
+
+def _reset_root():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+def measure_old(path: str, requests: int) -> dict[str, float]:
+    _reset_root()
+    logging.basicConfig(level=logging.DEBUG, filename=path)
+
+    start = perf_counter()
+    for i in range(requests):
+        _log_request(i)
+    elapsed = perf_counter() - start
+
+    _reset_root()
+    return {'per_request_us': round(elapsed / requests * 1e6, 3)}
+
+def measure_new(path: str, requests: int, fmt: str, sample_rate: float) -> dict[str, float]:
+    _reset_root()
+
+    with open(path, 'w') as stream:
+        configure_logging(level='DEBUG', fmt=fmt, stream=stream)
+        sample_every = max(round(1 / sample_rate), 1)
+
+        start = perf_counter()
+        for i in range(requests):
+            tokens = request_id.set(uuid4().hex), request_route.set('/recipe')
+            # the access log line is sampled, the rest is not
+            _log_request(i, access_log=i % sample_every == 0)
+            request_route.reset(tokens[1])
+            request_id.reset(tokens[0])
+        elapsed = perf_counter() - start
+
+        drain_start = perf_counter()
+        flush_logging()
+        drain = perf_counter() - drain_start
+
+    _reset_root()
+    return {
+        'per_request_us': round(elapsed / requests * 1e6, 3),
+        'listener_drain_ms': round(drain * 1000, 3)
+    }
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.logging_cost')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--access-log-sample', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'log')
+
+        results = {
+            'requests': args.requests,
+            'old_sync_debug': measure_old(path, args.requests),
+            'new_queue_json': measure_new(path, args.requests, 'json', 1.0),
+            'new_queue_text': measure_new(path, args.requests, 'text', 1.0),
+            f'new_queue_json_sampled_{args.access_log_sample}': measure_new(path, args.requests, 'json', args.access_log_sample)
+        }
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
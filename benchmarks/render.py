@@ -0,0 +1,111 @@
+"""
+Throughput of the Markdown rendering (`recipe.render`) on the synthetic
+recipes, and what it saves when a page is served.
+
+    python -m benchmarks.render --recipes 2000 --page 50
+
+Reports the Markdown-to-HTML and the sanitizing steps separately, the
+throughput of the backfill with one and with `--workers` processes, and
+the cost of a page of `--page` recipes rendered on the fly against the
+stored HTML read by hash.
+"""
+
+from sqlalchemy import create_engine, select
+
+from recipe.database.models import Recipe, RenderedSource
+from recipe.render import markdown_to_html, sanitize_html, render_markdown, backfill_rendered
+from recipe.seed import random_markdown
+
+from .dataset import DatasetSize, generate_dataset
+
+from time import perf_counter
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+def _timed(function, items: list) -> tuple[list, float]:
+    start = perf_counter()
+    results = [function(item) for item in items]
+    return results, perf_counter() - start
+
+def _throughput(count: int, size: int, seconds: float) -> dict[str, float]:
+    return {
+        'recipes_per_s': round(count / seconds, 1),
+        'mb_per_s': round(size / seconds / 1e6, 2),
+        'per_recipe_ms': round(seconds / count * 1000, 3)
+    }
+
+def measure_render(sources: list[str]) -> dict[str, dict[str, float]]:
+    size = sum(len(source.encode('utf-8')) for source in sources)
+
+    html, markdown_s = _timed(markdown_to_html, sources)
+    _, sanitize_s = _timed(sanitize_html, html)
+    _, total_s = _timed(render_markdown, sources)
+
+    return {
+        'markdown': _throughput(len(sources), size, markdown_s),
+        'sanitize': _throughput(len(sources), size, sanitize_s),
+        'render_markdown': _throughput(len(sources), size, total_s)
+    }
+
+def measure_backfill(directory: str, recipes: int, workers: int, seed: int) -> dict[str, float]:
+    engine = create_engine(f'sqlite:///{os.path.join(directory, f"render_{workers}.db")}')
+    generate_dataset(engine, DatasetSize(users=max(recipes // 10, 10), recipes=recipes), seed, render=False)
+
+    start = perf_counter()
+    counts = backfill_rendered(engine, workers=workers)
+    elapsed = perf_counter() - start
+
+    engine.dispose()
+    return {'rendered': counts['rendered'], 'seconds': round(elapsed, 3), 'recipes_per_s': round(counts['recipes'] / elapsed, 1)}
+
+def measure_page(directory: str, page: int, seed: int) -> dict[str, float]:
+    """A page of recipes: rendered on the fly against the stored HTML"""
+    engine = create_engine(f'sqlite:///{os.path.join(directory, "render_page.db")}')
+    generate_dataset(engine, DatasetSize(users=10, recipes=page * 4), seed)
+
+    with engine.connect() as conn:
+        rows = conn.execute(select(Recipe.source, Recipe.source_hash).limit(page)).all()
+
+        _, on_the_fly = _timed(render_markdown, [row.source for row in rows])
+
+        start = perf_counter()
+        conn.execute(select(RenderedSource.source_hash, RenderedSource.html)
+                     .where(RenderedSource.source_hash.in_([row.source_hash for row in rows]))).all()
+        stored = perf_counter() - start
+
+    engine.dispose()
+    return {'recipes': page, 'on_the_fly_ms': round(on_the_fly * 1000, 3), 'stored_ms': round(stored * 1000, 3)}
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.render')
+    parser.add_argument('--recipes', type=int, default=2000)
+    parser.add_argument('--page', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes of the parallel backfill')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    sources = [random_markdown(rng) for _ in range(args.recipes)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {
+            'recipes': args.recipes,
+            'average_source_bytes': round(sum(len(source.encode('utf-8')) for source in sources) / len(sources)),
+            'render': measure_render(sources),
+            'backfill': {
+                '1_worker': measure_backfill(directory, args.recipes, 1, args.seed),
+                f'{args.workers}_workers': measure_backfill(directory, args.recipes, args.workers, args.seed)
+            },
+            'page': measure_page(directory, args.page, args.seed)
+        }
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,223 @@
+"""
+Runs every scenario against a freshly generated dataset and reports
+latency percentiles and throughput as JSON.
+
+    python -m benchmarks.run --db-url sqlite:///db/benchmark.db --output results.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+
+With `--baseline`, the results are compared against a previously saved
+run and the process exits with a non-zero code on regressions.
+"""
+
+from sqlalchemy import create_engine
+
+from recipe.app import create_app
+
+from .dataset import DatasetSize, generate_dataset
+from .scenarios import SCENARIOS, Scenario, new_context, Context
+from .drivers import InProcessDriver, HTTPDriver
+from .startup import measure_startup, compare_startup
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import perf_counter
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+
+DEFAULT_DB_URL: str = 'sqlite:///db/benchmark.db'
+BENCHMARK_SECRET: str = 'benchmark-secret-benchmark-secret'
+
+def use_benchmark_secret():
+    """`create_app` and the tokens minted by the scenarios need a secret, unless one is already set"""
+    os.environ.setdefault('RECIPE_APP_SECRET', BENCHMARK_SECRET)
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if len(sorted_values) == 0:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0
+    }
+
+def run_scenario(scenario: Scenario, ctx: Context, driver, requests: int, warmup: int, concurrency: int, seed: int) -> dict[str, float]:
+    rng = random.Random(f'{seed}:{scenario.name}')
+    batch = [scenario.build(ctx, rng) for _ in range(warmup + requests)]
+
+    for request in batch[:warmup]:
+        driver.send(request)
+
+    def timed(request) -> tuple[float, int]:
+        start = perf_counter()
+        status = driver.send(request)
+        return perf_counter() - start, status
+
+    start = perf_counter()
+    if concurrency == 1:
+        results = [timed(request) for request in batch[warmup:]]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(timed, batch[warmup:]))
+    elapsed = perf_counter() - start
+
+    return summarize(
+        [latency for latency, _ in results],
+        sum(1 for _, status in results if status >= 500),
+        elapsed
+    )
+
+def compare(results: dict, baseline: dict, max_latency_regression: float, max_throughput_regression: float) -> list[str]:
+    """Returns human-readable descriptions of the regressions, if any"""
+    regressions = []
+
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+
+        if current['errors'] > previous['errors']:
+            regressions.append(f'{name}: {current["errors"]} server errors (baseline: {previous["errors"]})')
+
+        for key in ('p95_ms', 'p99_ms'):
+            if previous[key] > 0 and current[key] > previous[key] * (1 + max_latency_regression):
+                regressions.append(f'{name}: {key} {current[key]} > {previous[key]} (+{max_latency_regression:.0%} allowed)')
+
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 - max_throughput_regression):
+            regressions.append(f'{name}: throughput {current["throughput_rps"]} < {previous["throughput_rps"]} (-{max_throughput_regression:.0%} allowed)')
+
+    return regressions
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    size = DatasetSize()
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description='Load benchmarks for the recipe platform.')
+
+    parser.add_argument('--db-url', default=DEFAULT_DB_URL, help='database to run against. ALL ITS TABLES ARE DROPPED AND RE-CREATED')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--users', type=int, default=size.users)
+    parser.add_argument('--recipes', type=int, default=size.recipes)
+    parser.add_argument('--tags', type=int, default=size.tags)
+    parser.add_argument('--ratings-per-user', type=int, default=size.ratings_per_user)
+    parser.add_argument('--bookmarks-per-user', type=int, default=size.bookmarks_per_user)
+
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--scenario', action='append', help='run only the given scenario (may be repeated)')
+    parser.add_argument('--startup-runs', type=int, default=5, help='fresh processes started to measure the startup time, 0 to skip')
+
+    parser.add_argument('--http', action='store_true', help='send real HTTP requests to a local server instead of calling the app in-process')
+    parser.add_argument('--url', help='send real HTTP requests to an already running server using the same database')
+
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results against this JSON file')
+    parser.add_argument('--max-latency-regression', type=float, default=0.25, help='allowed relative growth of p95/p99')
+    parser.add_argument('--max-throughput-regression', type=float, default=0.2, help='allowed relative drop of throughput')
+
+    return parser.parse_args(argv)
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+    use_benchmark_secret()
+
+    size = DatasetSize(
+        users=args.users,
+        recipes=args.recipes,
+        tags=args.tags,
+        ratings_per_user=args.ratings_per_user,
+        bookmarks_per_user=args.bookmarks_per_user
+    )
+
+    if args.db_url.startswith('sqlite:///'):
+        os.makedirs(os.path.dirname(args.db_url[len('sqlite:///'):]) or '.', exist_ok=True)
+
+    engine = create_engine(args.db_url)
+    dataset = generate_dataset(engine, size, args.seed)
+    engine.dispose()
+
+    app = create_app(args.db_url)
+    ctx = new_context(dataset)
+
+    if args.url is not None:
+        driver = HTTPDriver(url=args.url)
+    elif args.http:
+        driver = HTTPDriver(app)
+    else:
+        driver = InProcessDriver(app)
+
+    scenarios = [s for s in SCENARIOS if args.scenario is None or s.name in args.scenario]
+
+    results = {
+        'meta': {
+            'date': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': engine.dialect.name,
+            'driver': 'http' if args.http or args.url else 'in-process',
+            'seed': args.seed,
+            'dataset': vars(size),
+            'requests': args.requests,
+            'concurrency': args.concurrency
+        },
+        'scenarios': {}
+    }
+
+    if args.startup_runs > 0:
+        startup = measure_startup(args.db_url, args.startup_runs)
+        results['startup'] = startup
+        print(
+            f'{"startup":<20} import {startup["import_ms"]:>9.2f} ms   '
+            f'first response {startup["time_to_first_response_ms"]:>9.2f} ms',
+            file=sys.stderr
+        )
+
+    try:
+        for scenario in scenarios:
+            summary = run_scenario(scenario, ctx, driver, args.requests, args.warmup, args.concurrency, args.seed)
+            results['scenarios'][scenario.name] = summary
+            print(
+                f'{scenario.name:<20} p50 {summary["p50_ms"]:>9.2f} ms   p95 {summary["p95_ms"]:>9.2f} ms   '
+                f'p99 {summary["p99_ms"]:>9.2f} ms   {summary["throughput_rps"]:>9.1f} req/s   errors {summary["errors"]}',
+                file=sys.stderr
+            )
+    finally:
+        driver.close()
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.max_latency_regression, args.max_throughput_regression)
+        if 'startup' in results and 'startup' in baseline:
+            regressions += compare_startup(results['startup'], baseline['startup'], args.max_latency_regression)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+
+        if len(regressions) > 0:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,120 @@
+"""
+Scripted request scenarios, one per route registered by `create_app`.
+
+A scenario only describes which request to send. The same scenarios are
+replayed either in-process through `falcon.testing.TestClient` or over
+real HTTP (see `drivers.py`).
+"""
+
+from recipe.security import authorize_user, get_admin_token
+from recipe.database.models import Authority, Status
+
+from .dataset import Dataset, BENCHMARK_PASSWORD
+
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Any, Callable
+import random
+
+@dataclass
+class BenchmarkRequest:
+    method: str
+    path: str # may contain a query string
+    token: str | None = None
+    json: dict[str, Any] | None = None
+
+@dataclass
+class Context:
+    dataset: Dataset
+    user_tokens: list[str]
+    admin_token: str
+    registrations: count = field(default_factory=count)
+
+@dataclass
+class Scenario:
+    name: str
+    build: Callable[[Context, random.Random], BenchmarkRequest]
+
+def new_context(dataset: Dataset) -> Context:
+    # Tokens are minted directly: logging in is a scenario of its own
+    return Context(
+        dataset=dataset,
+        user_tokens=[authorize_user(user_id, Authority.USER) for user_id in dataset.user_ids],
+        admin_token=get_admin_token()
+    )
+
+def _user(ctx: Context, rng: random.Random) -> tuple[str, str]:
+    i = rng.randrange(len(ctx.dataset.user_ids))
+    return str(ctx.dataset.user_ids[i]), ctx.user_tokens[i]
+
+def _approved(ctx: Context, rng: random.Random) -> str:
+    return str(rng.choice(ctx.dataset.approved_recipe_ids))
+
+def _page(rng: random.Random) -> str:
+    return f'page={rng.randint(1, 5)}&elements=20'
+
+def _ids(ids: list, rng: random.Random, k: int = 20) -> str:
+    return ','.join(str(_id) for _id in rng.sample(ids, k=min(k, len(ids))))
+
+def _search(ctx: Context, rng: random.Random) -> BenchmarkRequest:
+    # popular tags come first in `tag_texts`, so they are searched more often
+    tags = rng.sample(ctx.dataset.tag_texts[:20], k=rng.randint(1, 2))
+    return BenchmarkRequest('GET', f'/recipe/search?q={"+".join(tags)}&{_page(rng)}', _user(ctx, rng)[1])
+
+def _register(ctx: Context, rng: random.Random) -> BenchmarkRequest:
+    n = next(ctx.registrations)
+    return BenchmarkRequest('POST', '/auth/register', json={
+        'username': f'bench_new_user_{ctx.dataset.seed}_{rng.getrandbits(32)}_{n}',
+        'password': BENCHMARK_PASSWORD,
+        'first_name': 'New',
+        'last_name': 'User'
+    })
+
+SCENARIOS: list[Scenario] = [
+    # Users
+    Scenario('user_list', lambda ctx, rng: BenchmarkRequest('GET', f'/user?{_page(rng)}', _user(ctx, rng)[1])),
+    Scenario('user_by_id', lambda ctx, rng: BenchmarkRequest('GET', f'/user/{_user(ctx, rng)[0]}', _user(ctx, rng)[1])),
+    Scenario('user_batch', lambda ctx, rng: BenchmarkRequest('GET', f'/user/batch?ids={_ids(ctx.dataset.user_ids, rng)}', _user(ctx, rng)[1])),
+    Scenario('user_my', lambda ctx, rng: BenchmarkRequest('GET', '/user/my', _user(ctx, rng)[1])),
+    Scenario('user_promote', lambda ctx, rng: BenchmarkRequest('PATCH', f'/user/{_user(ctx, rng)[0]}', ctx.admin_token)),
+
+    # Recipes
+    Scenario('recipe_feed', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe?{_page(rng)}', _user(ctx, rng)[1])),
+    Scenario('recipe_feed_sorted', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe?{_page(rng)}&sort={rng.choice(("newest", "bookmarks", "ratings"))}', _user(ctx, rng)[1])),
+    Scenario('recipe_feed_html', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe?{_page(rng)}&format=html', _user(ctx, rng)[1])),
+    Scenario('recipe_feed_authors', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe?{_page(rng)}&include=author', _user(ctx, rng)[1])),
+    Scenario('recipe_for_you', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe/for-you?{_page(rng)}', _user(ctx, rng)[1])),
+    Scenario('recipe_create', lambda ctx, rng: BenchmarkRequest('POST', '/recipe', _user(ctx, rng)[1], {
+        'source': '# Benchmark recipe\n\n## Steps\n1. Mix everything.',
+        'tags': rng.sample(ctx.dataset.tag_texts[:20], k=2)
+    })),
+    Scenario('recipe_by_id', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe/{_approved(ctx, rng)}', _user(ctx, rng)[1])),
+    Scenario('recipe_batch', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe/batch?ids={_ids(ctx.dataset.approved_recipe_ids, rng)}', _user(ctx, rng)[1])),
+    Scenario('recipe_by_id_html', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe/{_approved(ctx, rng)}?format=html', _user(ctx, rng)[1])),
+    Scenario('recipe_moderate', lambda ctx, rng: BenchmarkRequest('PATCH', f'/recipe/{_approved(ctx, rng)}', ctx.admin_token, {
+        'status': Status.APPROVED
+    })),
+    Scenario('recipe_search', _search),
+    Scenario('recipe_my', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe/my?{_page(rng)}', _user(ctx, rng)[1])),
+    Scenario('recipe_pending', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe/pending?{_page(rng)}', ctx.admin_token)),
+    Scenario('recipe_denied', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe/deined?{_page(rng)}', ctx.admin_token)),
+
+    # Ratings and bookmarks
+    Scenario('rating_get', lambda ctx, rng: BenchmarkRequest('GET', f'/recipe/{_approved(ctx, rng)}/rating', _user(ctx, rng)[1])),
+    Scenario('rating_post', lambda ctx, rng: BenchmarkRequest('POST', f'/recipe/{_approved(ctx, rng)}/rating', _user(ctx, rng)[1], {
+        'score': rng.randint(1, 5)
+    })),
+    Scenario('bookmark_post', lambda ctx, rng: BenchmarkRequest('POST', f'/recipe/{_approved(ctx, rng)}/bookmark', _user(ctx, rng)[1])),
+    Scenario('bookmark_delete', lambda ctx, rng: BenchmarkRequest('DELETE', f'/recipe/{_approved(ctx, rng)}/bookmark', _user(ctx, rng)[1])),
+    Scenario('bookmark_list', lambda ctx, rng: BenchmarkRequest('GET', f'/bookmark?{_page(rng)}', _user(ctx, rng)[1])),
+
+    # Auth
+    Scenario('auth_login', lambda ctx, rng: BenchmarkRequest('POST', '/auth/login', json={
+        'username': rng.choice(ctx.dataset.usernames),
+        'password': BENCHMARK_PASSWORD
+    })),
+    Scenario('auth_register', _register),
+
+    # Service
+    Scenario('metrics', lambda ctx, rng: BenchmarkRequest('GET', '/metrics')),
+]
@@ -0,0 +1,55 @@
+"""
+Runtime of the similar recipes job (`recipe.similar`) against the
+catalog size, on the synthetic dataset with one user per ten recipes.
+
+    python -m benchmarks.similar_job --sizes 1000,5000,20000
+
+Reports the time spent loading the interactions, computing the
+neighbours and writing them, and the number of stored neighbours.
+"""
+
+from sqlalchemy import create_engine, func, select
+
+from recipe.database.models import RecipeNeighbour
+from recipe.similar import compute_similar
+
+from .dataset import DatasetSize, generate_dataset
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.similar_job')
+    parser.add_argument('--sizes', default='1000,5000,20000', help='recipes in the catalog')
+    parser.add_argument('--neighbours', type=int, default=20)
+    parser.add_argument('--max-memory-mb', type=float, default=256)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            engine = create_engine(f'sqlite:///{os.path.join(directory, f"similar_{size}.db")}')
+            generate_dataset(engine, DatasetSize(users=max(size // 10, 10), recipes=size), args.seed)
+
+            timings = compute_similar(engine, args.neighbours, args.max_memory_mb)
+
+            with engine.connect() as conn:
+                rows = conn.execute(select(func.count()).select_from(RecipeNeighbour)).scalar()
+
+            results[str(size)] = {
+                **{f'{phase}_s': round(seconds, 3) for phase, seconds in timings.items()},
+                'total_s': round(sum(timings.values()), 3),
+                'neighbour_rows': rows
+            }
+            engine.dispose()
+
+    json.dump({'neighbours': args.neighbours, 'max_memory_mb': args.max_memory_mb, 'recipes': results}, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,110 @@
+"""
+Startup time: how long `import recipe.app` takes (`python -X importtime`)
+and how long a fresh interpreter needs to serve its first response.
+
+Every measurement runs in a new process, so nothing is cached in memory.
+"""
+
+from statistics import median
+from time import time
+import json
+import os
+import subprocess
+import sys
+
+FIRST_RESPONSE_SCRIPT = '''
+import json, sys, time
+from uuid import uuid4
+
+start = time.perf_counter()
+import recipe.app
+imported = time.perf_counter()
+
+app = recipe.app.create_app(sys.argv[1])
+created = time.perf_counter()
+
+from falcon.testing import TestClient
+from recipe.security import authorize_user
+from recipe.database.models import Authority
+
+resp = TestClient(app).simulate_get('/recipe', headers={'Authorization': 'Bearer ' + authorize_user(uuid4(), Authority.USER)})
+responded = time.perf_counter()
+
+print(json.dumps({
+    'status': resp.status_code,
+    'responded_at': time.time(),
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (responded - created) * 1000
+}))
+'''
+
+def _repo_root() -> str:
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_times(module: str = 'recipe.app') -> dict[str, float]:
+    """
+    Cumulative import time of every module imported by `module`, in ms.
+    Nested imports keep their indentation, two spaces per level.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=_repo_root(), env=os.environ, check=True
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name[1:].rstrip()] = int(cumulative) / 1000
+
+    return times
+
+def direct_imports(times: dict[str, float], module: str) -> dict[str, float]:
+    """The modules imported directly by the top-level `module`, for diagnosis"""
+    names = list(times)
+    direct = {}
+
+    # `-X importtime` reports the nested imports before the module itself
+    for name in reversed(names[:names.index(module)]):
+        if not name.startswith('  '):
+            break
+        if not name.startswith('    '):
+            direct[name.strip()] = times[name]
+
+    return direct
+
+def first_response(db_url: str) -> dict[str, float]:
+    started_at = time()
+    result = subprocess.run(
+        [sys.executable, '-c', FIRST_RESPONSE_SCRIPT, db_url],
+        capture_output=True, text=True, cwd=_repo_root(), env=os.environ, check=True
+    )
+
+    measurement = json.loads(result.stdout.strip().splitlines()[-1])
+    measurement['time_to_first_response_ms'] = (measurement.pop('responded_at') - started_at) * 1000
+    return measurement
+
+def measure_startup(db_url: str, runs: int = 5) -> dict:
+    imports = [import_times() for _ in range(runs)]
+    responses = [first_response(db_url) for _ in range(runs)]
+
+    heaviest = sorted(direct_imports(imports[-1], 'recipe.app').items(), key=lambda item: item[1], reverse=True)[:10]
+
+    return {
+        'runs': runs,
+        'import_ms': round(median(times['recipe.app'] for times in imports), 3),
+        'create_app_ms': round(median(r['create_app_ms'] for r in responses), 3),
+        'first_request_ms': round(median(r['first_request_ms'] for r in responses), 3),
+        'time_to_first_response_ms': round(median(r['time_to_first_response_ms'] for r in responses), 3),
+        'first_response_status': responses[-1]['status'],
+        'heaviest_imports_ms': {name: round(ms, 3) for name, ms in heaviest}
+    }
+
+def compare_startup(current: dict, baseline: dict, max_regression: float) -> list[str]:
+    regressions = []
+    for key in ('import_ms', 'time_to_first_response_ms'):
+        if key in baseline and baseline[key] > 0 and current[key] > baseline[key] * (1 + max_regression):
+            regressions.append(f'startup: {key} {current[key]} > {baseline[key]} (+{max_regression:.0%} allowed)')
+    return regressions
@@ -0,0 +1,19 @@
+# Picked up automatically by `gunicorn 'recipe.app:app'` from the repository root
+
+import os
+
+def child_exit(server, worker):
+    # let the `/metrics` endpoint drop the live gauges of the exited worker
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+def post_worker_init(worker):
+    # the job runners only start on first use otherwise, and the outbox may have jobs left by the previous worker
+    from recipe.jobs import start_runners
+    start_runners()
+
+def worker_exit(server, worker):
+    # finish the queued background jobs before the worker exits
+    from recipe.jobs import stop_runners
+    stop_runners(timeout=float(os.environ.get('RECIPE_JOBS_SHUTDOWN_TIMEOUT', 30)))
@@ -0,0 +1,182 @@
+"""
+Tag affinity of the users, for the personalized feed (`GET /recipe/for-you`).
+
+The affinity of a user to a tag is the sum of the weights of their
+bookmarks and high ratings (`HIGH_SCORE` and above) of the recipes with
+that tag, with the same weights as the trending scores. A recipe is
+ranked by the dot product of its (0/1) tag vector with the user's
+affinity vector, that is, by the sum of the user's affinities to its tags.
+
+The vectors are kept in `user_tag_affinity` and changed incrementally,
+in the same transaction as the bookmarks and the ratings, with
+`UPDATE ... SET weight = weight + delta`, like the popularity counters.
+The top `AFFINITY_TAGS` tags of a user are cached, and dropped from the
+cache once the change is committed. `rebuild_affinity` recomputes all of
+them from scratch:
+
+    python -m recipe.affinity
+
+Scoring every recipe with a popular tag would read a good part of the
+catalog on every request. Instead, the candidates are the best
+`CANDIDATES_PER_TAG` approved recipes of each of the user's top tags,
+read from the tag index and cached per tag for the TTL of the cache.
+A recipe is scored by the lists it is in, so the feed has at most
+`AFFINITY_TAGS * CANDIDATES_PER_TAG` recipes.
+"""
+
+from dotenv import load_dotenv
+
+from sqlalchemy import create_engine, select, insert, update, delete, literal, func, bindparam, union_all, Engine
+from sqlalchemy.orm import Session
+
+from .cache import Cache, invalidate_after_commit
+from .database.database import database_url_from_env, insert_or_ignore
+from .bookmarks import BookmarkSet
+from .database.models import BookmarkedRecipe, RatedRecipe, Recipe, RecipesTags, UserTagAffinity, Status
+from .trending import BOOKMARK_WEIGHT, rating_weight
+
+from datetime import datetime
+from time import perf_counter
+from typing import Iterable
+from uuid import UUID
+import argparse
+import sys
+
+# the lowest score that counts as a "like"
+HIGH_SCORE: float = 4.0
+
+# the tags of a user that select and rank the candidates
+AFFINITY_TAGS: int = 10
+
+# the candidates of the personalized feed from every tag
+CANDIDATES_PER_TAG: int = 100
+
+# what is left of a weight after adding and removing the same values
+EPSILON: float = 1e-9
+
+def rating_affinity(score: float | None) -> float:
+    """The weight of a rating in the affinity vector, none for the low ones"""
+    return rating_weight(score) if score is not None and score >= HIGH_SCORE else 0.0
+
+def bump_affinity(db: Session, cache: Cache, user_id: UUID, recipe_ids: Iterable[UUID], delta: float):
+    """Add `delta` to the user's affinity to every tag of the recipes"""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids or delta == 0:
+        return
+
+    conn = db.connection()
+    table = UserTagAffinity.__table__
+
+    tags = conn.execute(select(RecipesTags.tag_id, func.count())
+                        .where(RecipesTags.recipe_id.in_(recipe_ids))
+                        .group_by(RecipesTags.tag_id)).all()
+    if not tags:
+        return
+
+    conn.execute(insert_or_ignore(conn.dialect.name, table).values([
+        {'user_id': user_id, 'tag_id': tag_id, 'weight': 0.0} for tag_id, _ in tags
+    ]))
+    conn.execute(update(table)
+                 .where((table.c.user_id == user_id) & (table.c.tag_id == bindparam('b_tag_id')))
+                 .values(weight=table.c.weight + bindparam('b_delta')),
+                 [{'b_tag_id': tag_id, 'b_delta': delta * n} for tag_id, n in tags])
+
+    if delta < 0:
+        conn.execute(delete(table).where((table.c.user_id == user_id) & (table.c.weight < EPSILON)))
+
+    invalidate_after_commit(db, cache, [user_id])
+
+def load_affinity(db: Session, user_id: UUID) -> list[tuple[UUID, float]]:
+    return [
+        (tag_id, weight)
+        for tag_id, weight in db.execute(select(UserTagAffinity.tag_id, UserTagAffinity.weight)
+                                         .where((UserTagAffinity.user_id == user_id) & (UserTagAffinity.weight >= EPSILON))
+                                         .order_by(UserTagAffinity.weight.desc(), UserTagAffinity.tag_id)
+                                         .limit(AFFINITY_TAGS))
+    ]
+
+def user_affinity(db: Session, cache: Cache, user_id: UUID) -> dict[UUID, float]:
+    """The user's top tags and their weights, from `cache` (keyed by user id)"""
+    return dict(cache.get_or_set(user_id, lambda: load_affinity(db, user_id)))
+
+def load_tag_recipes(db: Session, tag_id: UUID) -> list[tuple[UUID, float, datetime]]:
+    """The best approved recipes with the tag, as in the `rating` feed: `(id, rating, date_created)`"""
+    return [
+        tuple(row)
+        for row in db.execute(select(Recipe.id, Recipe.rating, Recipe.date_created)
+                              .join(RecipesTags, RecipesTags.recipe_id == Recipe.id)
+                              .where((RecipesTags.tag_id == tag_id) & (Recipe.status == Status.APPROVED))
+                              .order_by(Recipe.rating.desc(), Recipe.date_created.desc())
+                              .limit(CANDIDATES_PER_TAG))
+    ]
+
+def tag_recipes(db: Session, cache: Cache, tag_ids: Iterable[UUID]) -> dict[UUID, list[tuple[UUID, float, datetime]]]:
+    """`load_tag_recipes` of every tag, from `cache` (keyed by tag id)"""
+    tag_ids = list(tag_ids)
+    found = cache.get_many(tag_ids)
+
+    missing = [tag_id for tag_id in tag_ids if tag_id not in found]
+    if missing:
+        versions = cache.versions(missing)
+        loaded = {tag_id: load_tag_recipes(db, tag_id) for tag_id in missing}
+        cache.set_many(loaded, versions=versions)
+        found.update(loaded)
+
+    return found
+
+def rank_for_you(affinity: dict[UUID, float], candidates: dict[UUID, list[tuple[UUID, float, datetime]]], bookmarks: BookmarkSet) -> list[UUID]:
+    """
+    The ids of the candidates that are not bookmarked yet, by the sum of
+    the affinities to the tags they are candidates of, then as in the
+    `rating` feed.
+    """
+    scores: dict[UUID, float] = {}
+    order: dict[UUID, tuple[float, datetime]] = {}
+
+    for tag_id, recipes in candidates.items():
+        weight = affinity.get(tag_id, 0.0)
+        for recipe_id, rating, date_created in recipes:
+            scores[recipe_id] = scores.get(recipe_id, 0.0) + weight
+            order[recipe_id] = (rating, date_created)
+
+    ranked = [recipe_id for recipe_id in scores if recipe_id not in bookmarks]
+    ranked.sort(key=lambda recipe_id: (scores[recipe_id], *order[recipe_id]), reverse=True)
+    return ranked
+
+def rebuild_affinity(engine: Engine):
+    """Recompute the affinity vectors of all users, in one transaction"""
+    table = UserTagAffinity.__table__
+
+    interactions = union_all(
+        select(BookmarkedRecipe.user_id, BookmarkedRecipe.recipe_id, literal(BOOKMARK_WEIGHT).label('weight')),
+        # `rating_affinity` in SQL
+        select(RatedRecipe.user_id, RatedRecipe.recipe_id, rating_weight(RatedRecipe.score).label('weight'))
+        .where(RatedRecipe.score >= HIGH_SCORE)
+    ).subquery()
+
+    weights = (select(interactions.c.user_id, RecipesTags.tag_id, func.sum(interactions.c.weight))
+               .join(RecipesTags, RecipesTags.recipe_id == interactions.c.recipe_id)
+               .group_by(interactions.c.user_id, RecipesTags.tag_id))
+
+    with engine.begin() as conn:
+        conn.execute(delete(table))
+        conn.execute(insert(table).from_select(['user_id', 'tag_id', 'weight'], weights))
+
+def main(argv: list[str]) -> int:
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(prog='python -m recipe.affinity', description='Recompute the tag affinity of the users.')
+    parser.add_argument('--db-url', help='defaults to the database configured with the `RECIPE_DATABASE_*` variables')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.db_url or database_url_from_env())
+
+    start = perf_counter()
+    rebuild_affinity(engine)
+    print(f'Rebuilt the tag affinity in {perf_counter() - start:.1f} s.', file=sys.stderr)
+
+    engine.dispose()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,44 +1,142 @@
-import falcon
-
-from .resources.user import UserResource
-from .resources.recipe import RecipeResource
-from .resources.auth import AuthResource
-from .resources.bookmark import BookmarkResource
-from .resources.rating import RatingResource
+"""
+The application factory.
 
-from .database.database import new_engine, new_sessionmaker
+Importing this module has no side effects: the resources, the database
+layer and their dependencies are only imported when an application is
+built. `gunicorn 'recipe.app:app'` builds the default application,
+configured from the environment, on first access to `app`.
+"""
 
-from .util import (
-    handle_fields_missing, FieldsMissing, handle_unauthorized, Unauthorized,
-    handle_pagination_error, PaginationError, AccessDenied, handle_access_denied
-)
-from .security import get_admin_token
+import falcon
 
-from .log import logging
+from .log import logging, configure_logging, AccessLogMiddleware
 
+from datetime import timedelta
+from operator import attrgetter
+from threading import Lock
 import os
-from dotenv import load_dotenv
 
-def create_app(db_url: str) -> falcon.asgi.App:
+def create_app(db_url: str) -> falcon.App:
+    from .resources.user import UserResource
+    from .resources.recipe import RecipeResource
+    from .resources.auth import AuthResource
+    from .resources.bookmark import BookmarkResource
+    from .resources.rating import RatingResource
+    from .resources.moderation import ModerationResource
+    from .resources.attachment import AttachmentResource
+
+    from .database.database import new_engine, new_sessionmaker
+    from .cache import cache_from_env, invalidate_on_commit, bus_from_env
+    from .database.models import Recipe, User, Tag, BookmarkedRecipe, UserTagAffinity
+    from .instrumentation import instrument_engine, QueryInstrumentationMiddleware, DEFAULT_REPEAT_THRESHOLD
+    from .metrics import instrument_pool, MetricsMiddleware, MetricsResource
+    from .profiling import ProfilingMiddleware
+    from .trending import TrendingFeed
+    from .jobs import JobRunner
+    from .attachments import AttachmentStore
+
+    from .util import (
+        handle_fields_missing, FieldsMissing, handle_unauthorized, Unauthorized,
+        handle_pagination_error, PaginationError, AccessDenied, handle_access_denied
+    )
 
     if os.environ.get('RECIPE_APP_SECRET') is None:
         raise Exception('Please, set the `RECIPE_APP_SECRET` environment variable. You may use the `.env` file for your convenience.')
 
     # Database initialization
     engine = new_engine(db_url)
+    instrument_engine(
+        engine,
+        repeat_threshold=int(os.environ.get('RECIPE_SQL_REPEAT_THRESHOLD', DEFAULT_REPEAT_THRESHOLD)),
+        raise_on_repeat=os.environ.get('RECIPE_SQL_REPEAT_RAISE') == '1'
+    )
+    instrument_pool(engine)
     db_session = new_sessionmaker(engine)
 
+    # Caches
+    recipe_cache = cache_from_env('recipe', ttl=60, max_size=1024)
+    user_cache = cache_from_env('user', ttl=300, max_size=4096)
+    tag_cache = cache_from_env('tag', ttl=3600, max_size=4096)
+    bookmark_cache = cache_from_env('bookmark', ttl=300, max_size=4096)
+    affinity_cache = cache_from_env('affinity', ttl=300, max_size=4096)
+    tag_recipes_cache = cache_from_env('tag_recipes', ttl=300, max_size=1024)
+    html_cache = cache_from_env('html', ttl=3600, max_size=1024) # keyed by the content, never invalidated
+
+    # the other workers learn about the changes from the bus
+    cache_bus = bus_from_env(engine)
+    if cache_bus is not None:
+        for cache in (recipe_cache, user_cache, tag_cache, bookmark_cache, affinity_cache, tag_recipes_cache):
+            if not cache.shared:
+                cache_bus.register(cache)
+        cache_bus.start()
+
+    invalidate_on_commit(db_session, recipe_cache, Recipe, cache_bus)
+    invalidate_on_commit(db_session, user_cache, User, cache_bus)
+    invalidate_on_commit(db_session, tag_cache, Tag, cache_bus)
+    invalidate_on_commit(db_session, bookmark_cache, BookmarkedRecipe, cache_bus, key=attrgetter('user_id'))
+    invalidate_on_commit(db_session, affinity_cache, UserTagAffinity, cache_bus, key=attrgetter('user_id'))
+
+    # Background jobs
+
+    jobs = JobRunner(
+        db_session,
+        workers=int(os.environ.get('RECIPE_JOBS_WORKERS', 4)),
+        max_queue=int(os.environ.get('RECIPE_JOBS_QUEUE_SIZE', 10000)),
+        outbox=os.environ.get('RECIPE_JOBS_OUTBOX') == '1'
+    )
+
+    # Precomputed feeds
+
+    trending = TrendingFeed(
+        db_session,
+        jobs,
+        half_life=timedelta(hours=float(os.environ.get('RECIPE_TRENDING_HALF_LIFE_HOURS', 48))),
+        interval=float(os.environ.get('RECIPE_TRENDING_INTERVAL', 60)),
+        size=int(os.environ.get('RECIPE_TRENDING_SIZE', 500))
+    )
+
     # Rest API Resources
 
-    user_resource = UserResource(db_session)
-    recipe_resource = RecipeResource(db_session)
+    user_resource = UserResource(db_session, user_cache)
+    recipe_resource = RecipeResource(
+        db_session, recipe_cache, user_cache, tag_cache, bookmark_cache, affinity_cache, tag_recipes_cache, html_cache, trending, jobs
+    )
     auth_resource = AuthResource(db_session)
-    bookmark_resource = BookmarkResource(db_session)
-    rating_resource = RatingResource(db_session)
+    bookmark_resource = BookmarkResource(db_session, bookmark_cache, affinity_cache, html_cache, user_cache)
+    rating_resource = RatingResource(db_session, recipe_cache, affinity_cache, jobs)
+    moderation_resource = ModerationResource(
+        db_session,
+        bookmark_cache,
+        user_cache,
+        lease_duration=float(os.environ.get('RECIPE_MODERATION_LEASE_SECONDS', 600))
+    )
+    attachment_resource = AttachmentResource(
+        db_session,
+        AttachmentStore(os.environ.get('RECIPE_ATTACHMENT_DIR', 'attachments')),
+        max_size=int(os.environ.get('RECIPE_ATTACHMENT_MAX_BYTES', 10 * 1024 * 1024))
+    )
+    metrics_resource = MetricsResource()
 
     # Create Falcon application
 
-    app = falcon.App()
+    middleware = [
+        AccessLogMiddleware(sample_rate=float(os.environ.get('RECIPE_ACCESS_LOG_SAMPLE', 1.0))),
+        MetricsMiddleware(),
+        QueryInstrumentationMiddleware()
+    ]
+
+    profile_dir = os.environ.get('RECIPE_PROFILE_DIR')
+    if profile_dir is not None:
+        # the outermost one, so that the profiles include the other middleware
+        middleware.insert(0, ProfilingMiddleware(
+            profile_dir,
+            sample_every=int(os.environ.get('RECIPE_PROFILE_SAMPLE_EVERY', 1000)),
+            rotate_after=int(os.environ.get('RECIPE_PROFILE_ROTATE_AFTER', 100)),
+            keep=int(os.environ.get('RECIPE_PROFILE_KEEP', 10)),
+            flush_interval=float(os.environ.get('RECIPE_PROFILE_FLUSH_INTERVAL', 60))
+        ))
+
+    app = falcon.App(middleware=middleware)
 
     app.add_error_handler(FieldsMissing, handle_fields_missing)
     app.add_error_handler(Unauthorized, handle_unauthorized)
@@ -48,40 +146,70 @@ def create_app(db_url: str) -> falcon.asgi.App:
     app.add_route('/user', user_resource) # GET
     app.add_route('/user/{_id:uuid}', user_resource, suffix='by_id') # GET, PATCH
     app.add_route('/user/my', user_resource, suffix='my') # GET
+    app.add_route('/user/batch', user_resource, suffix='batch') # GET
 
     app.add_route('/recipe', recipe_resource) # GET, POST
     app.add_route('/recipe/{_id:uuid}', recipe_resource, suffix='by_id') # GET, PATCH[MODERATOR, ADMIN]
     app.add_route('/recipe/search', recipe_resource, suffix='by_tags') # GET
+    app.add_route('/recipe/batch', recipe_resource, suffix='batch') # GET
+    app.add_route('/recipe/trending', recipe_resource, suffix='trending') # GET
+    app.add_route('/recipe/for-you', recipe_resource, suffix='for_you') # GET
+    app.add_route('/recipe/status', recipe_resource, suffix='status') # PATCH[MODERATOR, ADMIN]
     app.add_route('/recipe/my', recipe_resource, suffix='my') # GET
     app.add_route('/recipe/pending', recipe_resource, suffix='pending') # GET[MODERATOR, ADMIN]
     app.add_route('/recipe/deined', recipe_resource, suffix='denied') # GET[MODERATOR, ADMIN]
 
+    app.add_route('/recipe/{_id:uuid}/similar', recipe_resource, suffix='similar') # GET
+    app.add_route('/recipe/{_id:uuid}/source', recipe_resource, suffix='source') # GET, PATCH[author]
     app.add_route('/recipe/{_id:uuid}/rating', rating_resource) # GET, POST
     app.add_route('/recipe/{_id:uuid}/bookmark', bookmark_resource, suffix='bookmark') # POST, DELETE
+    app.add_route('/recipe/{_id:uuid}/attachment', attachment_resource, suffix='recipe') # GET, POST[author]
+
+    app.add_route('/attachment/{sha256}', attachment_resource) # GET, no authorization
 
     app.add_route('/bookmark', bookmark_resource) # GET
+    app.add_route('/bookmark/batch', bookmark_resource, suffix='batch') # POST, DELETE
+
+    app.add_route('/moderation/claim', moderation_resource, suffix='claim') # POST[MODERATOR, ADMIN]
 
     app.add_route('/auth/login', auth_resource, suffix='login') # POST
     app.add_route('/auth/register', auth_resource, suffix='register') # POST
 
+    app.add_route('/metrics', metrics_resource) # GET
+
     return app
 
-load_dotenv()
+def create_default_app() -> falcon.App:
+    """The application configured with the environment variables and `.env`"""
+    from .database.database import database_url_from_env
+    from .security import get_admin_token
+    from .spec import register_docs
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    configure_logging()
+
+    logging.debug('Virtual admin user for this session:')
+    logging.debug(get_admin_token())
+    logging.debug('Please, note that this is not a real database user, and it is only a signed JWT for the user with max priveleges.')
+
+    app = create_app(database_url_from_env())
+    register_docs(app)
+
+    return app
 
-logging.debug('Virtual admin user for this session:')
-logging.debug(get_admin_token())
-logging.debug('Please, note that this is not a real database user, and it is only a signed JWT for the user with max priveleges.')
+_default_app: falcon.App | None = None
+_default_app_lock = Lock()
 
-db_password = os.environ.get('RECIPE_DATABASE_PASSWORD')
-if db_password is None:
-    raise Exception('Please, set the `RECIPE_DATABASE_PASSWORD` environment variable. You may use the `.env` file for your convenience.')
+def __getattr__(name: str):
+    global _default_app
 
-db_user = os.environ.get('RECIPE_DATABASE_USER', 'postgres')
-db_name = os.environ.get('RECIPE_DATABASE_NAME', 'recipe-postgres')
-db_host = os.environ.get('RECIPE_DATABASE_HOST', 'localhost')
-db_port = os.environ.get('RECIPE_DATABASE_PORT', '5432')
+    if name != 'app':
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-app = create_app(f'postgresql+psycopg2://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}')
+    with _default_app_lock:
+        if _default_app is None:
+            _default_app = create_default_app()
 
-from .spec import api
-api.register(app)
\ No newline at end of file
+    return _default_app
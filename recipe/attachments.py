@@ -0,0 +1,137 @@
+"""
+Photos attached to the recipes (`/recipe/{id}/attachment`).
+
+The files are stored on the local disk under the SHA-256 of their
+content (`<root>/ab/cdef...`), so the same photo attached twice, to one
+recipe or to many, is stored once, and a file never changes once it is
+written. The uploads are streamed to a temporary file in chunks, hashed
+on the way, and moved in place when complete; the body is never held in
+memory. Only JPEG, PNG, GIF and WebP images are accepted, recognized by
+their content rather than by the `Content-Type` of the upload.
+
+`FileRange` serves a part of a file: under gunicorn, it goes through
+`wsgi.file_wrapper`, which sends it with `sendfile()` straight from the
+page cache to the socket.
+"""
+
+from hashlib import sha256
+from typing import BinaryIO
+import os
+import re
+import tempfile
+
+CHUNK_SIZE: int = 64 * 1024
+
+SHA256_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+class AttachmentTooLarge(Exception):
+    pass
+
+class UnsupportedAttachment(Exception):
+    pass
+
+def sniff_image_type(head: bytes) -> str | None:
+    """The type of the image by its first 12 bytes, if it is one of the accepted ones"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+class FileRange:
+    """
+    `length` bytes of `file` from `start`. Has `fileno()`, so that
+    gunicorn sends it with `sendfile()` (bounded by `Content-Length`),
+    and a bounded `read()` for the other servers.
+    """
+
+    def __init__(self, file: BinaryIO, start: int, length: int):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b''
+
+        data = self.file.read(self.remaining if size < 0 else min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+class AttachmentStore:
+
+    root: str
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def save(self, stream: BinaryIO, max_size: int) -> tuple[str, str, int]:
+        """
+        Store the image read from `stream`, unless it is already stored.
+        Returns its SHA-256, type and size.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        try:
+            digest = sha256()
+            head = b''
+            size = 0
+
+            with os.fdopen(fd, 'wb') as tmp:
+                while chunk := stream.read(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise AttachmentTooLarge()
+
+                    if len(head) < 12:
+                        head += chunk[:12 - len(head)]
+
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+                tmp.flush()
+                os.fsync(tmp.fileno())
+
+            content_type = sniff_image_type(head)
+            if content_type is None:
+                raise UnsupportedAttachment()
+
+            hex_digest = digest.hexdigest()
+            path = self.path(hex_digest)
+
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # atomic: a concurrent upload of the same file writes the same bytes
+                os.replace(tmp_path, path)
+
+            return hex_digest, content_type, size
+
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open(self, digest: str) -> BinaryIO | None:
+        if SHA256_PATTERN.fullmatch(digest) is None:
+            return None
+
+        try:
+            # unbuffered: `sendfile()` starts at the position of the descriptor, which a buffered `seek()` may not move
+            return open(self.path(digest), 'rb', buffering=0)
+        except FileNotFoundError:
+            return None
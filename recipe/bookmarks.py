@@ -0,0 +1,54 @@
+"""
+The bookmarks of a user, as one compact value in the bookmark cache.
+
+Every recipe listing shows whether the viewer has bookmarked each
+recipe. Instead of asking the database for every page, the ids of all
+bookmarked recipes are kept as a single sorted byte string (16 bytes per
+recipe id), and the flag is found by a binary search.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .cache import Cache
+from .database.models import BookmarkedRecipe
+
+from bisect import bisect_left
+from typing import Iterable
+from uuid import UUID
+
+class BookmarkSet:
+    """A sorted array of recipe ids, packed into `bytes`"""
+
+    __slots__ = ('data',)
+
+    ID_SIZE = 16
+
+    data: bytes
+
+    def __init__(self, data: bytes = b''):
+        self.data = data
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[UUID]) -> 'BookmarkSet':
+        return cls(b''.join(sorted(recipe_id.bytes for recipe_id in ids)))
+
+    def __len__(self) -> int:
+        return len(self.data) // self.ID_SIZE
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.data[i * self.ID_SIZE:(i + 1) * self.ID_SIZE]
+
+    def __contains__(self, recipe_id: UUID) -> bool:
+        key = recipe_id.bytes
+        i = bisect_left(self, key)
+        return i < len(self) and self[i] == key
+
+def load_bookmark_ids(db: Session, user_id: UUID) -> bytes:
+    ids = db.scalars(select(BookmarkedRecipe.recipe_id).where(BookmarkedRecipe.user_id == user_id))
+    return BookmarkSet.from_ids(ids).data
+
+def bookmark_set(db: Session, cache: Cache, user_id: UUID) -> BookmarkSet:
+    """The recipes bookmarked by the user, from `cache` (keyed by user id)"""
+    # the raw bytes are cached: they are the same for every backend
+    return BookmarkSet(cache.get_or_set(user_id, lambda: load_bookmark_ids(db, user_id)))
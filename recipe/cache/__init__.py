@@ -0,0 +1,124 @@
+"""
+Caches.
+
+The backend of every cache is chosen by the URL in `RECIPE_CACHE_URL`:
+
+    memory://                     an LRU cache in every worker (default)
+    sqlite:////var/cache/recipe.db  a local SQLite file, shared by the workers of one host
+    redis://localhost:6379/0      a Redis server, shared by all hosts
+
+All backends support TTLs, bulk `get_many`/`set_many`, and `get_or_set`,
+which lets only one caller compute a missing value at a time.
+
+Every key has a version that is bumped by `invalidate`. A reader takes
+the version *before* loading the value from the database and passes it
+to `set`, which refuses to store the value if the key was invalidated
+in the meantime. This way, a slow reader can't put back a value that a
+concurrent writer has just made stale.
+
+With the `memory://` backend, the invalidations reach the caches of the
+other workers through the invalidation bus (see `.bus`), if one is
+configured. Otherwise the other workers may serve the old value for at
+most the TTL of the cache.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, sessionmaker, ORMExecuteState
+
+from operator import attrgetter
+from typing import Any, Callable, Hashable, Iterable
+
+from .base import Cache, MISSING
+from .memory import MemoryCache
+from .sqlite import SQLiteCache
+from .redis import RedisCache
+from .bus import InvalidationBus, bus_from_env
+
+import os
+
+def new_cache(name: str, url: str = 'memory://', ttl: float = 60.0, max_size: int = 1024) -> Cache:
+    """`max_size` is ignored by Redis, which has its own eviction policy"""
+    scheme = url.split('://', 1)[0]
+
+    if scheme == 'memory':
+        return MemoryCache(name, ttl, max_size)
+    if scheme == 'sqlite':
+        return SQLiteCache(name, url[len('sqlite:///'):], ttl, max_size)
+    if scheme in ('redis', 'rediss', 'unix'):
+        return RedisCache(name, url, ttl)
+
+    raise ValueError(f'Unsupported cache URL: {url}')
+
+def cache_from_env(name: str, ttl: float = 60.0, max_size: int = 1024) -> Cache:
+    """
+    The cache `name` on the backend from `RECIPE_CACHE_URL`. The defaults
+    are overridden by `RECIPE_<NAME>_CACHE_TTL` and `RECIPE_<NAME>_CACHE_SIZE`.
+    """
+    prefix = f'RECIPE_{name.upper()}_CACHE_'
+
+    return new_cache(
+        name,
+        os.environ.get('RECIPE_CACHE_URL', 'memory://'),
+        ttl=float(os.environ.get(prefix + 'TTL', ttl)),
+        max_size=int(os.environ.get(prefix + 'SIZE', max_size))
+    )
+
+def invalidate_after_commit(session: Session, cache: Cache, keys: Iterable[Hashable]):
+    """
+    Drop `keys` from `cache` once `session` commits, as `invalidate_on_commit`
+    does for the ORM changes. For the changes made with Core statements.
+    """
+    session.info.setdefault(f'changed:{cache.name}', set()).update(keys)
+
+def invalidate_on_commit(
+    db_sessionmaker: sessionmaker[Session],
+    cache: Cache,
+    model: type,
+    bus: InvalidationBus | None = None,
+    key: Callable[[Any], Hashable] = attrgetter('id')
+):
+    """
+    Drop an instance of `model` from `cache` (by `key(instance)`) whenever a
+    session of `db_sessionmaker` commits a change to it, whatever the
+    code path. ORM-enabled bulk `update(model)` / `delete(model)`
+    statements clear the whole cache.
+
+    The invalidations of a cache that is not shared are also published
+    to `bus`, for the other workers.
+    """
+
+    if cache.shared:
+        bus = None
+
+    changed_key = f'changed:{cache.name}'
+    all_changed_key = f'all_changed:{cache.name}'
+
+    @event.listens_for(db_sessionmaker, 'after_flush')
+    def after_flush(session: Session, flush_context):
+        changed = session.info.setdefault(changed_key, set())
+        for obj in session.new | session.dirty | session.deleted:
+            if isinstance(obj, model):
+                changed.add(key(obj))
+
+    @event.listens_for(db_sessionmaker, 'do_orm_execute')
+    def do_orm_execute(state: ORMExecuteState):
+        if (state.is_update or state.is_delete) and getattr(state.statement, 'table', None) is model.__table__:
+            state.session.info[all_changed_key] = True
+
+    @event.listens_for(db_sessionmaker, 'after_commit')
+    def after_commit(session: Session):
+        if session.info.pop(all_changed_key, False):
+            cache.clear()
+            if bus is not None:
+                bus.publish(cache.name, all=True)
+
+        changed = session.info.pop(changed_key, None)
+        if changed:
+            cache.invalidate_many(changed)
+            if bus is not None:
+                bus.publish(cache.name, changed)
+
+    @event.listens_for(db_sessionmaker, 'after_rollback')
+    def after_rollback(session: Session):
+        session.info.pop(all_changed_key, None)
+        session.info.pop(changed_key, None)
@@ -0,0 +1,185 @@
+from ..metrics import CACHE_REQUESTS, CACHE_EVICTIONS
+
+from threading import Event, Lock
+from time import monotonic, sleep
+from typing import Any, Callable, Hashable, Iterable
+
+MISSING = object()
+
+class Cache:
+    """
+    The interface of all cache backends.
+
+    The keys are namespaced with the name of the cache, so several caches
+    can share one backend. Every key has a version that `invalidate`
+    bumps: `set` and `set_many` refuse to store the values of the keys
+    that were invalidated after their `version` was taken.
+
+    A backend implements the underscored methods, which take the
+    namespaced string keys.
+    """
+
+    name: str
+    ttl: float
+    lock_timeout: float # how long to wait for a value that someone else computes
+
+    # Shared by the workers, so it doesn't need the invalidation bus
+    shared: bool = False
+
+    # An upper bound of the TTLs, while the invalidation bus is down
+    ttl_limit: float | None
+
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(self, name: str, ttl: float = 60.0, lock_timeout: float = 5.0):
+        self.name = name
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.ttl_limit = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._flights: dict[str, Event] = {}
+        self._flights_lock = Lock()
+
+    # Backend
+
+    def _get_many(self, keys: list[str]) -> dict[str, Any]:
+        raise NotImplementedError
+
+    def _set_many(self, items: dict[str, Any], ttl: float, versions: dict[str, int] | None):
+        raise NotImplementedError
+
+    def _versions(self, keys: list[str]) -> dict[str, int]:
+        raise NotImplementedError
+
+    def _invalidate_many(self, keys: list[str]):
+        raise NotImplementedError
+
+    def _clear(self):
+        raise NotImplementedError
+
+    def _try_lock(self, key: str, timeout: float) -> bool:
+        """Lock `key` for the other processes, if the backend is shared by them"""
+        return True
+
+    def _unlock(self, key: str):
+        pass
+
+    # Interface
+
+    def _key(self, key: Hashable) -> str:
+        return f'{self.name}:{key}'
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys: Iterable[Hashable]) -> dict[Hashable, Any]:
+        """The cached values of those `keys` that are in the cache"""
+        keys = {self._key(key): key for key in keys}
+        found = self._get_many(list(keys)) if keys else {}
+
+        hits = len(found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        CACHE_REQUESTS.labels(self.name, 'hit').inc(hits)
+        CACHE_REQUESTS.labels(self.name, 'miss').inc(len(keys) - hits)
+
+        return {keys[key]: value for key, value in found.items()}
+
+    def version(self, key: Hashable) -> int:
+        return self.versions([key])[key]
+
+    def versions(self, keys: Iterable[Hashable]) -> dict[Hashable, int]:
+        keys = {self._key(key): key for key in keys}
+        return {keys[key]: version for key, version in self._versions(list(keys)).items()}
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None, version: int | None = None):
+        self.set_many({key: value}, ttl, None if version is None else {key: version})
+
+    def set_many(self, items: dict[Hashable, Any], ttl: float | None = None, versions: dict[Hashable, int] | None = None):
+        if not items:
+            return
+
+        self._set_many(
+            {self._key(key): value for key, value in items.items()},
+            self._ttl(ttl),
+            None if versions is None else {self._key(key): version for key, version in versions.items()}
+        )
+
+    def invalidate(self, key: Hashable):
+        self.invalidate_many([key])
+
+    def invalidate_many(self, keys: Iterable[Hashable]):
+        keys = [self._key(key) for key in keys]
+        if keys:
+            self._invalidate_many(keys)
+
+    def clear(self):
+        self._clear()
+
+    def get_or_set(self, key: Hashable, compute: Callable[[], Any], ttl: float | None = None) -> Any:
+        """
+        The cached value of `key`, or the result of `compute()`, which is
+        then cached. Only one caller computes a missing value at a time:
+        the other threads of the process (and the other processes, for
+        the shared backends) wait for it for up to `lock_timeout` seconds.
+        """
+
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+
+        k = self._key(key)
+
+        with self._flights_lock:
+            flight = self._flights.get(k)
+            leader = flight is None
+            if leader:
+                flight = self._flights[k] = Event()
+
+        if not leader:
+            flight.wait(self.lock_timeout)
+            value = self._get_many([k]).get(k, MISSING)
+            # the leader has failed, or its value was already stale
+            return compute() if value is MISSING else value
+
+        try:
+            return self._compute(k, compute, ttl)
+        finally:
+            with self._flights_lock:
+                del self._flights[k]
+            flight.set()
+
+    def _compute(self, key: str, compute: Callable[[], Any], ttl: float | None) -> Any:
+        locked = self._try_lock(key, self.lock_timeout)
+
+        if not locked:
+            # another process computes it
+            deadline = monotonic() + self.lock_timeout
+            while monotonic() < deadline:
+                sleep(0.01)
+                value = self._get_many([key]).get(key, MISSING)
+                if value is not MISSING:
+                    return value
+
+        try:
+            version = self._versions([key])[key]
+            value = compute()
+            self._set_many({key: value}, self._ttl(ttl), {key: version})
+            return value
+        finally:
+            if locked:
+                self._unlock(key)
+
+    def _ttl(self, ttl: float | None) -> float:
+        ttl = self.ttl if ttl is None else ttl
+        return ttl if self.ttl_limit is None else min(ttl, self.ttl_limit)
+
+    def _evicted(self, reason: str, count: int = 1):
+        self.evictions += count
+        CACHE_EVICTIONS.labels(self.name, reason).inc(count)
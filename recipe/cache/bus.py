@@ -0,0 +1,301 @@
+"""
+Cache invalidation bus.
+
+The in-process caches of every worker on every host subscribe to the
+bus. After a commit, the worker that changed the data publishes the
+invalidated keys, and the other workers drop them from their caches.
+
+The transport is chosen by `RECIPE_CACHE_BUS`:
+
+    postgres                   `LISTEN/NOTIFY` in the application database
+    file:///run/recipe/bus.log   an append-only file, for a single host
+
+Lost messages can't always be detected, so the TTLs of the caches stay
+the last line of defence. While a worker is not subscribed, its caches
+keep the new entries for at most `fallback_ttl` seconds, and after
+(re)subscribing or detecting a gap in the messages it drops everything.
+"""
+
+from sqlalchemy import Engine, text
+
+from .base import Cache
+from ..log import logging
+from ..metrics import (
+    CACHE_INVALIDATION_MESSAGES, CACHE_INVALIDATION_LAG,
+    CACHE_INVALIDATION_LOST, CACHE_INVALIDATION_BUS_UP
+)
+
+from itertools import count
+from threading import Event, Lock, Thread
+from time import time
+from typing import Callable, Hashable, Iterable
+from uuid import uuid4
+import fcntl
+import json
+import os
+import select
+import socket
+
+CHANNEL: str = 'recipe_cache_invalidation'
+
+# `NOTIFY` payloads must be shorter than 8000 bytes
+MAX_KEYS_PER_MESSAGE: int = 150
+
+class Transport:
+    def publish(self, payload: str):
+        raise NotImplementedError
+
+    def listen(self, on_subscribed: Callable[[], None], on_message: Callable[[str], None], stop: Event):
+        """Deliver the messages until `stop` is set. Raises if the connection is lost"""
+        raise NotImplementedError
+
+class PostgresTransport(Transport):
+    engine: Engine
+    poll_interval: float
+
+    def __init__(self, engine: Engine, poll_interval: float = 1.0):
+        self.engine = engine
+        self.poll_interval = poll_interval
+
+    def publish(self, payload: str):
+        with self.engine.begin() as conn:
+            conn.execute(text('SELECT pg_notify(:channel, :payload)'), {'channel': CHANNEL, 'payload': payload})
+
+    def listen(self, on_subscribed: Callable[[], None], on_message: Callable[[str], None], stop: Event):
+        # a dedicated connection, taken out of the pool for good
+        connection = self.engine.raw_connection()
+        connection.detach()
+        dbapi_connection = connection.dbapi_connection
+
+        try:
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            on_subscribed()
+
+            while not stop.is_set():
+                if select.select([dbapi_connection], [], [], self.poll_interval) == ([], [], []):
+                    continue
+
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    on_message(dbapi_connection.notifies.pop(0).payload)
+        finally:
+            connection.close()
+
+class FileTransport(Transport):
+    """
+    Every message is a line appended to `path`. The file is rotated to
+    `<path>.1` when it grows over `max_bytes`; the subscribers finish
+    reading the rotated file before switching to the new one.
+    """
+
+    path: str
+    max_bytes: int
+    poll_interval: float
+
+    def __init__(self, path: str, max_bytes: int = 16 * 1024 * 1024, poll_interval: float = 0.05):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def publish(self, payload: str):
+        line = (payload + '\n').encode('utf-8')
+
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                if os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+            except FileNotFoundError:
+                pass
+
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDONLY | os.O_CREAT, 0o600)
+        return os.fdopen(fd, 'rb')
+
+    def listen(self, on_subscribed: Callable[[], None], on_message: Callable[[str], None], stop: Event):
+        file = self._open()
+        file.seek(0, os.SEEK_END)
+        on_subscribed()
+
+        buffer = b''
+        try:
+            while True:
+                chunk = file.read()
+
+                if chunk:
+                    buffer += chunk
+                    *lines, buffer = buffer.split(b'\n')
+                    for line in lines:
+                        on_message(line.decode('utf-8'))
+                    continue
+
+                try:
+                    rotated = os.stat(self.path).st_ino != os.fstat(file.fileno()).st_ino
+                except FileNotFoundError:
+                    rotated = True
+
+                if rotated:
+                    # everything from the old file has been read
+                    file.close()
+                    file = self._open()
+                    buffer = b''
+                    continue
+
+                if stop.wait(self.poll_interval):
+                    return
+        finally:
+            file.close()
+
+class InvalidationBus:
+    transport: Transport
+    fallback_ttl: float
+    max_lag: float # the lag, in seconds, above which a warning is logged
+
+    def __init__(self, transport: Transport, fallback_ttl: float = 5.0, max_lag: float = 1.0):
+        self.transport = transport
+        self.fallback_ttl = fallback_ttl
+        self.max_lag = max_lag
+
+        self.origin = f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}'
+        self._sequence = count(1)
+        self._sequence_lock = Lock()
+
+        # origin -> the latest received sequence number
+        self._received: dict[str, int] = {}
+
+        self._caches: dict[str, Cache] = {}
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+    def register(self, cache: Cache):
+        """Evict the keys published for `cache.name` from `cache`"""
+        self._caches[cache.name] = cache
+        cache.ttl_limit = self.fallback_ttl
+
+    def publish(self, cache_name: str, keys: Iterable[Hashable] = (), all: bool = False):
+        keys = [str(key) for key in keys]
+        batches = [keys[i:i + MAX_KEYS_PER_MESSAGE] for i in range(0, len(keys), MAX_KEYS_PER_MESSAGE)] or [[]]
+
+        for batch in batches:
+            # the sequence numbers must reach the transport in order
+            with self._sequence_lock:
+                payload = json.dumps({
+                    'origin': self.origin,
+                    'sequence': next(self._sequence),
+                    'sent_at': time(),
+                    'cache': cache_name,
+                    'keys': batch,
+                    'all': all
+                })
+
+                try:
+                    self.transport.publish(payload)
+                    CACHE_INVALIDATION_MESSAGES.labels('published').inc()
+                except Exception as e:
+                    # the others will see the change after the TTL
+                    logging.exception(e)
+
+    def start(self):
+        self._thread = Thread(target=self._run, name='cache-invalidation-bus', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        delay = 0.1
+        while not self._stop.is_set():
+            try:
+                self.transport.listen(self._subscribed, self._receive, self._stop)
+            except Exception as e:
+                logging.warning(f'Cache invalidation bus is down: {e!r}')
+
+            self._set_up(False)
+            if self._stop.wait(delay):
+                return
+            delay = min(delay * 2, 10.0)
+
+    def _subscribed(self):
+        # whatever was published before can't be received anymore
+        self._drop_all()
+        self._received.clear()
+        self._set_up(True)
+
+    def _set_up(self, up: bool):
+        CACHE_INVALIDATION_BUS_UP.set(1 if up else 0)
+        for cache in self._caches.values():
+            cache.ttl_limit = None if up else self.fallback_ttl
+
+    def _drop_all(self):
+        for cache in self._caches.values():
+            cache.clear()
+
+    def _receive(self, payload: str):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logging.warning(f'Malformed cache invalidation message: {payload!r}')
+            return
+
+        origin = message['origin']
+        if origin == self.origin:
+            return
+
+        CACHE_INVALIDATION_MESSAGES.labels('received').inc()
+
+        lag = time() - message['sent_at']
+        CACHE_INVALIDATION_LAG.observe(max(lag, 0))
+        if lag > self.max_lag:
+            logging.warning(f'Cache invalidation message from {origin} arrived after {lag:.3f}s')
+
+        previous = self._received.get(origin)
+        self._received[origin] = message['sequence']
+
+        if previous is not None and message['sequence'] != previous + 1:
+            CACHE_INVALIDATION_LOST.inc()
+            logging.warning(f'Missed cache invalidation messages from {origin}, dropping the caches')
+            self._drop_all()
+            return
+
+        cache = self._caches.get(message['cache'])
+        if cache is None:
+            return
+
+        if message['all']:
+            cache.clear()
+        else:
+            cache.invalidate_many(message['keys'])
+
+def bus_from_env(engine: Engine) -> InvalidationBus | None:
+    """The bus configured by `RECIPE_CACHE_BUS`, if any"""
+    url = os.environ.get('RECIPE_CACHE_BUS')
+    if not url:
+        return None
+
+    if url == 'postgres':
+        transport = PostgresTransport(engine)
+    elif url.startswith('file://'):
+        transport = FileTransport(url[len('file://'):])
+    else:
+        raise ValueError(f'Unsupported cache invalidation bus: {url}')
+
+    return InvalidationBus(
+        transport,
+        fallback_ttl=float(os.environ.get('RECIPE_CACHE_BUS_FALLBACK_TTL', 5)),
+        max_lag=float(os.environ.get('RECIPE_CACHE_BUS_MAX_LAG', 1))
+    )
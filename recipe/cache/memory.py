@@ -0,0 +1,95 @@
+from .base import Cache
+
+from collections import OrderedDict
+from itertools import count
+from threading import Lock
+from time import monotonic
+from typing import Any
+
+class MemoryCache(Cache):
+    """
+    An LRU cache in the memory of the process: the fastest backend, but
+    every gunicorn worker has its own copy.
+    """
+
+    max_size: int
+
+    def __init__(self, name: str, ttl: float = 60.0, max_size: int = 1024, **kwargs):
+        super().__init__(name, ttl, **kwargs)
+        self.max_size = max_size
+
+        # key -> (expires at, value)
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+        # The versions come from one global counter, so they only grow.
+        # The map is bounded: the forgotten keys get the version of the
+        # latest forgotten entry, which is never less than their own.
+        self._versions_map: OrderedDict[str, int] = OrderedDict()
+        self._forgotten_version = 0
+        self._counter = count(1)
+
+        self._lock = Lock()
+
+    def _get_many(self, keys: list[str]) -> dict[str, Any]:
+        found = {}
+        now = monotonic()
+
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+
+                if entry[0] <= now:
+                    del self._entries[key]
+                    self._evicted('expired')
+                    continue
+
+                self._entries.move_to_end(key)
+                found[key] = entry[1]
+
+        return found
+
+    def _set_many(self, items: dict[str, Any], ttl: float, versions: dict[str, int] | None):
+        expires_at = monotonic() + ttl
+
+        with self._lock:
+            for key, value in items.items():
+                if versions is not None and self._versions_map.get(key, self._forgotten_version) != versions[key]:
+                    continue
+
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evicted('size')
+
+    def _versions(self, keys: list[str]) -> dict[str, int]:
+        with self._lock:
+            return {key: self._versions_map.get(key, self._forgotten_version) for key in keys}
+
+    def _invalidate_many(self, keys: list[str]):
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._evicted('invalidated')
+
+                self._versions_map[key] = next(self._counter)
+                self._versions_map.move_to_end(key)
+
+            while len(self._versions_map) > self.max_size * 4:
+                _, self._forgotten_version = self._versions_map.popitem(last=False)
+
+    def _clear(self):
+        with self._lock:
+            if self._entries:
+                self._evicted('invalidated', len(self._entries))
+            self._entries.clear()
+
+            # every key is stale now
+            self._versions_map.clear()
+            self._forgotten_version = next(self._counter)
+
+    def __len__(self) -> int:
+        return len(self._entries)
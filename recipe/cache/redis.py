@@ -0,0 +1,122 @@
+from .base import Cache
+
+from typing import Any
+from uuid import uuid4
+import pickle
+
+# The versions only matter while a value is being computed
+VERSION_LIFETIME_MS: int = 3600 * 1000
+
+SET_IF_VERSION = '''
+local generation = tonumber(redis.call('GET', KEYS[3]) or '0')
+local version = tonumber(redis.call('GET', KEYS[2]) or '0')
+if generation * 4294967296 + version == tonumber(ARGV[3]) then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+'''
+
+UNLOCK = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+class RedisCache(Cache):
+    """
+    A cache in Redis, or any server that speaks its protocol (Valkey,
+    KeyDB, Dragonfly...), shared by all processes on all hosts. Needs
+    the `redis` package.
+
+    The values are pickled, so the server must only be writable by the
+    application.
+    """
+
+    shared = True
+
+    url: str
+
+    def __init__(self, name: str, url: str, ttl: float = 60.0, **kwargs):
+        super().__init__(name, ttl, **kwargs)
+        self.url = url
+
+        # optional dependency
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self._set_if_version = self.client.register_script(SET_IF_VERSION)
+        self._unlock_script = self.client.register_script(UNLOCK)
+        # only one thread of the process computes a key at a time
+        self._lock_tokens: dict[str, str] = {}
+
+    def _version_key(self, key: str) -> str:
+        return f'v|{key}'
+
+    def _generation_key(self) -> str:
+        # `clear` bumps it to make every key of the cache stale
+        return f'g|{self.name}'
+
+    def _get_many(self, keys: list[str]) -> dict[str, Any]:
+        return {
+            key: pickle.loads(value)
+            for key, value in zip(keys, self.client.mget(keys))
+            if value is not None
+        }
+
+    def _versions(self, keys: list[str]) -> dict[str, int]:
+        generation, *versions = self.client.mget([self._generation_key(), *map(self._version_key, keys)])
+        generation = int(generation or 0)
+        return {key: generation << 32 | int(version or 0) for key, version in zip(keys, versions)}
+
+    def _set_many(self, items: dict[str, Any], ttl: float, versions: dict[str, int] | None):
+        ttl_ms = max(int(ttl * 1000), 1)
+
+        with self.client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                if versions is None:
+                    pipe.set(key, value, px=ttl_ms)
+                else:
+                    self._set_if_version(
+                        keys=[key, self._version_key(key), self._generation_key()],
+                        args=[value, ttl_ms, versions[key]],
+                        client=pipe
+                    )
+            pipe.execute()
+
+    def _invalidate_many(self, keys: list[str]):
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.delete(*keys)
+            for key in keys:
+                pipe.incr(self._version_key(key))
+                pipe.pexpire(self._version_key(key), VERSION_LIFETIME_MS)
+            deleted, *_ = pipe.execute()
+
+        if deleted > 0:
+            self._evicted('invalidated', deleted)
+
+    def _clear(self):
+        self.client.incr(self._generation_key())
+
+        batch = []
+        for key in self.client.scan_iter(match=f'{self.name}:*', count=1000):
+            batch.append(key)
+            if len(batch) == 1000:
+                self._evicted('invalidated', self.client.delete(*batch))
+                batch = []
+        if batch:
+            self._evicted('invalidated', self.client.delete(*batch))
+
+    def _try_lock(self, key: str, timeout: float) -> bool:
+        token = uuid4().hex
+        if self.client.set(f'l|{key}', token, nx=True, px=max(int(timeout * 1000), 1)):
+            self._lock_tokens[key] = token
+            return True
+        return False
+
+    def _unlock(self, key: str):
+        token = self._lock_tokens.pop(key, None)
+        if token is not None:
+            self._unlock_script(keys=[f'l|{key}'], args=[token])
@@ -0,0 +1,206 @@
+from .base import Cache
+
+from itertools import count
+from time import time
+from typing import Any
+import os
+import pickle
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at REAL NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, expires_at REAL NOT NULL) WITHOUT ROWID;
+'''
+
+# SQLite allows at most 999 parameters in old versions
+MAX_PARAMETERS: int = 900
+
+# The versions only matter while a value is being computed, so the old
+# ones are dropped from time to time
+VERSION_LIFETIME: float = 3600.0
+
+class SQLiteCache(Cache):
+    """
+    A cache in a local SQLite database (in WAL mode), shared by all
+    processes on the host that use the same file.
+
+    The values are pickled, so only point it at a file that only the
+    application can write to.
+    """
+
+    shared = True
+
+    path: str
+    max_size: int
+    purge_every: int # writes between the removals of the expired entries
+
+    def __init__(self, name: str, path: str, ttl: float = 60.0, max_size: int = 100_000, purge_every: int = 1000, **kwargs):
+        super().__init__(name, ttl, **kwargs)
+        self.path = path
+        self.max_size = max_size
+        self.purge_every = purge_every
+
+        self._local = threading.local()
+        self._writes = count(1)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, and a new one after a fork
+        connection: sqlite3.Connection | None = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.lock_timeout, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    def _generation_key(self) -> str:
+        # `clear` bumps it to make every key of the cache stale
+        return self._key('')
+
+    def _get_many(self, keys: list[str]) -> dict[str, Any]:
+        db = self._connection()
+        now = time()
+        found = {}
+
+        for start in range(0, len(keys), MAX_PARAMETERS):
+            chunk = keys[start:start + MAX_PARAMETERS]
+            rows = db.execute(
+                f'SELECT key, value FROM entries WHERE key IN ({",".join("?" * len(chunk))}) AND expires_at > ?',
+                (*chunk, now)
+            )
+            for key, value in rows:
+                found[key] = pickle.loads(value)
+
+        return found
+
+    def _read_versions(self, db: sqlite3.Connection, keys: list[str]) -> dict[str, int]:
+        generation_key = self._generation_key()
+        versions = {}
+
+        for start in range(0, len(keys), MAX_PARAMETERS):
+            chunk = keys[start:start + MAX_PARAMETERS]
+            rows = db.execute(
+                f'SELECT key, version FROM versions WHERE key IN ({",".join("?" * (len(chunk) + 1))})',
+                (*chunk, generation_key)
+            )
+            versions.update(rows)
+
+        generation = versions.get(generation_key, 0)
+        return {key: generation << 32 | versions.get(key, 0) for key in keys}
+
+    def _versions(self, keys: list[str]) -> dict[str, int]:
+        return self._read_versions(self._connection(), keys)
+
+    def _set_many(self, items: dict[str, Any], ttl: float, versions: dict[str, int] | None):
+        db = self._connection()
+        expires_at = time() + ttl
+        rows = [(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires_at) for key, value in items.items()]
+
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if versions is not None:
+                current = self._read_versions(db, list(items))
+                rows = [row for row in rows if current[row[0]] == versions[row[0]]]
+
+            db.executemany('INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)', rows)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+        if next(self._writes) % self.purge_every == 0:
+            self.purge()
+
+    def _invalidate_many(self, keys: list[str]):
+        db = self._connection()
+        now = time()
+
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            for start in range(0, len(keys), MAX_PARAMETERS):
+                chunk = keys[start:start + MAX_PARAMETERS]
+                deleted = db.execute(f'DELETE FROM entries WHERE key IN ({",".join("?" * len(chunk))})', chunk).rowcount
+                if deleted > 0:
+                    self._evicted('invalidated', deleted)
+
+            db.executemany(
+                'INSERT INTO versions (key, version, updated_at) VALUES (?, 1, ?) '
+                'ON CONFLICT (key) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at',
+                [(key, now) for key in keys]
+            )
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def _clear(self):
+        db = self._connection()
+        prefix = self._generation_key()
+
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            deleted = db.execute("DELETE FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)).rowcount
+            if deleted > 0:
+                self._evicted('invalidated', deleted)
+
+            db.execute(
+                'INSERT INTO versions (key, version, updated_at) VALUES (?, 1, ?) '
+                'ON CONFLICT (key) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at',
+                (prefix, time())
+            )
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def _try_lock(self, key: str, timeout: float) -> bool:
+        now = time()
+        cursor = self._connection().execute(
+            'INSERT INTO locks (key, expires_at) VALUES (?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at WHERE locks.expires_at <= ?',
+            (key, now + timeout, now)
+        )
+        return cursor.rowcount == 1
+
+    def _unlock(self, key: str):
+        self._connection().execute('DELETE FROM locks WHERE key = ?', (key,))
+
+    def purge(self):
+        """Remove the expired entries, the old versions, and the entries over `max_size`"""
+        db = self._connection()
+        now = time()
+        prefix = self._generation_key()
+
+        expired = db.execute('DELETE FROM entries WHERE expires_at <= ?', (now,)).rowcount
+        if expired > 0:
+            self._evicted('expired', expired)
+
+        db.execute(
+            "DELETE FROM versions WHERE updated_at < ? AND substr(key, -1) != ':'",
+            (now - VERSION_LIFETIME,)
+        )
+        db.execute('DELETE FROM locks WHERE expires_at <= ?', (now,))
+
+        # the entries that expire first go first
+        over = db.execute(
+            'SELECT count(*) FROM entries WHERE substr(key, 1, ?) = ?', (len(prefix), prefix)
+        ).fetchone()[0] - self.max_size
+        if over > 0:
+            db.execute(
+                'DELETE FROM entries WHERE key IN '
+                '(SELECT key FROM entries WHERE substr(key, 1, ?) = ? ORDER BY expires_at LIMIT ?)',
+                (len(prefix), prefix, over)
+            )
+            self._evicted('size', over)
@@ -0,0 +1,105 @@
+"""
+Popularity counters of the recipes.
+
+`Recipe.bookmark_count` and `Recipe.rating_count` are changed in the
+same transaction as the bookmarks and the ratings, with
+`UPDATE ... SET n = n + 1`, so concurrent requests don't lose updates.
+The rows changed outside of the application (manual fixes, imports) make
+them drift, and `repair_counters` recomputes them in batches:
+
+    python -m recipe.counters --batch-size 1000
+"""
+
+from dotenv import load_dotenv
+
+from sqlalchemy import create_engine, select, update, func, true, Engine
+from sqlalchemy.orm import Session
+
+from .database.database import database_url_from_env
+from .database.models import Recipe, BookmarkedRecipe, RatedRecipe
+
+from time import perf_counter
+from typing import Callable, Iterable
+from uuid import UUID
+import argparse
+import sys
+
+def bump_counter(db: Session, column: str, recipe_ids: Iterable[UUID], delta: int):
+    """Add `delta` to the counter `column` of the recipes"""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+
+    recipes = Recipe.__table__
+    db.connection().execute(update(recipes)
+                            .where(recipes.c.id.in_(recipe_ids))
+                            .values({column: recipes.c[column] + delta}))
+
+def _actual_counts():
+    # an index lookup per recipe, in the `recipe_id` indexes of both tables
+    recipes = Recipe.__table__
+    bookmarks = (select(func.count())
+                 .select_from(BookmarkedRecipe.__table__)
+                 .where(BookmarkedRecipe.recipe_id == recipes.c.id)
+                 .scalar_subquery())
+    ratings = (select(func.count())
+               .select_from(RatedRecipe.__table__)
+               .where(RatedRecipe.recipe_id == recipes.c.id)
+               .scalar_subquery())
+    return bookmarks, ratings
+
+def repair_counters(engine: Engine, batch_size: int = 1000, log: Callable[[str], None] = lambda line: None) -> int:
+    """
+    Recompute the counters of every recipe, one transaction per
+    `batch_size` recipes, and fix the drifted ones. Returns how many
+    recipes were fixed. A change racing with the fix is left for the
+    next run.
+    """
+    recipes = Recipe.__table__
+    bookmarks, ratings = _actual_counts()
+
+    fixed = 0
+    last_id: UUID | None = None
+
+    while True:
+        with engine.begin() as conn:
+            # walking the primary key, one range of ids at a time
+            batch = select(recipes.c.id).order_by(recipes.c.id).offset(batch_size - 1).limit(1)
+            in_range = true() if last_id is None else recipes.c.id > last_id
+            upper = conn.execute(batch.where(in_range)).scalar()
+            if upper is not None:
+                in_range = in_range & (recipes.c.id <= upper)
+
+            fixed += conn.execute(update(recipes)
+                                  .where(in_range & ((recipes.c.bookmark_count != bookmarks) | (recipes.c.rating_count != ratings)))
+                                  .values(bookmark_count=bookmarks, rating_count=ratings)).rowcount
+
+        if upper is None:
+            # the last, incomplete batch
+            break
+        last_id = upper
+
+        log(f'checked up to {last_id}, fixed {fixed} recipes so far')
+
+    log(f'checked all recipes, fixed {fixed}')
+    return fixed
+
+def main(argv: list[str]) -> int:
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(prog='python -m recipe.counters', description='Recompute the popularity counters of the recipes.')
+    parser.add_argument('--db-url', help='defaults to the database configured with the `RECIPE_DATABASE_*` variables')
+    parser.add_argument('--batch-size', type=int, default=1000, help='recipes per transaction')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.db_url or database_url_from_env())
+
+    start = perf_counter()
+    fixed = repair_counters(engine, args.batch_size, log=lambda line: print(line, file=sys.stderr))
+    print(f'Fixed the counters of {fixed} recipes in {perf_counter() - start:.1f} s.', file=sys.stderr)
+
+    engine.dispose()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
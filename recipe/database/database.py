@@ -1,22 +1,48 @@
-from sqlalchemy import create_engine, Engine
+from sqlalchemy import create_engine, Engine, Table, Insert
 from sqlalchemy.orm import sessionmaker
 
-from sqlalchemy_utils import create_database, database_exists
-
 from .models import OrmBase
 
+import os
+
 def new_engine(url: str) -> Engine:
     return create_engine(
         url
     )
 
+def database_url_from_env() -> str:
+    db_password = os.environ.get('RECIPE_DATABASE_PASSWORD')
+    if db_password is None:
+        raise Exception('Please, set the `RECIPE_DATABASE_PASSWORD` environment variable. You may use the `.env` file for your convenience.')
+
+    db_user = os.environ.get('RECIPE_DATABASE_USER', 'postgres')
+    db_name = os.environ.get('RECIPE_DATABASE_NAME', 'recipe-postgres')
+    db_host = os.environ.get('RECIPE_DATABASE_HOST', 'localhost')
+    db_port = os.environ.get('RECIPE_DATABASE_PORT', '5432')
+
+    return f'postgresql+psycopg2://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
+
 def new_sessionmaker(engine: Engine):
     return sessionmaker(engine)
 
+def insert_or_ignore(dialect_name: str, table: Table) -> Insert:
+    """`INSERT ... ON CONFLICT DO NOTHING` into `table`"""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f'`ON CONFLICT DO NOTHING` is not supported by {dialect_name}')
+
+    return insert(table).on_conflict_do_nothing()
+
 def init_db(engine: Engine):
     # Not used. Using alembic migrations instead
     OrmBase.metadata.create_all(engine)
 
 def validate_db_presence(url: str):
+    # only needed by the migrations, and slow to import
+    from sqlalchemy_utils import create_database, database_exists
+
     if not database_exists(url):
         create_database(url)
\ No newline at end of file
@@ -1,3 +1,4 @@
+from sqlalchemy import Index, JSON, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 from typing import Any
@@ -53,6 +54,12 @@ class Status:
     PENDING: int = 1
     APPROVED: int = 2
 
+STATUS_NAMES: dict[int, str] = {
+    Status.DENIED: 'denied',
+    Status.PENDING: 'pending',
+    Status.APPROVED: 'approved'
+}
+
 class Recipe(OrmBase):
     __tablename__ = 'recipes'
 
@@ -64,6 +71,50 @@ class Recipe(OrmBase):
     rating: Mapped[float] = mapped_column(nullable=False)
     status: Mapped[int] = mapped_column(nullable=False)
 
+    # Maintained by the bookmark and rating handlers (see `recipe.counters`)
+    bookmark_count: Mapped[int] = mapped_column(nullable=False, server_default='0')
+    rating_count: Mapped[int] = mapped_column(nullable=False, server_default='0')
+
+    # Bumped by every edit of the source (see `recipe.versions`)
+    version: Mapped[int] = mapped_column(nullable=False, server_default='1')
+
+    # The key of the rendered HTML in `rendered_sources` (see `recipe.render`)
+    source_hash: Mapped[str | None] = mapped_column(nullable=True)
+
+    # The moderator who reviews the pending recipe, until the lease expires
+    lease_owner_id: Mapped[UUID | None] = mapped_column(nullable=True)
+    lease_expires_at: Mapped[datetime | None] = mapped_column(nullable=True)
+
+    __table_args__ = (
+        # the moderation queue: only the pending recipes, oldest first
+        Index(
+            'ix_recipes_pending_date_created', 'date_created',
+            postgresql_where=text(f'status = {Status.PENDING}'),
+            sqlite_where=text(f'status = {Status.PENDING}')
+        ),
+        # the feed of the approved recipes, one index per `sort`
+        Index(
+            'ix_recipes_approved_rating', 'rating', 'date_created',
+            postgresql_where=text(f'status = {Status.APPROVED}'),
+            sqlite_where=text(f'status = {Status.APPROVED}')
+        ),
+        Index(
+            'ix_recipes_approved_date_created', 'date_created',
+            postgresql_where=text(f'status = {Status.APPROVED}'),
+            sqlite_where=text(f'status = {Status.APPROVED}')
+        ),
+        Index(
+            'ix_recipes_approved_bookmark_count', 'bookmark_count', 'date_created',
+            postgresql_where=text(f'status = {Status.APPROVED}'),
+            sqlite_where=text(f'status = {Status.APPROVED}')
+        ),
+        Index(
+            'ix_recipes_approved_rating_count', 'rating_count', 'date_created',
+            postgresql_where=text(f'status = {Status.APPROVED}'),
+            sqlite_where=text(f'status = {Status.APPROVED}')
+        ),
+    )
+
     def __init__(self, c: RecipeCreate):
         self.source = c.source
         self.author_id = c.author_id
@@ -71,6 +122,9 @@ class Recipe(OrmBase):
         self.date_edited = datetime.utcnow()
         self.rating = 0
         self.status = Status.PENDING
+        self.version = 1
+        self.bookmark_count = 0
+        self.rating_count = 0
 
     def serialize(self) -> dict[str, Any]:
         return {
@@ -101,6 +155,13 @@ class BookmarkedRecipe(OrmBase):
     recipe_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
     date_added: Mapped[datetime] = mapped_column(nullable=False)
 
+    __table_args__ = (
+        # the bookmark feed: the user's bookmarks, the latest first
+        Index('ix_bookmarked_recipes_user_id_date_added', 'user_id', 'date_added', 'recipe_id'),
+        # the bookmarks of a recipe, for its `bookmark_count`
+        Index('ix_bookmarked_recipes_recipe_id', 'recipe_id'),
+    )
+
     def __init__(self, c: BookmarkedRecipeCreate):
         self.user_id = c.user_id
         self.recipe_id = c.recipe_id
@@ -113,6 +174,11 @@ class RatedRecipe(OrmBase):
     recipe_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
     score: Mapped[float] = mapped_column(nullable=False)
 
+    __table_args__ = (
+        # the ratings of a recipe, for its `rating_count`
+        Index('ix_rated_recipes_recipe_id', 'recipe_id'),
+    )
+
     def __init__(self, c: RatedRecipeCreate):
         self.user_id = c.user_id
         self.recipe_id = c.recipe_id
@@ -124,10 +190,141 @@ class RecipesTags(OrmBase):
     recipe_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
     tag_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
 
+    __table_args__ = (
+        # the recipes with a tag: the search and the personalized feed
+        Index('ix_recipes_tags_tag_id', 'tag_id', 'recipe_id'),
+    )
+
     def __init__(self, c: RecipesTagsCreate):
         self.recipe_id = c.recipe_id
         self.tag_id = c.tag_id
 
+# Trending recipes (see `recipe.trending`)
+
+class RecipeActivity(OrmBase):
+    """A bookmark or a rating that is not yet counted in `RecipeTrending`"""
+
+    __tablename__ = 'recipe_activity'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    recipe_id: Mapped[UUID] = mapped_column(nullable=False)
+    weight: Mapped[float] = mapped_column(nullable=False)
+    date_created: Mapped[datetime] = mapped_column(nullable=False)
+
+class RecipeTrending(OrmBase):
+    __tablename__ = 'recipe_trending'
+
+    recipe_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
+    log_score: Mapped[float] = mapped_column(nullable=False)
+    date_updated: Mapped[datetime] = mapped_column(nullable=False)
+
+    __table_args__ = (
+        Index('ix_recipe_trending_log_score', 'log_score'),
+    )
+
+# Similar recipes (see `recipe.similar`)
+
+class RecipeNeighbour(OrmBase):
+    __tablename__ = 'recipe_neighbours'
+
+    recipe_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
+    rank: Mapped[int] = mapped_column(primary_key=True, nullable=False) # 0 is the most similar
+    neighbour_id: Mapped[UUID] = mapped_column(nullable=False)
+    score: Mapped[float] = mapped_column(nullable=False)
+    date_computed: Mapped[datetime] = mapped_column(nullable=False)
+
+# Near-duplicate recipes (see `recipe.duplicates`)
+
+class RecipeSignature(OrmBase):
+    __tablename__ = 'recipe_signatures'
+
+    recipe_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
+    source_hash: Mapped[str] = mapped_column(nullable=False) # of the indexed source
+    signature: Mapped[bytes] = mapped_column(nullable=False) # MinHash
+    date_computed: Mapped[datetime] = mapped_column(nullable=False)
+
+class RecipeLshBucket(OrmBase):
+    __tablename__ = 'recipe_lsh_buckets'
+
+    band: Mapped[int] = mapped_column(primary_key=True, nullable=False)
+    bucket: Mapped[str] = mapped_column(primary_key=True, nullable=False) # the hash of the band of the signature
+    recipe_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
+
+    __table_args__ = (
+        # reindexing a recipe, and the buckets of a page of recipes
+        Index('ix_recipe_lsh_buckets_recipe_id', 'recipe_id'),
+    )
+
+# The personalized feed (see `recipe.affinity`)
+
+class UserTagAffinity(OrmBase):
+    __tablename__ = 'user_tag_affinity'
+
+    user_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
+    tag_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
+    weight: Mapped[float] = mapped_column(nullable=False)
+
+# The earlier sources of the recipes (see `recipe.versions`)
+
+class RecipeVersion(OrmBase):
+    __tablename__ = 'recipe_versions'
+
+    recipe_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
+    version: Mapped[int] = mapped_column(primary_key=True, nullable=False)
+    snapshot: Mapped[bool] = mapped_column(nullable=False) # the whole source, or a delta from the previous version
+    data: Mapped[bytes] = mapped_column(nullable=False) # compressed
+    date_created: Mapped[datetime] = mapped_column(nullable=False)
+
+# The photos of the recipes, stored on disk by their SHA-256 (see `recipe.attachments`)
+
+class RecipeAttachment(OrmBase):
+    __tablename__ = 'recipe_attachments'
+
+    recipe_id: Mapped[UUID] = mapped_column(primary_key=True, nullable=False)
+    sha256: Mapped[str] = mapped_column(primary_key=True, nullable=False)
+    content_type: Mapped[str] = mapped_column(nullable=False)
+    size: Mapped[int] = mapped_column(nullable=False)
+    date_added: Mapped[datetime] = mapped_column(nullable=False)
+
+# The HTML of the recipes (see `recipe.render`)
+
+class RenderedSource(OrmBase):
+    __tablename__ = 'rendered_sources'
+
+    source_hash: Mapped[str] = mapped_column(primary_key=True, nullable=False)
+    html: Mapped[str] = mapped_column(nullable=False)
+    date_rendered: Mapped[datetime] = mapped_column(nullable=False)
+
+# Background jobs (see `recipe.jobs`)
+
+class JobOutbox(OrmBase):
+    """A job that has not succeeded yet, written in the transaction that enqueued it"""
+
+    __tablename__ = 'job_outbox'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    attempts: Mapped[int] = mapped_column(nullable=False)
+    run_after: Mapped[datetime] = mapped_column(nullable=False)
+    date_created: Mapped[datetime] = mapped_column(nullable=False)
+
+    # The worker that runs the job, until the lease expires
+    locked_until: Mapped[datetime | None] = mapped_column(nullable=True)
+
+    # Set once the job has run out of retries: it is kept for inspection
+    date_failed: Mapped[datetime | None] = mapped_column(nullable=True)
+    last_error: Mapped[str | None] = mapped_column(nullable=True)
+
+    __table_args__ = (
+        # the sweep: the jobs that are due
+        Index(
+            'ix_job_outbox_due_run_after', 'run_after',
+            postgresql_where=text('date_failed IS NULL'),
+            sqlite_where=text('date_failed IS NULL')
+        ),
+    )
+
 # Associations table for the one-to-one relationships
 
 class UserPassword(OrmBase):
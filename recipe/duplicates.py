@@ -0,0 +1,225 @@
+"""
+Near-duplicate recipes, shown to the moderators (`near_duplicates` of
+`GET /recipe/pending`), so that the reposts of the existing recipes with
+small edits can be denied together.
+
+The source of a recipe is split into shingles (`SHINGLE_SIZE` words in a
+row, lowercased, the Markdown markup dropped), and its MinHash signature
+of `NUM_PERM` values estimates the Jaccard similarity of the shingle sets
+of two recipes as the share of equal values. The signature is computed
+with one permutation hashing: every shingle is hashed once, the hash
+picks a bin and the bin keeps the smallest value, and the empty bins
+borrow the value of the next non-empty one ("densification"). That is
+linear in the size of the source rather than `NUM_PERM` times it.
+
+The signatures are indexed with LSH: they are cut into `BANDS` bands of
+`NUM_PERM // BANDS` values, and every band is stored as a bucket in
+`recipe_lsh_buckets`. The recipes that share a bucket are the candidates,
+and the candidates whose signatures are at least `DUPLICATE_THRESHOLD`
+similar are the near-duplicates. With 16 bands of 8 values, a pair that
+is 0.8 similar is a candidate with the probability of 0.95, and a pair
+that is 0.5 similar with that of 0.06, so a page of the moderation queue
+is checked with a single indexed join, whatever the size of the catalog.
+
+A recipe is indexed by a background job (`index_duplicates`) when it is
+created or edited. The recipes created before, or loaded by
+`recipe.seed`, are indexed by
+
+    python -m recipe.duplicates --batch-size 500
+"""
+
+from dotenv import load_dotenv
+
+from sqlalchemy import create_engine, select, delete, insert, true, Engine
+from sqlalchemy.orm import Session, aliased
+
+from .database.database import database_url_from_env
+from .database.models import Recipe, RecipeSignature, RecipeLshBucket
+from .render import source_hash
+
+from datetime import datetime
+from hashlib import blake2b
+from time import perf_counter
+from typing import Any, Callable
+from uuid import UUID
+import argparse
+import re
+import struct
+import sys
+
+SHINGLE_SIZE: int = 3 # words
+NUM_PERM: int = 128
+BANDS: int = 16
+DUPLICATE_THRESHOLD: float = 0.8
+MAX_NEAR_DUPLICATES: int = 10 # per recipe, the most similar
+
+_BIN_BITS = (NUM_PERM - 1).bit_length()
+_VALUE_MASK = 0xffffffff # the values are stored as 32 bits
+_EMPTY = _VALUE_MASK + 1
+_SIGNATURE_FORMAT = f'<{NUM_PERM}I'
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), 'little')
+
+def shingles(source: str) -> set[int]:
+    """The hashes of the runs of `SHINGLE_SIZE` words of `source`"""
+    words = re.findall(r'\w+', source.lower())
+    runs = max(len(words) - SHINGLE_SIZE + 1, 1 if words else 0)
+    return {_hash(' '.join(words[i:i + SHINGLE_SIZE]).encode('utf-8')) for i in range(runs)}
+
+def signature(source: str) -> list[int] | None:
+    """The MinHash signature of `source`, none without any words to compare"""
+    source_shingles = shingles(source)
+    if not source_shingles:
+        return None
+
+    values = [_EMPTY] * NUM_PERM
+    for shingle in source_shingles:
+        position = shingle & (NUM_PERM - 1)
+        value = (shingle >> _BIN_BITS) & _VALUE_MASK
+        if value < values[position]:
+            values[position] = value
+
+    # densification: an empty bin takes the value of the next non-empty one,
+    # shifted by the distance, so that two empty bins rarely agree by chance
+    dense = values[:]
+    for position in range(NUM_PERM):
+        distance = 1
+        while dense[position] == _EMPTY:
+            borrowed = values[(position + distance) % NUM_PERM]
+            if borrowed != _EMPTY:
+                dense[position] = (borrowed + distance * 0x9e3779b1) & _VALUE_MASK
+            distance += 1
+
+    return dense
+
+def pack_signature(values: list[int]) -> bytes:
+    return struct.pack(_SIGNATURE_FORMAT, *values)
+
+def unpack_signature(data: bytes) -> tuple[int, ...]:
+    return struct.unpack(_SIGNATURE_FORMAT, data)
+
+def similarity(a: tuple[int, ...] | list[int], b: tuple[int, ...] | list[int]) -> float:
+    """The estimated Jaccard similarity of the shingles of two recipes"""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+def buckets(values: list[int]) -> list[tuple[int, str]]:
+    """`(band, bucket)` of every band of the signature"""
+    data = pack_signature(values)
+    band_size = len(data) // BANDS
+    return [
+        (band, blake2b(data[band * band_size:(band + 1) * band_size], digest_size=8).hexdigest())
+        for band in range(BANDS)
+    ]
+
+# The index
+
+def index_recipe(db: Session, recipe_id: UUID, source: str, current_hash: str):
+    """(Re)index the source of the recipe, the caller commits"""
+    values = signature(source)
+
+    db.execute(delete(RecipeLshBucket).where(RecipeLshBucket.recipe_id == recipe_id))
+    db.execute(delete(RecipeSignature).where(RecipeSignature.recipe_id == recipe_id))
+
+    if values is None:
+        # all the sources without words would share every bucket
+        # and be duplicates of each other, so they are not indexed
+        return
+
+    db.execute(insert(RecipeSignature).values(
+        recipe_id=recipe_id,
+        source_hash=current_hash,
+        signature=pack_signature(values),
+        date_computed=datetime.utcnow()
+    ))
+    db.execute(insert(RecipeLshBucket), [
+        {'band': band, 'bucket': bucket, 'recipe_id': recipe_id} for band, bucket in buckets(values)
+    ])
+
+# made once, an alias copies the table
+_OWN_BUCKETS = aliased(RecipeLshBucket)
+_OTHER_BUCKETS = aliased(RecipeLshBucket)
+
+def near_duplicates(db: Session, recipe_ids: list[UUID]) -> dict[UUID, list[dict[str, Any]]]:
+    """
+    The near-duplicates of every recipe, the most similar first, in two
+    queries: the candidates from the shared buckets, then their signatures.
+    """
+    if not recipe_ids:
+        return {}
+
+    own, other = _OWN_BUCKETS, _OTHER_BUCKETS
+    pairs = db.execute(select(own.recipe_id, other.recipe_id).distinct()
+                       .join(other, (other.band == own.band) & (other.bucket == own.bucket) & (other.recipe_id != own.recipe_id))
+                       .where(own.recipe_id.in_(recipe_ids))).all()
+
+    result: dict[UUID, list[dict[str, Any]]] = {recipe_id: [] for recipe_id in recipe_ids}
+    if not pairs:
+        return result
+
+    ids = set(recipe_ids).union(candidate_id for _, candidate_id in pairs)
+    rows = db.execute(select(RecipeSignature.recipe_id, RecipeSignature.signature, Recipe.status)
+                      .join(Recipe, Recipe.id == RecipeSignature.recipe_id)
+                      .where(RecipeSignature.recipe_id.in_(ids))).all()
+    signatures = {row.recipe_id: unpack_signature(row.signature) for row in rows}
+    statuses = {row.recipe_id: row.status for row in rows}
+
+    for recipe_id, candidate_id in pairs:
+        if recipe_id not in signatures or candidate_id not in signatures:
+            continue
+
+        score = similarity(signatures[recipe_id], signatures[candidate_id])
+        if score >= DUPLICATE_THRESHOLD:
+            result[recipe_id].append({'id': candidate_id, 'status': statuses[candidate_id], 'similarity': score})
+
+    for duplicates in result.values():
+        duplicates.sort(key=lambda duplicate: duplicate['similarity'], reverse=True)
+        del duplicates[MAX_NEAR_DUPLICATES:]
+
+    return result
+
+def backfill_duplicates(engine: Engine, batch_size: int = 500, log: Callable[[str], None] = lambda line: None) -> dict[str, int]:
+    """Index every recipe that isn't indexed, or was edited since, one transaction per `batch_size` recipes"""
+    counts = {'recipes': 0, 'indexed': 0}
+    last_id: UUID | None = None
+
+    while True:
+        with Session(engine) as db:
+            rows = db.execute(select(Recipe.id, Recipe.source, RecipeSignature.source_hash)
+                              .outerjoin(RecipeSignature, RecipeSignature.recipe_id == Recipe.id)
+                              .where(true() if last_id is None else Recipe.id > last_id)
+                              .order_by(Recipe.id)
+                              .limit(batch_size)).all()
+            if not rows:
+                return counts
+
+            for row in rows:
+                current_hash = source_hash(row.source)
+                if row.source_hash != current_hash:
+                    index_recipe(db, row.id, row.source, current_hash)
+                    counts['indexed'] += 1
+            db.commit()
+
+        counts['recipes'] += len(rows)
+        last_id = rows[-1].id
+        log(f'checked up to {last_id}: {counts}')
+
+def main(argv: list[str]) -> int:
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(prog='python -m recipe.duplicates', description='Index the recipes for the near-duplicate detection.')
+    parser.add_argument('--db-url', help='defaults to the database configured with the `RECIPE_DATABASE_*` variables')
+    parser.add_argument('--batch-size', type=int, default=500, help='recipes per transaction')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.db_url or database_url_from_env())
+
+    start = perf_counter()
+    counts = backfill_duplicates(engine, args.batch_size, log=lambda line: print(line, file=sys.stderr))
+    print(f'Indexed {counts["indexed"]} of {counts["recipes"]} recipes in {perf_counter() - start:.1f} s.', file=sys.stderr)
+
+    engine.dispose()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
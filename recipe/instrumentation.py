@@ -0,0 +1,111 @@
+from falcon import Request, Response
+
+from sqlalchemy import Engine, event
+
+from contextvars import ContextVar
+from time import perf_counter
+import re
+
+from .log import logging
+
+DEFAULT_REPEAT_THRESHOLD: int = 10
+
+# `IN (?, ?, ?)` lists are expanded per call, so their length
+# must not make otherwise identical statements look different
+_PARAM = r'(?:\?|%\(\w+\)s|%s|:\w+)'
+_IN_LIST_RE = re.compile(r'\(\s*' + _PARAM + r'(?:\s*,\s*' + _PARAM + r')*\s*\)')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+class RepeatedQueryError(Exception):
+    shape: str
+    count: int
+
+    def __init__(self, shape: str, count: int):
+        super().__init__(f'The same statement was executed {count} times during one request: {shape}')
+        self.shape = shape
+        self.count = count
+
+class QueryStats:
+    """Statements issued while serving a single request"""
+
+    count: int
+    duration: float # sec
+    shapes: dict[str, int]
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = {}
+
+_current_stats: ContextVar[QueryStats | None] = ContextVar('query_stats', default=None)
+
+def statement_shape(statement: str) -> str:
+    shape = _WHITESPACE_RE.sub(' ', statement).strip()
+    return _IN_LIST_RE.sub('(...)', shape)
+
+def instrument_engine(engine: Engine, repeat_threshold: int = DEFAULT_REPEAT_THRESHOLD, raise_on_repeat: bool = False):
+    """
+    Count the statements and the time spent in the database for the
+    request that is currently being served (see `QueryInstrumentationMiddleware`).
+
+    When a statement of the same shape runs more than `repeat_threshold`
+    times in one request, it is most likely an N+1 lookup: a warning is
+    logged, or `RepeatedQueryError` is raised if `raise_on_repeat` is set.
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _current_stats.get()
+        if stats is None:
+            return
+
+        shape = statement_shape(statement)
+        repeats = stats.shapes.get(shape, 0) + 1
+        stats.shapes[shape] = repeats
+
+        if repeats > repeat_threshold:
+            if raise_on_repeat:
+                raise RepeatedQueryError(shape, repeats)
+            if repeats == repeat_threshold + 1:
+                logging.warning(f'Possible N+1 query: the statement was executed more than {repeat_threshold} times during one request: {shape}')
+
+        conn.info.setdefault('query_start_time', []).append(perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _current_stats.get()
+        if stats is None:
+            return
+
+        start_times: list[float] = conn.info.get('query_start_time', [])
+        if len(start_times) == 0:
+            return
+
+        stats.count += 1
+        stats.duration += perf_counter() - start_times.pop()
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # the statement failed, so `after_cursor_execute` is never called for it
+        if context.connection is not None:
+            start_times: list[float] = context.connection.info.get('query_start_time', [])
+            if len(start_times) > 0:
+                start_times.pop()
+
+class QueryInstrumentationMiddleware:
+    """Reports the per-request statement count and database time in the response headers"""
+
+    def process_request(self, req: Request, resp: Response):
+        stats = QueryStats()
+        req.context.query_stats = stats
+        req.context.query_stats_token = _current_stats.set(stats)
+
+    def process_response(self, req: Request, resp: Response, resource, req_succeeded: bool):
+        stats: QueryStats | None = getattr(req.context, 'query_stats', None)
+        if stats is None:
+            return
+
+        _current_stats.reset(req.context.query_stats_token)
+
+        resp.append_header('Server-Timing', f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries"')
+        resp.set_header('X-DB-Queries', str(stats.count))
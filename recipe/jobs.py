@@ -0,0 +1,366 @@
+"""
+Background jobs.
+
+The work that doesn't need to block the response (recomputing the
+rating of a recipe, creating its tags, refreshing the trending recipes)
+runs on a `JobRunner`: a bounded queue and a pool of threads in every
+worker, with named job types, retries with exponential backoff, and
+periodic jobs.
+
+The handlers call `jobs.enqueue_after_commit(session, name, payload)`:
+the job is queued once the transaction that made it necessary commits,
+and forgotten if it rolls back.
+
+With `outbox=True`, the job is also written to `job_outbox` in that same
+transaction, and the row is deleted once the job has succeeded. Every
+worker sweeps the table for the jobs that are due (left behind by a
+worker that was restarted or crashed, or waiting for a retry), and claims
+a row with a lease before running it, so that only one worker runs it at
+a time. Without the outbox, the queued jobs of a worker are lost if it
+exits before they run.
+
+A job may run more than once (a lease expires, a worker dies after the
+job has done its work), so the handlers must be idempotent. The payloads
+are stored as JSON.
+
+The threads are started on first use, or by `start_runners`, so that
+under gunicorn they run in the workers and not in the master.
+`stop_runners` stops taking new jobs and waits for the queued ones; it is
+called when a gunicorn worker exits (see `gunicorn.conf.py`) and at exit.
+"""
+
+from sqlalchemy import event, select, insert, update, delete
+from sqlalchemy.orm import Session, sessionmaker
+
+from .database.models import JobOutbox
+from .metrics import JOB_QUEUE_DEPTH, JOBS, JOB_LATENCY, JOB_DURATION
+from .log import logging
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from itertools import count
+from threading import Condition, Lock, Thread
+from time import monotonic, perf_counter
+from typing import Any, Callable
+from weakref import WeakSet
+import atexit
+import heapq
+import queue
+
+@dataclass
+class JobType:
+    name: str
+    handler: Callable[[dict[str, Any]], None]
+    retries: int # after the first attempt
+    backoff: float # seconds before the first retry, doubled for every next one
+    max_backoff: float
+
+@dataclass
+class Job:
+    name: str
+    payload: dict[str, Any]
+    attempt: int = 0
+    outbox_id: int | None = None
+    due: float = field(default_factory=monotonic) # `monotonic()` when the job may start
+    then: Callable[[], None] | None = None # once the job has succeeded or failed for good
+
+class JobRunner:
+
+    db_session: sessionmaker[Session]
+    workers: int # 0 runs the jobs in the thread that enqueues them
+    outbox: bool
+    sweep_interval: float # seconds between the sweeps of `job_outbox`
+    lease: float # seconds a worker may run a job before the others take it over
+
+    types: dict[str, JobType]
+
+    def __init__(
+        self,
+        db_sessionmaker: sessionmaker[Session],
+        workers: int = 4,
+        max_queue: int = 10000,
+        outbox: bool = False,
+        sweep_interval: float = 5.0,
+        lease: float = 300.0
+    ):
+        self.db_session = db_sessionmaker
+        self.workers = workers
+        self.outbox = outbox
+        self.sweep_interval = sweep_interval
+        self.lease = lease
+
+        self.types = {}
+
+        self._queue: queue.Queue[Job | None] = queue.Queue(max_queue)
+        self._lock = Lock()
+        self._wakeup = Condition(self._lock)
+        self._timers: list[tuple[float, int, Callable[[], None]]] = []
+        self._sequence = count()
+        self._outbox_ids: set[int] = set() # queued, waiting for a retry or running in this worker
+        self._threads: list[Thread] = []
+        self._started = False
+        self._stopping = False
+
+        self._info_key = f'jobs:{id(self)}'
+
+        @event.listens_for(db_sessionmaker, 'after_commit')
+        def after_commit(session: Session):
+            for job in session.info.pop(self._info_key, ()):
+                self._submit(job)
+
+        @event.listens_for(db_sessionmaker, 'after_rollback')
+        def after_rollback(session: Session):
+            session.info.pop(self._info_key, None)
+
+        _runners.add(self)
+
+    def register(self, name: str, handler: Callable[[dict[str, Any]], None], retries: int = 3, backoff: float = 1.0, max_backoff: float = 300.0):
+        self.types[name] = JobType(name, handler, retries, backoff, max_backoff)
+
+    def enqueue_after_commit(self, session: Session, name: str, payload: dict[str, Any]):
+        """Run the job `name` once `session` commits"""
+        if name not in self.types:
+            raise KeyError(f'Unknown job type: {name}')
+
+        outbox_id = None
+        if self.outbox:
+            now = datetime.utcnow()
+            outbox_id = session.connection().execute(insert(JobOutbox.__table__).values(
+                name=name, payload=payload, attempts=0, run_after=now, date_created=now
+            )).inserted_primary_key[0]
+
+        session.info.setdefault(self._info_key, []).append(Job(name, payload, outbox_id=outbox_id))
+
+    def enqueue(self, name: str, payload: dict[str, Any]):
+        """Run the job `name` as soon as possible, without the outbox"""
+        if name not in self.types:
+            raise KeyError(f'Unknown job type: {name}')
+        self._submit(Job(name, payload))
+
+    def every(self, interval: float, name: str, payload: dict[str, Any] | None = None):
+        """Run the job `name` every `interval` seconds after the previous run ends, starting in `interval` seconds"""
+        def tick():
+            self._submit(Job(name, payload or {}, then=lambda: self._schedule(interval, tick)))
+
+        self.start()
+        self._schedule(interval, tick)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    # Threads
+
+    def start(self):
+        with self._lock:
+            if self._started or self._stopping:
+                return
+            self._started = True
+
+            self._threads.append(Thread(target=self._run_timers, name='jobs-scheduler', daemon=True))
+            for i in range(self.workers):
+                self._threads.append(Thread(target=self._work, name=f'jobs-{i}', daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+        if self.outbox:
+            # the jobs left behind by the previous workers first
+            self._schedule(0, self._sweep)
+
+    def stop(self, timeout: float = 30.0):
+        """Stop taking new jobs, and wait up to `timeout` seconds for the queued ones"""
+        with self._wakeup:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._wakeup.notify_all()
+
+        deadline = monotonic() + timeout
+
+        # the workers exit once they get to the end of the queue
+        for _ in range(self.workers if self._started else 0):
+            try:
+                self._queue.put(None, timeout=max(deadline - monotonic(), 0))
+            except queue.Full:
+                break
+
+        for thread in self._threads:
+            thread.join(max(deadline - monotonic(), 0))
+
+        left = sum(1 for job in list(self._queue.queue) if job is not None)
+        if left:
+            logging.warning(f'{left} background jobs were not run before the shutdown' + (', they stay in the outbox' if self.outbox else ''))
+
+    def _schedule(self, delay: float, action: Callable[[], None]):
+        with self._wakeup:
+            heapq.heappush(self._timers, (monotonic() + delay, next(self._sequence), action))
+            self._wakeup.notify()
+
+    def _run_timers(self):
+        while True:
+            with self._wakeup:
+                while not self._stopping and (not self._timers or self._timers[0][0] > monotonic()):
+                    self._wakeup.wait(self._timers[0][0] - monotonic() if self._timers else None)
+                if self._stopping:
+                    return
+                _, _, action = heapq.heappop(self._timers)
+
+            try:
+                action()
+            except Exception as e:
+                logging.exception(e)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            JOB_QUEUE_DEPTH.dec()
+            self._run(job)
+
+    # Jobs
+
+    def _submit(self, job: Job):
+        if job.outbox_id is not None:
+            with self._lock:
+                if job.outbox_id in self._outbox_ids:
+                    return
+                self._outbox_ids.add(job.outbox_id)
+
+        self.start()
+        self._dispatch(job)
+
+    def _dispatch(self, job: Job):
+        if self._stopping:
+            # with the outbox, the next worker runs it
+            JOBS.labels(job.name, 'dropped').inc()
+            return
+
+        if self.workers == 0:
+            self._run(job)
+            return
+
+        try:
+            self._queue.put_nowait(job)
+            JOB_QUEUE_DEPTH.inc()
+        except queue.Full:
+            JOBS.labels(job.name, 'dropped').inc()
+            logging.warning(f'The job queue is full, dropped a `{job.name}` job' + (', it stays in the outbox' if job.outbox_id is not None else ''))
+            self._finish(job)
+
+    def _run(self, job: Job):
+        job_type = self.types[job.name]
+
+        try:
+            if job.outbox_id is not None and not self._claim(job.outbox_id):
+                # done or taken by another worker
+                self._finish(job, then=False)
+                return
+
+            JOB_LATENCY.labels(job.name).observe(max(monotonic() - job.due, 0))
+
+            start = perf_counter()
+            try:
+                job_type.handler(job.payload)
+            finally:
+                JOB_DURATION.labels(job.name).observe(perf_counter() - start)
+
+            if job.outbox_id is not None:
+                with self.db_session() as db:
+                    db.execute(delete(JobOutbox).where(JobOutbox.id == job.outbox_id))
+                    db.commit()
+
+        except Exception as e:
+            self._failed(job, job_type, e)
+            return
+
+        JOBS.labels(job.name, 'done').inc()
+        self._finish(job)
+
+    def _failed(self, job: Job, job_type: JobType, error: Exception):
+        attempt = job.attempt + 1
+        retry = attempt <= job_type.retries
+        delay = min(job_type.backoff * 2 ** job.attempt, job_type.max_backoff)
+
+        try:
+            if job.outbox_id is not None:
+                now = datetime.utcnow()
+                with self.db_session() as db:
+                    db.execute(update(JobOutbox)
+                               .where(JobOutbox.id == job.outbox_id)
+                               .values(
+                                   attempts=attempt,
+                                   locked_until=None,
+                                   run_after=now + timedelta(seconds=delay),
+                                   date_failed=None if retry else now,
+                                   last_error=repr(error)
+                               ))
+                    db.commit()
+        except Exception as e:
+            logging.exception(e)
+
+        if not retry:
+            JOBS.labels(job.name, 'failed').inc()
+            logging.error(f'The `{job.name}` job failed after {attempt} attempts', exc_info=error)
+            self._finish(job)
+            return
+
+        JOBS.labels(job.name, 'retried').inc()
+        logging.warning(f'The `{job.name}` job failed, retrying in {delay:.1f} s', exc_info=error)
+
+        retried = Job(job.name, job.payload, attempt, job.outbox_id, monotonic() + delay, job.then)
+        self._schedule(delay, lambda: self._dispatch(retried))
+
+    def _finish(self, job: Job, then: bool = True):
+        if job.outbox_id is not None:
+            with self._lock:
+                self._outbox_ids.discard(job.outbox_id)
+
+        if then and job.then is not None:
+            job.then()
+
+    # Outbox
+
+    def _claim(self, outbox_id: int) -> bool:
+        now = datetime.utcnow()
+        with self.db_session() as db:
+            claimed = db.execute(update(JobOutbox)
+                                 .where((JobOutbox.id == outbox_id)
+                                        & JobOutbox.date_failed.is_(None)
+                                        & (JobOutbox.locked_until.is_(None) | (JobOutbox.locked_until < now)))
+                                 .values(locked_until=now + timedelta(seconds=self.lease))
+                                 .execution_options(synchronize_session=False)).rowcount
+            db.commit()
+        return claimed == 1
+
+    def _sweep(self):
+        try:
+            now = datetime.utcnow()
+            with self.db_session() as db:
+                rows = db.execute(select(JobOutbox.id, JobOutbox.name, JobOutbox.payload, JobOutbox.attempts, JobOutbox.run_after)
+                                  .where(JobOutbox.date_failed.is_(None)
+                                         & (JobOutbox.run_after <= now)
+                                         & (JobOutbox.locked_until.is_(None) | (JobOutbox.locked_until < now)))
+                                  .order_by(JobOutbox.run_after)
+                                  .limit(max(self._queue.maxsize - self._queue.qsize(), 0) or 1)).all()
+
+            for outbox_id, name, payload, attempts, run_after in rows:
+                if name not in self.types:
+                    logging.warning(f'Unknown job type in the outbox: {name}')
+                    continue
+                self._submit(Job(name, payload, attempts, outbox_id, monotonic() - (now - run_after).total_seconds()))
+        finally:
+            if not self._stopping:
+                self._schedule(self.sweep_interval, self._sweep)
+
+_runners: WeakSet[JobRunner] = WeakSet()
+
+def start_runners():
+    for runner in list(_runners):
+        runner.start()
+
+@atexit.register
+def stop_runners(timeout: float = 30.0):
+    """Stop all runners, sharing `timeout` seconds"""
+    deadline = monotonic() + timeout
+    for runner in list(_runners):
+        runner.stop(max(deadline - monotonic(), 0))
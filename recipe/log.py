@@ -1,3 +1,172 @@
+"""
+Logging setup.
+
+Records are put into a queue on the request thread and formatted and
+written by a `QueueListener` thread, so no I/O happens on the request
+path. Every record carries the id and the route of the request during
+which it was emitted.
+
+The rest of the application logs through the root logger:
+
+    from .log import logging
+    logging.exception(e)
+"""
+
+import falcon
+from falcon import Request, Response
+
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from time import perf_counter
+from uuid import uuid4
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+REQUEST_ID_HEADER: str = 'X-Request-ID'
+
+request_id: ContextVar[str | None] = ContextVar('request_id', default=None)
+request_route: ContextVar[str | None] = ContextVar('request_route', default=None)
+
+access_logger = logging.getLogger('recipe.access')
+
+# Attributes of every `LogRecord`; anything else was passed with `extra=`
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'request_id', 'route'}
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """Attaches the request context and renders the message before the record leaves the request thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The root logger has no other handlers, so unlike the stdlib
+        # implementation the record is updated in place, without a copy
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+
+        # the traceback objects can't be formatted on another thread later
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+
+        record.request_id = request_id.get()
+        record.route = request_route.get()
+
+        return record
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'route': getattr(record, 'route', None)
+        }
+
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES:
+                data[key] = value
+
+        if record.exc_text:
+            data['exception'] = record.exc_text
+
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+TEXT_FORMAT: str = '%(asctime)s %(levelname)s [%(name)s] [%(request_id)s %(route)s] %(message)s'
+
+_listener: logging.handlers.QueueListener | None = None
+
+def configure_logging(level: str | None = None, fmt: str | None = None, stream=None) -> logging.handlers.QueueListener:
+    """
+    Replace the handlers of the root logger with the queue-based pipeline.
+
+    `level` defaults to `RECIPE_LOG_LEVEL` (`INFO`), `fmt` to `RECIPE_LOG_FORMAT`,
+    either `json` (default) or `text`. Safe to call more than once.
+    """
+    global _listener
+
+    level = level or os.environ.get('RECIPE_LOG_LEVEL', 'INFO')
+    fmt = fmt or os.environ.get('RECIPE_LOG_FORMAT', 'json')
+
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    # not used by the formatters, and slow to collect for every record
+    logging.logThreads = False
+    logging.logMultiprocessing = False
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(ContextQueueHandler(log_queue))
+    root.setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+
+    return _listener
+
+@atexit.register
+def flush_logging():
+    """Write out everything that is still in the queue"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+class AccessLogMiddleware:
+    """
+    Assigns an id to every request (or takes it from the `X-Request-ID`
+    header) and logs a sampled share of the requests. Server errors are
+    always logged.
+    """
+
+    sample_rate: float
+
+    def __init__(self, sample_rate: float = 1.0):
+        self.sample_rate = sample_rate
+
+    def process_request(self, req: Request, resp: Response):
+        rid = req.get_header(REQUEST_ID_HEADER) or uuid4().hex
+
+        req.context.access_log_start_time = perf_counter()
+        req.context.request_id_token = request_id.set(rid)
+        req.context.request_route_token = request_route.set(None)
+
+        resp.set_header(REQUEST_ID_HEADER, rid)
+
+    def process_resource(self, req: Request, resp: Response, resource, params):
+        request_route.set(req.uri_template)
+
+    def process_response(self, req: Request, resp: Response, resource, req_succeeded: bool):
+        start_time: float | None = getattr(req.context, 'access_log_start_time', None)
+        if start_time is None:
+            return
+
+        status = falcon.http_status_to_code(resp.status)
+
+        if status >= 500 or (self.sample_rate > 0 and random.random() < self.sample_rate):
+            access_logger.info(
+                f'{req.method} {req.relative_uri} {status}',
+                extra={
+                    'method': req.method,
+                    'path': req.path,
+                    'status': status,
+                    'duration_ms': round((perf_counter() - start_time) * 1000, 3)
+                }
+            )
 
-logging.basicConfig(level=logging.DEBUG)
\ No newline at end of file
+        request_route.reset(req.context.request_route_token)
+        request_id.reset(req.context.request_id_token)
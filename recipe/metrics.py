@@ -0,0 +1,202 @@
+"""
+Prometheus metrics.
+
+When the application runs under gunicorn with several workers, set
+the `PROMETHEUS_MULTIPROC_DIR` environment variable to an empty directory
+before the start. Every worker then writes its samples into memory-mapped
+files in that directory, and `/metrics` aggregates all of them, no matter
+which worker serves the scrape.
+"""
+
+import falcon
+from falcon import Request, Response
+
+from sqlalchemy import Engine, event
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+)
+from prometheus_client import multiprocess
+
+from time import perf_counter
+import os
+
+UNMATCHED_ROUTE: str = 'unmatched'
+
+HTTP_REQUESTS = Counter(
+    'recipe_http_requests_total',
+    'HTTP requests served, by route template and response status.',
+    ['method', 'route', 'status']
+)
+
+HTTP_REQUEST_DURATION = Histogram(
+    'recipe_http_request_duration_seconds',
+    'Time spent serving HTTP requests, by route template and response status.',
+    ['method', 'route', 'status'],
+    buckets=(.005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 10.0)
+)
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    'recipe_http_requests_in_flight',
+    'HTTP requests that are currently being served.',
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_CONNECTIONS = Gauge(
+    'recipe_db_pool_connections',
+    'Database connections opened by the connection pools.',
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_CHECKED_OUT = Gauge(
+    'recipe_db_pool_checked_out_connections',
+    'Database connections currently checked out of the connection pools.',
+    multiprocess_mode='livesum'
+)
+
+BCRYPT_DURATION = Histogram(
+    'recipe_bcrypt_duration_seconds',
+    'Time spent hashing and checking passwords.',
+    ['operation'], # hash, check
+    buckets=(.01, .025, .05, .1, .2, .3, .5, .75, 1.0, 2.0)
+)
+
+JWT_DURATION = Histogram(
+    'recipe_jwt_duration_seconds',
+    'Time spent encoding and decoding JWTs.',
+    ['operation'], # encode, decode
+    buckets=(.00005, .0001, .00025, .0005, .001, .0025, .005, .01)
+)
+
+CACHE_REQUESTS = Counter(
+    'recipe_cache_requests_total',
+    'Cache lookups, by cache and result (hit, miss).',
+    ['cache', 'result']
+)
+
+CACHE_EVICTIONS = Counter(
+    'recipe_cache_evictions_total',
+    'Entries removed from the caches, by cache and reason (size, expired, invalidated).',
+    ['cache', 'reason']
+)
+
+CACHE_INVALIDATION_MESSAGES = Counter(
+    'recipe_cache_invalidation_messages_total',
+    'Messages of the cache invalidation bus, by direction (published, received).',
+    ['direction']
+)
+
+CACHE_INVALIDATION_LAG = Histogram(
+    'recipe_cache_invalidation_lag_seconds',
+    'Time between the publication of an invalidation message and its receipt by another worker.',
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+)
+
+CACHE_INVALIDATION_LOST = Counter(
+    'recipe_cache_invalidation_lost_total',
+    'Times a worker may have missed invalidation messages (a gap or a reconnect) and dropped its caches.'
+)
+
+CACHE_INVALIDATION_BUS_UP = Gauge(
+    'recipe_cache_invalidation_bus_up',
+    'Whether every worker is subscribed to the cache invalidation bus.',
+    multiprocess_mode='livemin'
+)
+
+MODERATION_DECISIONS = Counter(
+    'recipe_moderation_decisions_total',
+    'Recipe status changes made by moderators, by the new status.',
+    ['status']
+)
+
+TRENDING_EVENTS = Counter(
+    'recipe_trending_events_processed_total',
+    'Bookmarks and ratings folded into the trending scores.'
+)
+
+TRENDING_REFRESH_DURATION = Histogram(
+    'recipe_trending_refresh_duration_seconds',
+    'Time spent processing the new activity and reloading the trending recipes.',
+    buckets=(.01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+JOB_QUEUE_DEPTH = Gauge(
+    'recipe_job_queue_depth',
+    'Background jobs waiting for a thread of the job runner.',
+    multiprocess_mode='livesum'
+)
+
+JOBS = Counter(
+    'recipe_jobs_total',
+    'Runs of background jobs, by the job type and the result: done, retried, failed or dropped (the queue was full).',
+    ['job', 'result']
+)
+
+JOB_LATENCY = Histogram(
+    'recipe_job_latency_seconds',
+    'Time from when a background job was due to when it started.',
+    ['job'],
+    buckets=(.001, .005, .01, .05, .1, .5, 1.0, 5.0, 10.0, 60.0, 300.0)
+)
+
+JOB_DURATION = Histogram(
+    'recipe_job_duration_seconds',
+    'Time spent running a background job.',
+    ['job'],
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+def multiprocess_mode() -> bool:
+    return 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+def instrument_pool(engine: Engine):
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        DB_POOL_CONNECTIONS.inc()
+
+    @event.listens_for(engine, 'close')
+    def close(dbapi_connection, connection_record):
+        DB_POOL_CONNECTIONS.dec()
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKED_OUT.inc()
+
+    @event.listens_for(engine, 'checkin')
+    def checkin(dbapi_connection, connection_record):
+        DB_POOL_CHECKED_OUT.dec()
+
+class MetricsMiddleware:
+    """Records the count and the latency of requests per Falcon route template"""
+
+    def process_request(self, req: Request, resp: Response):
+        req.context.request_start_time = perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+
+    def process_response(self, req: Request, resp: Response, resource, req_succeeded: bool):
+        start_time: float | None = getattr(req.context, 'request_start_time', None)
+        if start_time is None:
+            return
+
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+
+        # the template, not the path, to keep the label cardinality bounded
+        route = req.uri_template or UNMATCHED_ROUTE
+        status = str(falcon.http_status_to_code(resp.status))
+
+        HTTP_REQUESTS.labels(req.method, route, status).inc()
+        HTTP_REQUEST_DURATION.labels(req.method, route, status).observe(perf_counter() - start_time)
+
+class MetricsResource:
+
+    def on_get(self, req: Request, resp: Response):
+        if multiprocess_mode():
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+
+        resp.data = generate_latest(registry)
+        resp.content_type = CONTENT_TYPE_LATEST
+        resp.status = falcon.HTTP_200
@@ -0,0 +1,146 @@
+"""
+Sampling profiler for live requests.
+
+One request in every `sample_every` (and every request with an `X-Profile`
+header carrying an admin JWT) is run under `cProfile`. The profiles are
+aggregated per route template in memory and written as `pstats` files
+every `flush_interval` seconds, on rotation and at the exit of the worker:
+
+    <directory>/<route>.<pid>.pstats              the current aggregate
+    <directory>/<route>.<pid>.<timestamp>.pstats  rotated aggregates
+
+Every gunicorn worker writes its own files. Merge and inspect them with
+
+    python -c "import pstats, glob; pstats.Stats(*glob.glob('profiles/recipe_{_id_uuid}.*.pstats')).sort_stats('cumulative').print_stats(30)"
+
+or any `pstats`-compatible viewer (e.g. snakeviz).
+"""
+
+from falcon import Request, Response
+
+from .database.models import Authority
+
+from itertools import count
+from threading import Lock
+from time import time_ns, monotonic
+import atexit
+import cProfile
+import glob
+import os
+import pstats
+import re
+
+import jwt
+
+PROFILE_HEADER: str = 'X-Profile'
+
+class RouteProfile:
+    stats: pstats.Stats | None
+    samples: int
+    dirty: bool # has samples that aren't written yet
+
+    def __init__(self):
+        self.stats = None
+        self.samples = 0
+        self.dirty = False
+
+class ProfilingMiddleware:
+    directory: str
+    sample_every: int # 0 to profile only the requests with the header
+    rotate_after: int # samples per file
+    keep: int # rotated files per route and worker
+    flush_interval: float # seconds between the writes of the current aggregates
+
+    def __init__(self, directory: str, sample_every: int = 1000, rotate_after: int = 100, keep: int = 10, flush_interval: float = 60):
+        self.directory = directory
+        self.sample_every = sample_every
+        self.rotate_after = rotate_after
+        self.keep = keep
+        self.flush_interval = flush_interval
+
+        self._counter = count(1)
+        self._profiles: dict[str, RouteProfile] = {}
+        self._lock = Lock()
+        self._last_flush = monotonic()
+
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.flush)
+
+    def _sampled(self, req: Request) -> bool:
+        if self.sample_every > 0 and next(self._counter) % self.sample_every == 0:
+            return True
+
+        token = req.get_header(PROFILE_HEADER)
+        if token is None:
+            return False
+
+        try:
+            payload = jwt.decode(token, os.environ.get('RECIPE_APP_SECRET'), algorithms=['HS256'])
+        except Exception:
+            return False
+
+        return bool(payload.get('role', 0) & Authority.ADMIN)
+
+    def process_request(self, req: Request, resp: Response):
+        if not self._sampled(req):
+            return
+
+        profiler = cProfile.Profile()
+        req.context.profiler = profiler
+        profiler.enable()
+
+    def process_response(self, req: Request, resp: Response, resource, req_succeeded: bool):
+        profiler: cProfile.Profile | None = getattr(req.context, 'profiler', None)
+        if profiler is None:
+            return
+
+        profiler.disable()
+        self.record(req.uri_template or 'unmatched', profiler)
+
+    def _path(self, route: str, suffix: str = '') -> str:
+        name = re.sub(r'[^A-Za-z0-9_{}-]+', '_', route).strip('_') or 'root'
+        return os.path.join(self.directory, f'{name}.{os.getpid()}{suffix}.pstats')
+
+    def record(self, route: str, profiler: cProfile.Profile):
+        with self._lock:
+            profile = self._profiles.setdefault(route, RouteProfile())
+
+            if profile.stats is None:
+                profile.stats = pstats.Stats(profiler)
+            else:
+                profile.stats.add(profiler)
+            profile.samples += 1
+            profile.dirty = True
+
+            if profile.samples >= self.rotate_after:
+                profile.stats.dump_stats(self._path(route, f'.{time_ns()}'))
+                self._profiles[route] = RouteProfile()
+                self._remove_current(route)
+                self._remove_old(route)
+
+            if monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        """Write the current aggregates that have new samples"""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        for route, profile in self._profiles.items():
+            if profile.dirty:
+                profile.stats.dump_stats(self._path(route))
+                profile.dirty = False
+        self._last_flush = monotonic()
+
+    def _remove_current(self, route: str):
+        try:
+            os.remove(self._path(route))
+        except FileNotFoundError:
+            pass
+
+    def _remove_old(self, route: str):
+        current = self._path(route)
+        rotated = sorted(p for p in glob.glob(glob.escape(current[:-len('.pstats')]) + '.*.pstats'))
+        for path in rotated[:-self.keep]:
+            os.remove(path)
@@ -0,0 +1,217 @@
+"""
+Server-side rendering of the recipe Markdown (`format=html`).
+
+The Markdown is rendered with `markdown-it-py` (CommonMark, tables and
+strikethrough, raw HTML escaped), then sanitized with `nh3` against an
+allowlist of the tags that Markdown produces, so that the clients can
+insert the HTML as is.
+
+The HTML is stored in `rendered_sources`, keyed by `source_hash`: the
+SHA-256 of the source and of `RENDERER_VERSION`. A recipe keeps the hash
+of its source in `Recipe.source_hash`, set in the same transaction as the
+source, and the rendering itself is a background job (`render_source`).
+The recipes with the same source share one row, a source is rendered
+again only when it changes, and the rows are never updated, so they are
+cached without invalidation. Until its row exists, a recipe is rendered
+on the fly.
+
+Changing the renderer or the allowlist must bump `RENDERER_VERSION`; the
+existing recipes (and the ones loaded by `recipe.seed`) are then rendered
+in batches by
+
+    python -m recipe.render --batch-size 500 --workers 4
+"""
+
+from dotenv import load_dotenv
+
+from sqlalchemy import create_engine, select, update, delete, bindparam, true, Connection, Engine
+from sqlalchemy.orm import Session
+
+from markdown_it import MarkdownIt
+import nh3
+
+from .cache import Cache
+from .database.database import database_url_from_env, insert_or_ignore
+from .database.models import Recipe, RenderedSource
+
+from datetime import datetime
+from hashlib import sha256
+from multiprocessing import Pool
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
+from uuid import UUID
+import argparse
+import os
+import sys
+
+# part of every hash: bump it whenever the rendered HTML would change
+RENDERER_VERSION: int = 1
+
+ALLOWED_TAGS: set[str] = {
+    'p', 'br', 'hr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'em', 'strong', 'del', 's', 'code', 'pre', 'blockquote',
+    'ul', 'ol', 'li', 'a', 'img',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td'
+}
+
+ALLOWED_ATTRIBUTES: dict[str, set[str]] = {
+    'a': {'href', 'title'},
+    'img': {'src', 'alt', 'title'},
+    'ol': {'start'},
+    'code': {'class'} # the language of a fenced block
+}
+
+ALLOWED_URL_SCHEMES: set[str] = {'http', 'https', 'mailto'}
+
+_markdown = MarkdownIt('commonmark', {'html': False}).enable(['table', 'strikethrough'])
+
+def source_hash(source: str) -> str:
+    return sha256(f'{RENDERER_VERSION}\n{source}'.encode('utf-8')).hexdigest()
+
+def markdown_to_html(source: str) -> str:
+    """The HTML of the Markdown, not sanitized yet"""
+    return _markdown.render(source)
+
+def sanitize_html(html: str) -> str:
+    return nh3.clean(
+        html,
+        tags=ALLOWED_TAGS,
+        attributes=ALLOWED_ATTRIBUTES,
+        url_schemes=ALLOWED_URL_SCHEMES,
+        link_rel='nofollow noopener noreferrer'
+    )
+
+def render_markdown(source: str) -> str:
+    """Sanitized HTML of the Markdown"""
+    return sanitize_html(markdown_to_html(source))
+
+def store_rendered(conn: Connection, sources: dict[str, str], map_: Callable = map) -> int:
+    """
+    Render the sources (hash -> source) that are not stored yet, with
+    `map_` (`Pool.map` renders them in parallel). Returns how many were
+    rendered.
+    """
+    table = RenderedSource.__table__
+
+    stored = set(conn.execute(select(table.c.source_hash).where(table.c.source_hash.in_(sources))).scalars())
+    missing = [h for h in sources if h not in stored]
+    if not missing:
+        return 0
+
+    now = datetime.utcnow()
+    # a concurrent render of the same source is the same HTML
+    conn.execute(insert_or_ignore(conn.dialect.name, table).values([
+        {'source_hash': h, 'html': html, 'date_rendered': now}
+        for h, html in zip(missing, map_(render_markdown, [sources[h] for h in missing]))
+    ]))
+    return len(missing)
+
+def stored_html(db: Session, cache: Cache, hashes: Iterable[str | None]) -> dict[str, str]:
+    """The stored HTML of those hashes that are rendered, from `cache` (keyed by the hash)"""
+    hashes = {h for h in hashes if h is not None}
+    found = cache.get_many(hashes)
+
+    missing = [h for h in hashes if h not in found]
+    if missing:
+        loaded = dict(db.execute(select(RenderedSource.source_hash, RenderedSource.html)
+                                 .where(RenderedSource.source_hash.in_(missing))).all())
+        # the rows never change, no need for the versions
+        cache.set_many(loaded)
+        found.update(loaded)
+
+    return found
+
+def rendered_html(db: Session, cache: Cache, recipes: Iterable[Recipe]) -> dict[UUID, str]:
+    """The HTML of the recipes, stored or rendered on the fly"""
+    recipes = list(recipes)
+    found = stored_html(db, cache, [recipe.source_hash for recipe in recipes])
+
+    return {
+        recipe.id: found[recipe.source_hash] if recipe.source_hash in found else render_markdown(recipe.source)
+        for recipe in recipes
+    }
+
+def _batches(engine: Engine, batch_size: int) -> Iterator[tuple[Connection, list]]:
+    """`(id, source, source_hash)` of all recipes, one transaction per batch"""
+    recipes = Recipe.__table__
+    last_id: UUID | None = None
+
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select(recipes.c.id, recipes.c.source, recipes.c.source_hash)
+                                .where(true() if last_id is None else recipes.c.id > last_id)
+                                .order_by(recipes.c.id)
+                                .limit(batch_size)).all()
+            if not rows:
+                return
+
+            yield conn, rows
+
+        last_id = rows[-1].id
+
+def backfill_rendered(engine: Engine, batch_size: int = 500, workers: int = 1, log: Callable[[str], None] = lambda line: None) -> dict[str, int]:
+    """
+    Hash and render the sources of every recipe that are not rendered
+    with the current `RENDERER_VERSION`, one transaction per `batch_size`
+    recipes, then delete the rows no recipe refers to. An edit racing
+    with a batch keeps its own hash.
+    """
+    recipes = Recipe.__table__
+    table = RenderedSource.__table__
+
+    counts = {'recipes': 0, 'rehashed': 0, 'rendered': 0, 'deleted': 0}
+
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        for conn, rows in _batches(engine, batch_size):
+            sources = {source_hash(row.source): row.source for row in rows}
+
+            stale = [
+                {'b_id': row.id, 'b_source': row.source, 'b_source_hash': h}
+                for row in rows
+                if row.source_hash != (h := source_hash(row.source))
+            ]
+            if stale:
+                conn.execute(update(recipes)
+                             .where((recipes.c.id == bindparam('b_id')) & (recipes.c.source == bindparam('b_source')))
+                             .values(source_hash=bindparam('b_source_hash')),
+                             stale)
+
+            counts['recipes'] += len(rows)
+            counts['rehashed'] += len(stale)
+            counts['rendered'] += store_rendered(conn, sources, pool.map if pool is not None else map)
+
+            log(f'checked up to {rows[-1].id}: {counts}')
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    with engine.begin() as conn:
+        counts['deleted'] = conn.execute(delete(table)
+                                         .where(table.c.source_hash.not_in(select(recipes.c.source_hash)
+                                                                           .where(recipes.c.source_hash.is_not(None))))).rowcount
+
+    return counts
+
+def main(argv: list[str]) -> int:
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(prog='python -m recipe.render', description='Render the Markdown of the recipes that is not rendered yet.')
+    parser.add_argument('--db-url', help='defaults to the database configured with the `RECIPE_DATABASE_*` variables')
+    parser.add_argument('--batch-size', type=int, default=500, help='recipes per transaction')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='rendering processes')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.db_url or database_url_from_env())
+
+    start = perf_counter()
+    counts = backfill_rendered(engine, args.batch_size, args.workers, log=lambda line: print(line, file=sys.stderr))
+    print(f'Rendered {counts["rendered"]} sources of {counts["recipes"]} recipes in {perf_counter() - start:.1f} s, '
+          f'deleted {counts["deleted"]} unused renderings.', file=sys.stderr)
+
+    engine.dispose()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
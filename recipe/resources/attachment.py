@@ -0,0 +1,243 @@
+import falcon
+from falcon import Request, Response
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker, Session
+
+from ..util import check_auth
+from ..database.database import insert_or_ignore
+from ..database.models import Recipe, RecipeAttachment
+from ..validation import INTERNAL_ERROR_RESPONSE, ErrorResponse, AttachmentResponse, AttachmentListResponse
+from ..attachments import AttachmentStore, AttachmentTooLarge, UnsupportedAttachment, FileRange, sniff_image_type
+from ..log import logging
+from ..spec import api
+
+from spectree import Response as SpecResponse
+
+from datetime import datetime
+from typing import Any
+from uuid import UUID
+import os
+
+def attachment_data(attachment: RecipeAttachment) -> dict[str, Any]:
+    return {
+        'sha256': attachment.sha256,
+        'url': f'/attachment/{attachment.sha256}',
+        'content_type': attachment.content_type,
+        'size': attachment.size,
+        'date_added': falcon.dt_to_http(attachment.date_added)
+    }
+
+class AttachmentResource:
+
+    db_session: sessionmaker[Session]
+    store: AttachmentStore
+    max_size: int # bytes
+
+    def __init__(self, db_sessionmaker: sessionmaker[Session], store: AttachmentStore, max_size: int):
+        self.db_session = db_sessionmaker
+        self.store = store
+        self.max_size = max_size
+
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_201=AttachmentResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_404=ErrorResponse,
+            HTTP_413=ErrorResponse,
+            HTTP_415=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        path_parameter_descriptions={
+            '_id': 'A UUID that corresponds to a recipe.'
+        }
+    )
+    @falcon.before(check_auth)
+    def on_post_recipe(self, req: Request, resp: Response, _id: UUID):
+        try:
+            user_id: UUID = req.context.user_id
+
+            # not holding a connection while the body is uploaded
+            with self.db_session() as db:
+                author_id = db.scalar(select(Recipe.author_id).where(Recipe.id == _id))
+
+            if author_id is None:
+                resp.media = {
+                    'value': None,
+                    'errors': ['No recipe with such id was found.']
+                }
+                resp.status = falcon.HTTP_404
+                return
+
+            if author_id != user_id:
+                resp.media = {
+                    'value': None,
+                    'errors': ['Only the author can attach photos to the recipe.']
+                }
+                resp.status = falcon.HTTP_403
+                return
+
+            too_large = {
+                'value': None,
+                'errors': [f'The attachment must not be larger than {self.max_size} bytes.']
+            }
+
+            if req.content_length is not None and req.content_length > self.max_size:
+                resp.media = too_large
+                resp.status = falcon.HTTP_413
+                return
+
+            try:
+                digest, content_type, size = self.store.save(req.bounded_stream, self.max_size)
+            except AttachmentTooLarge:
+                resp.media = too_large
+                resp.status = falcon.HTTP_413
+                return
+            except UnsupportedAttachment:
+                resp.media = {
+                    'value': None,
+                    'errors': ['Only JPEG, PNG, GIF and WebP images can be attached.']
+                }
+                resp.status = falcon.HTTP_415
+                return
+
+            attachment = RecipeAttachment(recipe_id=_id, sha256=digest, content_type=content_type, size=size, date_added=datetime.utcnow())
+
+            with self.db_session() as db:
+                # attaching the same photo twice is a no-op
+                conn = db.connection()
+                conn.execute(insert_or_ignore(conn.dialect.name, RecipeAttachment.__table__).values(
+                    recipe_id=attachment.recipe_id,
+                    sha256=attachment.sha256,
+                    content_type=attachment.content_type,
+                    size=attachment.size,
+                    date_added=attachment.date_added
+                ))
+                db.commit()
+
+            resp.location = f'/attachment/{digest}'
+            resp.media = {
+                'value': attachment_data(attachment),
+                'errors': None
+            }
+            resp.status = falcon.HTTP_201
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
+
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_200=AttachmentListResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        path_parameter_descriptions={
+            '_id': 'A UUID that corresponds to a recipe.'
+        }
+    )
+    @falcon.before(check_auth)
+    def on_get_recipe(self, req: Request, resp: Response, _id: UUID):
+        try:
+            with self.db_session() as db:
+                attachments = db.scalars(select(RecipeAttachment)
+                                         .where(RecipeAttachment.recipe_id == _id)
+                                         .order_by(RecipeAttachment.date_added)).all()
+
+                resp.media = {
+                    'value': [attachment_data(attachment) for attachment in attachments],
+                    'errors': None
+                }
+                resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
+
+    @api.validate(
+        resp=SpecResponse(
+            'HTTP_200',
+            'HTTP_206',
+            'HTTP_304',
+            'HTTP_416',
+            HTTP_404=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        path_parameter_descriptions={
+            'sha256': 'The SHA-256 of the attachment, as in its `url`.'
+        }
+    )
+    def on_get(self, req: Request, resp: Response, sha256: str):
+        # Not authorized: the photos are loaded by the `<img>` tags of the
+        # rendered recipes, and the hash of a photo can't be guessed.
+
+        # an invalid `Range` is a bad request
+        requested_range = req.range
+
+        try:
+            file = self.store.open(sha256)
+
+            if file is None:
+                resp.media = {
+                    'value': None,
+                    'errors': ['No attachment with such hash was found.']
+                }
+                resp.status = falcon.HTTP_404
+                return
+
+            try:
+                size = os.fstat(file.fileno()).st_size
+
+                # the content of a URL never changes
+                resp.etag = sha256
+                resp.cache_control = ['public', 'max-age=31536000', 'immutable']
+                resp.accept_ranges = 'bytes'
+
+                if req.if_none_match is not None and any(tag == '*' or tag == sha256 for tag in req.if_none_match):
+                    file.close()
+                    resp.content_type = None # no content
+                    resp.status = falcon.HTTP_304
+                    return
+
+                resp.content_type = sniff_image_type(file.read(12)) or falcon.MEDIA_OCTET_STREAM
+                resp.set_header('X-Content-Type-Options', 'nosniff')
+
+                start, length = 0, size
+                resp.status = falcon.HTTP_200
+
+                if requested_range is not None:
+                    first, last = requested_range
+                    if first < 0:
+                        # the last `-first` bytes
+                        start = max(size + first, 0)
+                        end = size - 1
+                    else:
+                        start = first
+                        end = size - 1 if last < 0 else min(last, size - 1)
+
+                    if start >= size:
+                        file.close()
+                        resp.content_type = None
+                        resp.set_header('Content-Range', f'bytes */{size}')
+                        resp.status = falcon.HTTP_416
+                        return
+
+                    length = end - start + 1
+                    resp.content_range = (start, end, size)
+                    resp.status = falcon.HTTP_206
+
+                resp.stream = FileRange(file, start, length)
+                resp.content_length = length
+
+            except BaseException:
+                file.close()
+                raise
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
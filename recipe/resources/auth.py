@@ -12,6 +12,7 @@ from ..validation import (
 )
 from ..security import authorize_user
 from ..log import logging
+from ..metrics import BCRYPT_DURATION
 
 import bcrypt
 
@@ -51,7 +52,10 @@ class AuthResource:
                 
                 user_password = db.execute(select(UserPassword).where(UserPassword.user_id == user.id)).scalar()
 
-                if not bcrypt.checkpw(password.encode('utf-8'), user_password.hashed_password):
+                with BCRYPT_DURATION.labels('check').time():
+                    password_matches = bcrypt.checkpw(password.encode('utf-8'), user_password.hashed_password)
+
+                if not password_matches:
                     resp.media = resp.media = {
                         'value': None,
                         'errors': ['The password is incorrect.']
@@ -109,7 +113,8 @@ class AuthResource:
                 db.commit()
                 db.refresh(new_user)
 
-                hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+                with BCRYPT_DURATION.labels('hash').time():
+                    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
 
                 new_user_id = new_user.id
 
@@ -1,34 +1,145 @@
 import falcon
 from falcon import Request, Response
 
-from sqlalchemy import select, func
+from sqlalchemy import select, delete, func, tuple_, Row
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, Session
 
-from ..util import check_auth
+from ..util import check_auth, PaginationError
+from ..database.database import insert_or_ignore
 from ..database.models import BookmarkedRecipe, RatedRecipe, Recipe, Status
 from ..validation import (
-    BookmarkedRecipeCreate, ResponseWrapper, INTERNAL_ERROR_RESPONSE,
-    PaginationParams, PaginatedRecipeResponse, ErrorResponse, RecipeData
+    BookmarkedRecipeCreate, ResponseWrapper, INTERNAL_ERROR_RESPONSE, ErrorResponse, RecipeData,
+    BookmarkFeedParams, BookmarkFeedResponse, BookmarkBatchRequest, BookmarkBatchResponse
 )
+from ..cache import Cache, invalidate_after_commit
+from ..bookmarks import bookmark_set
+from ..counters import bump_counter
+from ..trending import record_activity, BOOKMARK_WEIGHT
+from ..affinity import bump_affinity
+from ..render import rendered_html
+from .recipe import shared_recipe_data, included_authors
 from ..log import logging
 from ..spec import api
 
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
 from uuid import UUID
+import binascii
 import math
 
 from spectree import Response as SpecResponse
 
+def encode_cursor(date_added: datetime, recipe_id: UUID) -> str:
+    """The position of a bookmark in the feed, opaque to the clients"""
+    return urlsafe_b64encode(f'{date_added.isoformat()}|{recipe_id}'.encode('ascii')).decode('ascii')
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        date_added, recipe_id = urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+        return datetime.fromisoformat(date_added), UUID(recipe_id)
+    except (ValueError, binascii.Error):
+        raise PaginationError(['The `after` parameter is not a valid cursor.'])
+
+def bookmark_feed(
+    db: Session,
+    user_id: UUID,
+    limit: int,
+    offset: int = 0,
+    after: tuple[datetime, UUID] | None = None,
+    hide_denied: bool = False
+) -> list[Row]:
+    """
+    The user's bookmarked recipes, the latest bookmarks first, with the
+    user's scores: rows of `(Recipe, date_added, score)`, in one query.
+
+    With `after` (the `date_added` and the recipe id of the last bookmark
+    of the previous page), `offset` is ignored and the index on
+    `(user_id, date_added, recipe_id)` is scanned from that position.
+    """
+    statement = (select(Recipe, BookmarkedRecipe.date_added, RatedRecipe.score)
+                 .select_from(BookmarkedRecipe)
+                 .join(Recipe, Recipe.id == BookmarkedRecipe.recipe_id)
+                 .outerjoin(RatedRecipe, (RatedRecipe.recipe_id == BookmarkedRecipe.recipe_id) & (RatedRecipe.user_id == user_id))
+                 .where(BookmarkedRecipe.user_id == user_id)
+                 .order_by(BookmarkedRecipe.date_added.desc(), BookmarkedRecipe.recipe_id.desc())
+                 .limit(limit))
+
+    if hide_denied:
+        statement = statement.where(Recipe.status != Status.DENIED)
+
+    if after is not None:
+        statement = statement.where(tuple_(BookmarkedRecipe.date_added, BookmarkedRecipe.recipe_id) < tuple_(*after))
+    else:
+        statement = statement.offset(offset)
+
+    return db.execute(statement).all()
+
+def add_bookmarks(db: Session, user_id: UUID, recipe_ids: list[UUID], now: datetime) -> tuple[set[UUID], set[UUID]]:
+    """
+    Bookmark the approved recipes among `recipe_ids` with one
+    `INSERT ... ON CONFLICT DO NOTHING`. Returns the ids of the approved
+    recipes and of the bookmarks that were actually added.
+    """
+    conn = db.connection()
+    recipes = Recipe.__table__
+    bookmarks = BookmarkedRecipe.__table__
+
+    approved = set(conn.execute(select(recipes.c.id)
+                                .where(recipes.c.id.in_(recipe_ids) & (recipes.c.status == Status.APPROVED))).scalars())
+    if not approved:
+        return approved, set()
+
+    statement = insert_or_ignore(conn.dialect.name, bookmarks).values([
+        {'user_id': user_id, 'recipe_id': recipe_id, 'date_added': now}
+        for recipe_id in approved
+    ])
+
+    if conn.dialect.insert_returning:
+        added = set(conn.execute(statement.returning(bookmarks.c.recipe_id)).scalars())
+    else:
+        existing = set(conn.execute(select(bookmarks.c.recipe_id)
+                                    .where((bookmarks.c.user_id == user_id) & bookmarks.c.recipe_id.in_(approved))).scalars())
+        conn.execute(statement)
+        added = approved - existing
+
+    return approved, added
+
+def remove_bookmarks(db: Session, user_id: UUID, recipe_ids: list[UUID]) -> set[UUID]:
+    """One `DELETE ... WHERE recipe_id IN`. Returns the ids of the removed bookmarks"""
+    conn = db.connection()
+    bookmarks = BookmarkedRecipe.__table__
+
+    statement = delete(bookmarks).where((bookmarks.c.user_id == user_id) & bookmarks.c.recipe_id.in_(recipe_ids))
+
+    if conn.dialect.delete_returning:
+        return set(conn.execute(statement.returning(bookmarks.c.recipe_id)).scalars())
+
+    removed = set(conn.execute(select(bookmarks.c.recipe_id)
+                               .where((bookmarks.c.user_id == user_id) & bookmarks.c.recipe_id.in_(recipe_ids))).scalars())
+    conn.execute(statement)
+    return removed
+
 class BookmarkResource:
 
     db_session: sessionmaker[Session]
+    bookmark_cache: Cache # user id -> `BookmarkSet.data`
+    affinity_cache: Cache # user id -> the top tags of `user_tag_affinity`
+    html_cache: Cache # source hash -> the rendered HTML
+    user_cache: Cache # user id -> the serialized user, for `include=author`
 
-    def __init__(self, db_sessionmaker: sessionmaker[Session]):
+    def __init__(self, db_sessionmaker: sessionmaker[Session], bookmark_cache: Cache, affinity_cache: Cache, html_cache: Cache, user_cache: Cache):
         self.db_session = db_sessionmaker
+        self.bookmark_cache = bookmark_cache
+        self.affinity_cache = affinity_cache
+        self.html_cache = html_cache
+        self.user_cache = user_cache
 
     @api.validate(
-        query=PaginationParams,
+        query=BookmarkFeedParams,
         resp=SpecResponse(
-            HTTP_200=PaginatedRecipeResponse,
+            HTTP_200=BookmarkFeedResponse,
+            HTTP_400=ErrorResponse,
             HTTP_401=ErrorResponse,
             HTTP_403=ErrorResponse,
             HTTP_500=ErrorResponse
@@ -36,50 +147,57 @@ class BookmarkResource:
     )
     @falcon.before(check_auth)
     def on_get(self, req: Request, resp: Response):
+        # an invalid cursor is a bad request (see `handle_pagination_error`)
+        after = None
+        if req.context.query.after is not None:
+            after = decode_cursor(req.context.query.after)
+
         try:
             page: int = req.context.query.page
             elements: int = req.context.query.elements
+            hide_denied: bool = req.context.query.hide_denied
+            output_format: str = req.context.query.format
+            include: str | None = req.context.query.include
             user_id: UUID = req.context.user_id
 
             with self.db_session() as db:
-                records = db.scalars(select(BookmarkedRecipe)
-                                    .where(BookmarkedRecipe.user_id == user_id)
-                                    .order_by(BookmarkedRecipe.date_added.desc())
-                                    .offset((page - 1) * elements)
-                                    .limit(elements)).all()
-                
-                recipe_ids = [rec.recipe_id for rec in records]
-
-                recipes = db.scalars(select(Recipe).where(Recipe.id.in_(recipe_ids))).all()
-
-                res_data = []
-                for recipe in recipes:
-                    rating_record = db.scalar(select(RatedRecipe).where((RatedRecipe.recipe_id == recipe.id) & (RatedRecipe.user_id == user_id)))
-
-                    data = RecipeData(
-                        id=recipe.id,
-                        source=recipe.source,
-                        author_id=recipe.author_id,
-                        date_created=falcon.dt_to_http(recipe.date_created),
-                        date_edited=falcon.dt_to_http(recipe.date_edited),
-                        rating=recipe.rating,
-                        status=recipe.status,
-                        bookmarked=True,
-                        user_score=rating_record.score if rating_record is not None else None,
-                    )
+                rows = bookmark_feed(db, user_id, elements + 1, (page - 1) * elements, after, hide_denied)
+
+                next_cursor = None
+                if len(rows) > elements:
+                    rows = rows[:elements]
+                    next_cursor = encode_cursor(rows[-1].date_added, rows[-1].Recipe.id)
+
+                if hide_denied:
+                    total_records: int = db.scalar(select(func.count())
+                                                   .select_from(BookmarkedRecipe)
+                                                   .join(Recipe, Recipe.id == BookmarkedRecipe.recipe_id)
+                                                   .where((BookmarkedRecipe.user_id == user_id) & (Recipe.status != Status.DENIED)))
+                else:
+                    total_records = len(bookmark_set(db, self.bookmark_cache, user_id))
 
-                    res_data.append(data)
+                html = rendered_html(db, self.html_cache, [row.Recipe for row in rows]) if output_format == 'html' else None
 
-                query = select(func.count()).select_from(BookmarkedRecipe)
-                total_records: int = db.scalar(query)
+                res_data = [
+                    RecipeData(
+                        **shared_recipe_data(row.Recipe),
+                        bookmarked=True,
+                        user_score=row.score,
+                        html=None if html is None else html[row.Recipe.id]
+                    )
+                    for row in rows
+                ]
 
                 resp.media = {
                     'value': {
                         'totalPages': math.ceil(total_records / elements),
-                        'data': [d.serialize() for d in res_data]
+                        'data': [d.serialize() for d in res_data],
+                        'next': next_cursor
                     },
                     'errors': None
                 }
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, res_data)
         except Exception as e:
             resp.media = INTERNAL_ERROR_RESPONSE
             resp.status = falcon.HTTP_500
@@ -133,7 +251,21 @@ class BookmarkResource:
                 bookmark = BookmarkedRecipe(c)
 
                 db.add(bookmark)
-                db.commit()
+                bump_counter(db, 'bookmark_count', [recipe_id], 1)
+                record_activity(db, [recipe_id], BOOKMARK_WEIGHT, bookmark.date_added)
+                bump_affinity(db, self.affinity_cache, user_id, [recipe_id], BOOKMARK_WEIGHT)
+
+                try:
+                    db.commit()
+                except IntegrityError:
+                    # a concurrent request has added it first
+                    db.rollback()
+                    resp.media = {
+                        'value': None,
+                        'errors': ['The bookmark is already added.']
+                    }
+                    resp.status = falcon.HTTP_200
+                    return
         
                 resp.media = {
                     'value': None,
@@ -175,6 +307,8 @@ class BookmarkResource:
                     return
                 
                 db.delete(bookmark)
+                bump_counter(db, 'bookmark_count', [recipe_id], -1)
+                bump_affinity(db, self.affinity_cache, user_id, [recipe_id], -BOOKMARK_WEIGHT)
                 db.commit()
 
                 resp.media = {
@@ -185,4 +319,85 @@ class BookmarkResource:
         except Exception as e:
             resp.media = INTERNAL_ERROR_RESPONSE
             resp.status = falcon.HTTP_500
-            logging.exception(e)
\ No newline at end of file
+            logging.exception(e)
+
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_200=BookmarkBatchResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        json=BookmarkBatchRequest
+    )
+    @falcon.before(check_auth)
+    def on_post_batch(self, req: Request, resp: Response):
+        try:
+            user_id: UUID = req.context.user_id
+            recipe_ids = list(dict.fromkeys(req.context.json.ids))
+
+            with self.db_session() as db:
+                now = datetime.utcnow()
+                approved, added = add_bookmarks(db, user_id, recipe_ids, now)
+
+                if added:
+                    bump_counter(db, 'bookmark_count', added, 1)
+                    record_activity(db, added, BOOKMARK_WEIGHT, now)
+                    bump_affinity(db, self.affinity_cache, user_id, added, BOOKMARK_WEIGHT)
+                    # a Core statement, so the bookmark set is dropped explicitly
+                    invalidate_after_commit(db, self.bookmark_cache, [user_id])
+                db.commit()
+
+            def result(recipe_id: UUID) -> str:
+                if recipe_id in added:
+                    return 'added'
+                return 'exists' if recipe_id in approved else 'not_found'
+
+            resp.media = {
+                'value': [{'id': str(recipe_id), 'result': result(recipe_id)} for recipe_id in recipe_ids],
+                'errors': None
+            }
+            resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
+
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_200=BookmarkBatchResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        json=BookmarkBatchRequest
+    )
+    @falcon.before(check_auth)
+    def on_delete_batch(self, req: Request, resp: Response):
+        try:
+            user_id: UUID = req.context.user_id
+            recipe_ids = list(dict.fromkeys(req.context.json.ids))
+
+            with self.db_session() as db:
+                removed = remove_bookmarks(db, user_id, recipe_ids)
+
+                if removed:
+                    bump_counter(db, 'bookmark_count', removed, -1)
+                    bump_affinity(db, self.affinity_cache, user_id, removed, -BOOKMARK_WEIGHT)
+                    invalidate_after_commit(db, self.bookmark_cache, [user_id])
+                db.commit()
+
+            resp.media = {
+                'value': [
+                    {'id': str(recipe_id), 'result': 'removed' if recipe_id in removed else 'not_found'}
+                    for recipe_id in recipe_ids
+                ],
+                'errors': None
+            }
+            resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
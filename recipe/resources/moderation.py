@@ -0,0 +1,120 @@
+import falcon
+from falcon import Request, Response
+
+from sqlalchemy import select, update, or_
+from sqlalchemy.orm import sessionmaker, Session
+
+from ..util import check_auth
+from ..database.models import Recipe, Status, Authority
+from ..validation import (
+    INTERNAL_ERROR_RESPONSE, ErrorResponse,
+    ModerationClaimParams, ModerationClaimResponse
+)
+from ..bookmarks import bookmark_set
+from ..cache import Cache
+from .recipe import viewer_recipe_data, included_authors
+
+from ..log import logging
+from ..spec import api
+
+from spectree import Response as SpecResponse
+
+from datetime import datetime, timedelta
+from uuid import UUID
+
+def claim_pending(db: Session, moderator_id: UUID, n: int, now: datetime, expires_at: datetime) -> list[Recipe]:
+    """
+    Lease up to `n` pending recipes, oldest first, to the moderator: the
+    ones without a lease, with an expired lease, or already leased to
+    them (their leases are renewed). Commit to keep the leases.
+
+    On PostgreSQL, concurrent claims skip the rows locked by each other.
+    SQLite has no row locks, but the first write of a transaction locks
+    the whole database until the commit, so the claims are serialized.
+    """
+
+    # Core statements: the leases are not a part of the cached recipes,
+    # and an ORM bulk update would drop the whole recipe cache
+    conn = db.connection()
+    recipes = Recipe.__table__
+
+    if conn.dialect.name == 'sqlite':
+        conn.execute(update(recipes)
+                     .where((recipes.c.status == Status.PENDING) & (recipes.c.lease_expires_at <= now))
+                     .values(lease_owner_id=None, lease_expires_at=None))
+
+    ids = conn.execute(select(recipes.c.id)
+                       .where((recipes.c.status == Status.PENDING) & or_(
+                           recipes.c.lease_expires_at.is_(None),
+                           recipes.c.lease_expires_at <= now,
+                           recipes.c.lease_owner_id == moderator_id
+                       ))
+                       .order_by(recipes.c.date_created)
+                       .limit(n)
+                       .with_for_update(skip_locked=True)).scalars().all()
+
+    if not ids:
+        return []
+
+    conn.execute(update(recipes)
+                 .where(recipes.c.id.in_(ids))
+                 .values(lease_owner_id=moderator_id, lease_expires_at=expires_at))
+
+    return db.scalars(select(Recipe)
+                      .where(Recipe.id.in_(ids))
+                      .order_by(Recipe.date_created)).all()
+
+class ModerationResource:
+
+    db_session: sessionmaker[Session]
+    bookmark_cache: Cache # user id -> `BookmarkSet.data`
+    user_cache: Cache # user id -> the serialized user, for `include=author`
+    lease_duration: timedelta
+
+    def __init__(self, db_sessionmaker: sessionmaker, bookmark_cache: Cache, user_cache: Cache, lease_duration: float = 600):
+        self.db_session = db_sessionmaker
+        self.bookmark_cache = bookmark_cache
+        self.user_cache = user_cache
+        self.lease_duration = timedelta(seconds=lease_duration)
+
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_200=ModerationClaimResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        query=ModerationClaimParams
+    )
+    @falcon.before(check_auth, Authority.MODERATOR | Authority.ADMIN)
+    def on_post_claim(self, req: Request, resp: Response):
+        try:
+            n: int = req.context.query.n
+            include: str | None = req.context.query.include
+            user_id: UUID = req.context.user_id
+
+            now = datetime.utcnow()
+            expires_at = now + self.lease_duration
+
+            with self.db_session() as db:
+                recipes = claim_pending(db, user_id, n, now, expires_at)
+                db.commit()
+
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
+                res_data = viewer_recipe_data(db, bookmarks, user_id, recipes)
+
+                resp.media = {
+                    'value': {
+                        'expires': falcon.dt_to_http(expires_at),
+                        'data': [d.serialize() for d in res_data]
+                    },
+                    'errors': None
+                }
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, res_data)
+                resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
@@ -1,9 +1,11 @@
 import falcon
 from falcon import Request, Response
 
-from sqlalchemy import select
+from sqlalchemy import select, update, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, Session
 
+from datetime import datetime
 from uuid import UUID
 
 from ..database.models import RatedRecipe, Recipe
@@ -12,17 +14,49 @@ from ..validation import (
     RatingResponse, RatingRequest, ErrorResponse, PaginationParams
 )
 from ..util import check_auth
+from ..counters import bump_counter
+from ..trending import record_activity, rating_weight
+from ..affinity import bump_affinity, rating_affinity
+from ..cache import Cache, invalidate_after_commit
+from ..jobs import JobRunner
 from ..log import logging
 from ..spec import api
 
 from spectree import Response as SpecResponse
 
+def recompute_rating(db: Session, recipe_id: UUID):
+    """Set the rating of the recipe to the average score, in one `UPDATE`"""
+    recipes = Recipe.__table__
+    average = (select(func.coalesce(func.avg(RatedRecipe.score), 0))
+               .where(RatedRecipe.recipe_id == recipe_id)
+               .scalar_subquery())
+
+    db.connection().execute(update(recipes).where(recipes.c.id == recipe_id).values(rating=average))
+
 class RatingResource:
     
     db_session: sessionmaker[Session]
+    recipe_cache: Cache # recipe id -> the shared part of `RecipeData`
+    affinity_cache: Cache # user id -> the top tags of `user_tag_affinity`
+    jobs: JobRunner
 
-    def __init__(self, db_sessionmaker: sessionmaker[Session]):
+    def __init__(self, db_sessionmaker: sessionmaker[Session], recipe_cache: Cache, affinity_cache: Cache, jobs: JobRunner):
         self.db_session = db_sessionmaker
+        self.recipe_cache = recipe_cache
+        self.affinity_cache = affinity_cache
+        self.jobs = jobs
+
+        jobs.register('recompute_rating', self.recompute_rating)
+
+    def recompute_rating(self, payload: dict):
+        recipe_id = UUID(payload['recipe_id'])
+
+        with self.db_session() as db:
+            recompute_rating(db, recipe_id)
+
+            # a Core statement, so the recipe is dropped from the cache explicitly
+            invalidate_after_commit(db, self.recipe_cache, [recipe_id])
+            db.commit()
 
     @api.validate(
         resp=SpecResponse(
@@ -64,6 +98,36 @@ class RatingResource:
             resp.status = falcon.HTTP_500
             logging.exception(e)
     
+    def _rate(self, db: Session, user_id: UUID, recipe_id: UUID, score: float):
+        """Add or update the rating of the user, with its counter, trending and affinity changes"""
+        existing_rating = db.scalar(select(RatedRecipe)
+                                    .where((RatedRecipe.recipe_id == recipe_id) & (RatedRecipe.user_id == user_id)))
+
+        c = RatedRecipeCreate(
+            user_id=user_id,
+            recipe_id=recipe_id,
+            score=score
+        )
+
+        if existing_rating is None:
+            previous_score = None
+            db.add(RatedRecipe(c))
+            bump_counter(db, 'rating_count', [recipe_id], 1)
+        else:
+            previous_score = existing_rating.score
+            existing_rating.score = c.score
+
+        # a re-rate counts only the raised weight, the scores can't go down
+        weight = rating_weight(score) - (rating_weight(previous_score) if previous_score is not None else 0)
+        if weight > 0:
+            record_activity(db, [recipe_id], weight, datetime.utcnow())
+
+        # the new score may turn a "like" into a plain rating, or back
+        bump_affinity(db, self.affinity_cache, user_id, [recipe_id], rating_affinity(score) - rating_affinity(previous_score))
+
+        # the average doesn't have to be ready for the response
+        self.jobs.enqueue_after_commit(db, 'recompute_rating', {'recipe_id': str(recipe_id)})
+
     @api.validate(
         resp=SpecResponse(
             HTTP_201=ResponseWrapper,
@@ -95,26 +159,15 @@ class RatingResource:
                     resp.status = falcon.HTTP_404
                     return
                 
-                existing_rating = db.scalar(select(RatedRecipe)
-                                            .where((RatedRecipe.recipe_id == _id) & (RatedRecipe.user_id == user_id)))
-                
-                if existing_rating is not None:
-                    db.delete(existing_rating)
-                    db.commit()
-
-                ratings = db.scalars(select(RatedRecipe).where(RatedRecipe.recipe_id == _id)).all()
+                self._rate(db, user_id, _id, score)
 
-                c = RatedRecipeCreate(
-                    user_id=user_id,
-                    recipe_id=_id,
-                    score=score
-                )
-                rating_record = RatedRecipe(c)
-                db.add(rating_record)
-
-                recipe.rating = (sum([record.score for record in ratings]) + score) / (len(ratings) + 1)
-                db.add(recipe)
-                db.commit()
+                try:
+                    db.commit()
+                except IntegrityError:
+                    # a concurrent request has rated it first, update their rating instead
+                    db.rollback()
+                    self._rate(db, user_id, _id, score)
+                    db.commit()
 
                 resp.media = {
                     'value': None,
@@ -1,34 +1,250 @@
 import falcon
 from falcon import Request, Response
 
-from sqlalchemy import select, func
+from sqlalchemy import select, update, func, bindparam
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, Session
 
 from ..util import check_auth
 from ..validation import RecipeData, INTERNAL_ERROR_RESPONSE, ResponseWrapper
 
-from ..database.models import Recipe, Tag, RecipesTags, Status, Authority, BookmarkedRecipe, RatedRecipe
+from ..database.models import Recipe, Tag, RecipesTags, Status, STATUS_NAMES, Authority, RatedRecipe, RecipeNeighbour, RecipeSignature
 from ..validation import (
-    RecipeCreate, TagCreate, RecipesTagsCreate, StatusChange,
-    PaginatedRecipeResponse, RecipeResponse, ErrorResponse, PaginationParams,
-    RecipeAddRequest, RecipeChangeStatusRequest, RecipeSearchRequest, AuthorizationHeader
+    RecipeCreate, TagCreate, StatusChange,
+    PaginatedRecipeResponse, RecipeResponse, ErrorResponse, RecipeListParams,
+    RecipeAddRequest, RecipeChangeStatusRequest, RecipeSearchRequest, AuthorizationHeader,
+    RecipeBulkStatusRequest, RecipeBulkStatusResponse, SimilarRecipesParams, RecipeListResponse,
+    RecipeFormatParams, RecipePageParams, RecipeSourceRequest, RecipeSourceParams, RecipeSourceResponse,
+    NearDuplicate, RecipeBatchParams, RecipeBatchResponse
 )
 
+from ..cache import Cache, invalidate_after_commit
+from ..jobs import JobRunner
+from ..database.database import insert_or_ignore
+from ..bookmarks import BookmarkSet, bookmark_set
+from ..trending import TrendingFeed
+from ..affinity import user_affinity, tag_recipes, rank_for_you
+from ..render import source_hash, store_rendered, stored_html, rendered_html, render_markdown
+from ..versions import DiffError, apply_unified_diff, record_version, load_version
+from ..duplicates import index_recipe, near_duplicates
+from ..metrics import MODERATION_DECISIONS
+from .user import serialized_users
 from ..log import logging
 
 from ..spec import api
 
 from spectree import Response as SpecResponse
 
+from datetime import datetime
+from typing import Any, Iterable
 import math
 from uuid import UUID
 
+# `sort` of the recipe feed -> the order, backed by an `ix_recipes_approved_*` index
+RECIPE_SORTS = {
+    'rating': (Recipe.rating.desc(), Recipe.date_created.desc()),
+    'newest': (Recipe.date_created.desc(),),
+    'bookmarks': (Recipe.bookmark_count.desc(), Recipe.date_created.desc()),
+    'ratings': (Recipe.rating_count.desc(), Recipe.date_created.desc())
+}
+
+def shared_recipe_data(recipe: Recipe) -> dict[str, Any]:
+    """The fields of `RecipeData` that are the same for every viewer"""
+    return {
+        'id': recipe.id,
+        'source': recipe.source,
+        'source_hash': recipe.source_hash,
+        'author_id': recipe.author_id,
+        'date_created': falcon.dt_to_http(recipe.date_created),
+        'date_edited': falcon.dt_to_http(recipe.date_edited),
+        'rating': recipe.rating,
+        'status': recipe.status,
+        'version': recipe.version
+    }
+
+def load_shared_recipe_data(db: Session, recipe_id: UUID) -> dict[str, Any] | None:
+    recipe = db.scalar(select(Recipe).where(Recipe.id == recipe_id))
+    return None if recipe is None else shared_recipe_data(recipe)
+
+def shared_recipes(db: Session, cache: Cache, recipe_ids: Iterable[UUID]) -> dict[UUID, dict[str, Any]]:
+    """`shared_recipe_data` of those ids that exist, from `cache`, the missing ones in one query"""
+    recipe_ids = list(recipe_ids)
+    found = {recipe_id: data for recipe_id, data in cache.get_many(recipe_ids).items() if data is not None}
+
+    missing = [recipe_id for recipe_id in recipe_ids if recipe_id not in found]
+    if missing:
+        versions = cache.versions(missing)
+        loaded = {recipe.id: shared_recipe_data(recipe) for recipe in db.scalars(select(Recipe).where(Recipe.id.in_(missing)))}
+        cache.set_many(loaded, versions={recipe_id: versions[recipe_id] for recipe_id in loaded})
+        found.update(loaded)
+
+    return found
+
+def user_scores(db: Session, user_id: UUID, recipe_ids: list[UUID]) -> dict[UUID, float]:
+    """The user's scores of those recipes that they have rated, in one query"""
+    if not recipe_ids:
+        return {}
+
+    return dict(db.execute(select(RatedRecipe.recipe_id, RatedRecipe.score)
+                           .where((RatedRecipe.user_id == user_id) & RatedRecipe.recipe_id.in_(recipe_ids))).all())
+
+def viewer_recipe_data(
+    db: Session,
+    bookmarks: BookmarkSet,
+    user_id: UUID,
+    recipes: list[Recipe],
+    html: dict[UUID, str] | None = None
+) -> list[RecipeData]:
+    """`RecipeData` of the recipes, as seen by the user, with `html` (see `rendered_html`) if given"""
+    scores = user_scores(db, user_id, [recipe.id for recipe in recipes])
+
+    return [
+        RecipeData(
+            **shared_recipe_data(recipe),
+            bookmarked=recipe.id in bookmarks,
+            user_score=scores.get(recipe.id),
+            html=None if html is None else html[recipe.id]
+        )
+        for recipe in recipes
+    ]
+
+def included_authors(db: Session, user_cache: Cache, res_data: list[RecipeData]) -> dict[str, dict[str, Any]]:
+    """The authors of the recipes, once each, for `include=author`: one query for those that aren't cached"""
+    authors = serialized_users(db, user_cache, dict.fromkeys(d.author_id for d in res_data))
+    return {str(author_id): author for author_id, author in authors.items()}
+
+def set_statuses(db: Session, by_status: dict[int, list[UUID]]) -> set[UUID]:
+    """
+    One `UPDATE ... WHERE id IN` per status, which also releases the
+    moderation leases. Returns the ids of the recipes that exist.
+    """
+    conn = db.connection()
+    recipes = Recipe.__table__
+    updated: set[UUID] = set()
+
+    for status, ids in by_status.items():
+        statement = (update(recipes)
+                     .where(recipes.c.id.in_(ids))
+                     .values(status=status, lease_owner_id=None, lease_expires_at=None))
+
+        if conn.dialect.update_returning:
+            updated.update(conn.execute(statement.returning(recipes.c.id)).scalars())
+        else:
+            updated.update(conn.execute(select(recipes.c.id).where(recipes.c.id.in_(ids))).scalars())
+            conn.execute(statement)
+
+    return updated
+
+def hash_unrendered_sources(db: Session, recipe_ids: Iterable[UUID]) -> list[UUID]:
+    """
+    Set `source_hash` of those recipes that were created before the
+    rendering, and return their ids, so that they are rendered.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return []
+
+    conn = db.connection()
+    recipes = Recipe.__table__
+
+    rows = conn.execute(select(recipes.c.id, recipes.c.source)
+                        .where(recipes.c.id.in_(recipe_ids) & recipes.c.source_hash.is_(None))).all()
+    if rows:
+        conn.execute(update(recipes)
+                     .where(recipes.c.id == bindparam('recipe_id'))
+                     .values(source_hash=bindparam('hash')),
+                     [{'recipe_id': row.id, 'hash': source_hash(row.source)} for row in rows])
+
+    return [row.id for row in rows]
+
 class RecipeResource:
 
     db_session: sessionmaker[Session]
-
-    def __init__(self, db_sessionmaker: sessionmaker):
+    recipe_cache: Cache # recipe id -> the shared part of `RecipeData`
+    user_cache: Cache # user id -> the serialized user, for `include=author`
+    tag_cache: Cache # tag text -> tag id
+    bookmark_cache: Cache # user id -> `BookmarkSet.data`
+    affinity_cache: Cache # user id -> the top tags of `user_tag_affinity`
+    tag_recipes_cache: Cache # tag id -> the candidates of the personalized feed
+    html_cache: Cache # source hash -> the rendered HTML
+    trending: TrendingFeed
+    jobs: JobRunner
+
+    def __init__(
+        self,
+        db_sessionmaker: sessionmaker,
+        recipe_cache: Cache,
+        user_cache: Cache,
+        tag_cache: Cache,
+        bookmark_cache: Cache,
+        affinity_cache: Cache,
+        tag_recipes_cache: Cache,
+        html_cache: Cache,
+        trending: TrendingFeed,
+        jobs: JobRunner
+    ):
         self.db_session = db_sessionmaker
+        self.recipe_cache = recipe_cache
+        self.user_cache = user_cache
+        self.tag_cache = tag_cache
+        self.bookmark_cache = bookmark_cache
+        self.affinity_cache = affinity_cache
+        self.tag_recipes_cache = tag_recipes_cache
+        self.html_cache = html_cache
+        self.trending = trending
+        self.jobs = jobs
+
+        jobs.register('attach_tags', self.attach_tags)
+        jobs.register('render_source', self.render_source)
+        jobs.register('index_duplicates', self.index_duplicates)
+
+    def attach_tags(self, payload: dict):
+        """Link the recipe to its tags, creating the missing ones"""
+        recipe_id = UUID(payload['recipe_id'])
+        tags: list[str] = payload['tags']
+
+        with self.db_session() as db:
+            tag_ids = {tag.text: tag.id for tag in db.scalars(select(Tag).where(Tag.text.in_(tags)))}
+
+            new_tags = [Tag(TagCreate(text=tag)) for tag in tags if tag not in tag_ids]
+            if new_tags:
+                db.add_all(new_tags)
+                db.flush() # need the IDs
+                tag_ids.update((tag.text, tag.id) for tag in new_tags)
+
+            # a retry doesn't link the tags twice
+            conn = db.connection()
+            conn.execute(insert_or_ignore(conn.dialect.name, RecipesTags.__table__).values([
+                {'recipe_id': recipe_id, 'tag_id': tag_ids[tag]} for tag in tags
+            ]))
+            db.commit()
+
+    def render_source(self, payload: dict):
+        """Store the HTML of the recipe's source, unless it is already stored"""
+        recipe_id = UUID(payload['recipe_id'])
+
+        with self.db_session() as db:
+            # the source may have changed since, the hash changes with it
+            row = db.execute(select(Recipe.source, Recipe.source_hash).where(Recipe.id == recipe_id)).first()
+            if row is None or row.source_hash is None:
+                return
+
+            store_rendered(db.connection(), {row.source_hash: row.source})
+            db.commit()
+
+    def index_duplicates(self, payload: dict):
+        """Index the recipe's source for the near-duplicate detection, unless it is already indexed"""
+        recipe_id = UUID(payload['recipe_id'])
+
+        with self.db_session() as db:
+            row = db.execute(select(Recipe.source, Recipe.source_hash, RecipeSignature.source_hash.label('indexed_hash'))
+                             .outerjoin(RecipeSignature, RecipeSignature.recipe_id == Recipe.id)
+                             .where(Recipe.id == recipe_id)).first()
+            if row is None or row.source_hash is None or row.indexed_hash == row.source_hash:
+                return
+
+            index_recipe(db, recipe_id, row.source, row.source_hash)
+            db.commit()
 
     @api.validate(
         resp=SpecResponse(
@@ -37,40 +253,28 @@ class RecipeResource:
             HTTP_403=ErrorResponse,
             HTTP_500=ErrorResponse
         ),
-        query=PaginationParams
+        query=RecipeListParams
     )
     @falcon.before(check_auth)
     def on_get(self, req: Request, resp: Response):
         try:
             page: int = req.context.query.page
             elements: int = req.context.query.elements
+            sort: str = req.context.query.sort
+            output_format: str = req.context.query.format
+            include: str | None = req.context.query.include
             user_id: UUID = req.context.user_id
 
             with self.db_session() as db:
                 recipes = db.scalars(select(Recipe)
                                      .where(Recipe.status == Status.APPROVED)
-                                     .order_by(Recipe.rating.desc(), Recipe.date_created.desc())
+                                     .order_by(*RECIPE_SORTS[sort])
                                      .offset((page - 1) * elements)
                                      .limit(elements)).all()
 
-                res_data = []
-                for recipe in recipes:
-                    bookmark_record = db.scalar(select(BookmarkedRecipe).where((BookmarkedRecipe.recipe_id == recipe.id) & (BookmarkedRecipe.user_id == user_id)))
-                    rating_record = db.scalar(select(RatedRecipe).where((RatedRecipe.recipe_id == recipe.id) & (RatedRecipe.user_id == user_id)))
-
-                    data = RecipeData(
-                        id=recipe.id,
-                        source=recipe.source,
-                        author_id=recipe.author_id,
-                        date_created=falcon.dt_to_http(recipe.date_created),
-                        date_edited=falcon.dt_to_http(recipe.date_edited),
-                        rating=recipe.rating,
-                        status=recipe.status,
-                        bookmarked=bookmark_record is not None,
-                        user_score=rating_record.score if rating_record is not None else None,
-                    )
-
-                    res_data.append(data)
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
+                html = rendered_html(db, self.html_cache, recipes) if output_format == 'html' else None
+                res_data = viewer_recipe_data(db, bookmarks, user_id, recipes, html)
 
                 query = select(func.count()).select_from(Recipe).where(Recipe.status == Status.APPROVED)
                 total_records: int = db.scalar(query)
@@ -82,6 +286,116 @@ class RecipeResource:
                     },
                     'errors': None
                 }
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, res_data)
+                resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
+
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_200=PaginatedRecipeResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        query=RecipePageParams
+    )
+    @falcon.before(check_auth)
+    def on_get_trending(self, req: Request, resp: Response):
+        try:
+            page: int = req.context.query.page
+            elements: int = req.context.query.elements
+            output_format: str = req.context.query.format
+            include: str | None = req.context.query.include
+            user_id: UUID = req.context.user_id
+
+            # the top is precomputed, only the page is read from the database
+            top = self.trending.top()
+            page_ids = top[(page - 1) * elements:page * elements]
+
+            with self.db_session() as db:
+                # a recipe may have been denied since the last refresh
+                found = {recipe.id: recipe for recipe in db.scalars(select(Recipe)
+                                                                    .where(Recipe.id.in_(page_ids) & (Recipe.status == Status.APPROVED)))}
+                recipes = [found[recipe_id] for recipe_id in page_ids if recipe_id in found]
+
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
+                html = rendered_html(db, self.html_cache, recipes) if output_format == 'html' else None
+                res_data = viewer_recipe_data(db, bookmarks, user_id, recipes, html)
+
+                resp.media = {
+                    'value': {
+                        'totalPages': math.ceil(len(top) / elements),
+                        'data': [d.serialize() for d in res_data]
+                    },
+                    'errors': None
+                }
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, res_data)
+                resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
+
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_200=PaginatedRecipeResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        query=RecipePageParams
+    )
+    @falcon.before(check_auth)
+    def on_get_for_you(self, req: Request, resp: Response):
+        try:
+            page: int = req.context.query.page
+            elements: int = req.context.query.elements
+            output_format: str = req.context.query.format
+            include: str | None = req.context.query.include
+            user_id: UUID = req.context.user_id
+
+            with self.db_session() as db:
+                affinity = user_affinity(db, self.affinity_cache, user_id)
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
+
+                if affinity:
+                    # ranked in memory, only the page is read from the database
+                    ranked = rank_for_you(affinity, tag_recipes(db, self.tag_recipes_cache, affinity), bookmarks)
+                    page_ids = ranked[(page - 1) * elements:page * elements]
+
+                    # a recipe may have been denied since its tag was cached
+                    found = {recipe.id: recipe for recipe in db.scalars(select(Recipe)
+                                                                        .where(Recipe.id.in_(page_ids) & (Recipe.status == Status.APPROVED)))}
+                    recipes = [found[recipe_id] for recipe_id in page_ids if recipe_id in found]
+                    total_records = len(ranked)
+                else:
+                    # nothing is known about the user yet: the plain feed
+                    recipes = db.scalars(select(Recipe)
+                                         .where(Recipe.status == Status.APPROVED)
+                                         .order_by(*RECIPE_SORTS['rating'])
+                                         .offset((page - 1) * elements)
+                                         .limit(elements)).all()
+                    total_records = db.scalar(select(func.count()).select_from(Recipe).where(Recipe.status == Status.APPROVED))
+
+                html = rendered_html(db, self.html_cache, recipes) if output_format == 'html' else None
+                res_data = viewer_recipe_data(db, bookmarks, user_id, recipes, html)
+
+                resp.media = {
+                    'value': {
+                        'totalPages': math.ceil(total_records / elements),
+                        'data': [d.serialize() for d in res_data]
+                    },
+                    'errors': None
+                }
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, res_data)
                 resp.status = falcon.HTTP_200
 
         except Exception as e:
@@ -112,34 +426,23 @@ class RecipeResource:
                 )
 
                 recipe = Recipe(c)
+                recipe.source_hash = source_hash(source)
 
                 db.add(recipe)
-                db.commit()
-                db.refresh(recipe)
+                db.flush() # need the ID
 
                 recipe_id = recipe.id
 
-                # add tags, if any
-
-                if tags is not None:
-                    for tag in tags:
-                        existing_tag = db.scalar(select(Tag).where(Tag.text == tag))
-                        if existing_tag is None:
-                            c = TagCreate(text=tag)
-                            new_tag = Tag(c)
-
-                            db.add(new_tag)
-                            db.commit()
-                            db.refresh(new_tag) # need the ID
+                # rendered once, for `format=html`
+                self.jobs.enqueue_after_commit(db, 'render_source', {'recipe_id': str(recipe_id)})
+                # for `near_duplicates` in the moderation queue
+                self.jobs.enqueue_after_commit(db, 'index_duplicates', {'recipe_id': str(recipe_id)})
 
-                            c = RecipesTagsCreate(
-                                recipe_id=recipe_id,
-                                tag_id=new_tag.id
-                            )
-                            new_record = RecipesTags(c)
+                # the tags are only needed once the recipe is approved
+                if tags:
+                    self.jobs.enqueue_after_commit(db, 'attach_tags', {'recipe_id': str(recipe_id), 'tags': list(dict.fromkeys(tags))})
 
-                            db.add(new_record)
-                            db.commit()
+                db.commit()
 
                 resp.location = f'/recipe/{recipe_id}'
                 resp.media = {
@@ -161,6 +464,7 @@ class RecipeResource:
             HTTP_404=ErrorResponse,
             HTTP_500=ErrorResponse
         ),
+        query=RecipeFormatParams,
         path_parameter_descriptions={
             '_id': 'A UUID that corresponds to a recipe.'
         }
@@ -168,11 +472,191 @@ class RecipeResource:
     @falcon.before(check_auth)
     def on_get_by_id(self, req: Request, resp: Response, _id: UUID):
         try:
+            output_format: str = req.context.query.format
+            include: str | None = req.context.query.include
+            user_id: UUID = req.context.user_id
+
+            with self.db_session() as db:
+                # The recipe itself is cached, the viewer's part is not
+                shared = self.recipe_cache.get_or_set(_id, lambda: load_shared_recipe_data(db, _id))
+
+                if shared is None:
+                    resp.media = {
+                        'value': None,
+                        'errors': ['No recipe with such id was found.']
+                    }
+                    resp.status = falcon.HTTP_404
+                    return
+
+                html = None
+                if output_format == 'html':
+                    # rendered on the fly until `render_source` has stored it
+                    h = shared.get('source_hash')
+                    html = stored_html(db, self.html_cache, [h]).get(h) or render_markdown(shared['source'])
+
+                data = RecipeData(
+                    **shared,
+                    bookmarked=_id in bookmark_set(db, self.bookmark_cache, user_id),
+                    user_score=user_scores(db, user_id, [_id]).get(_id),
+                    html=html
+                )
+
+                resp.media = {
+                    'value': data.serialize(),
+                    'errors': None
+                }
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, [data])
+                resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
+
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_200=RecipeBatchResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        query=RecipeBatchParams
+    )
+    @falcon.before(check_auth)
+    def on_get_batch(self, req: Request, resp: Response):
+        try:
+            ids = list(dict.fromkeys(req.context.query.ids))
+            output_format: str = req.context.query.format
+            include: str | None = req.context.query.include
+            user_id: UUID = req.context.user_id
+
+            with self.db_session() as db:
+                # visible as in `on_get_by_id`: by anyone who knows the id
+                shared = shared_recipes(db, self.recipe_cache, ids)
+                found = [_id for _id in ids if _id in shared]
+
+                html = {}
+                if output_format == 'html':
+                    stored = stored_html(db, self.html_cache, [shared[_id]['source_hash'] for _id in found])
+                    html = {
+                        _id: stored.get(shared[_id]['source_hash']) or render_markdown(shared[_id]['source'])
+                        for _id in found
+                    }
+
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
+                scores = user_scores(db, user_id, found)
+
+                res_data = [
+                    RecipeData(
+                        **shared[_id],
+                        bookmarked=_id in bookmarks,
+                        user_score=scores.get(_id),
+                        html=html.get(_id)
+                    )
+                    for _id in found
+                ]
+
+                resp.media = {
+                    'value': {
+                        'data': [d.serialize() for d in res_data],
+                        'missing': [str(_id) for _id in ids if _id not in shared]
+                    },
+                    'errors': None
+                }
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, res_data)
+                resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
+
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_200=RecipeSourceResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_404=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        query=RecipeSourceParams,
+        path_parameter_descriptions={
+            '_id': 'A UUID that corresponds to a recipe.'
+        }
+    )
+    @falcon.before(check_auth)
+    def on_get_source(self, req: Request, resp: Response, _id: UUID):
+        try:
+            version: int | None = req.context.query.version
+
+            with self.db_session() as db:
+                recipe = db.execute(select(Recipe.source, Recipe.version).where(Recipe.id == _id)).first()
+
+                source = None
+                if recipe is not None:
+                    if version is None or version == recipe.version:
+                        version, source = recipe.version, recipe.source
+                    elif version < recipe.version:
+                        source = load_version(db, _id, version)
+
+                if source is None:
+                    resp.media = {
+                        'value': None,
+                        'errors': ['No recipe with such id and version was found.']
+                    }
+                    resp.status = falcon.HTTP_404
+                    return
+
+                resp.media = {
+                    'value': {
+                        'version': version,
+                        'source': source
+                    },
+                    'errors': None
+                }
+                resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
+
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_200=RecipeResponse,
+            HTTP_400=ErrorResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_404=ErrorResponse,
+            HTTP_409=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        json=RecipeSourceRequest,
+        path_parameter_descriptions={
+            '_id': 'A UUID that corresponds to a recipe.'
+        }
+    )
+    @falcon.before(check_auth)
+    def on_patch_source(self, req: Request, resp: Response, _id: UUID):
+        try:
+            base_version: int = req.context.json.base_version
+            source: str | None = req.context.json.source
+            diff: str | None = req.context.json.diff
             user_id: UUID = req.context.user_id
 
+            if (source is None) == (diff is None):
+                resp.media = {
+                    'value': None,
+                    'errors': ['Send either the new `source` or a `diff`.']
+                }
+                resp.status = falcon.HTTP_400
+                return
+
             with self.db_session() as db:
-                result = db.execute(select(Recipe).where(Recipe.id == _id))
-                recipe = result.scalar()
+                # concurrent edits of the recipe wait for each other on PostgreSQL
+                recipe = db.scalar(select(Recipe).where(Recipe.id == _id).with_for_update())
 
                 if recipe is None:
                     resp.media = {
@@ -181,24 +665,67 @@ class RecipeResource:
                     }
                     resp.status = falcon.HTTP_404
                     return
-                
-                bookmark_record = db.scalar(select(BookmarkedRecipe)
-                                             .where((BookmarkedRecipe.user_id == user_id) & (BookmarkedRecipe.recipe_id == recipe.id)))
-                rating_record = db.scalar(select(RatedRecipe)
-                                           .where((RatedRecipe.user_id == user_id) & (RatedRecipe.recipe_id == recipe.id)))
+
+                if recipe.author_id != user_id:
+                    resp.media = {
+                        'value': None,
+                        'errors': ['Only the author can edit the recipe.']
+                    }
+                    resp.status = falcon.HTTP_403
+                    return
+
+                if recipe.version != base_version:
+                    resp.media = {
+                        'value': None,
+                        'errors': [f'The recipe has been edited since, the current version is {recipe.version}.']
+                    }
+                    resp.status = falcon.HTTP_409
+                    return
+
+                if diff is not None:
+                    try:
+                        source = apply_unified_diff(recipe.source, diff)
+                    except DiffError as e:
+                        resp.media = {
+                            'value': None,
+                            'errors': [str(e)]
+                        }
+                        resp.status = falcon.HTTP_400
+                        return
+
+                if source != recipe.source:
+                    previous_source = recipe.source
+
+                    recipe.source = source
+                    recipe.source_hash = source_hash(source)
+                    recipe.version += 1
+                    recipe.date_edited = datetime.utcnow()
+
+                    # the edited recipe is moderated again
+                    recipe.status = Status.PENDING
+                    recipe.lease_owner_id = None
+                    recipe.lease_expires_at = None
+
+                    record_version(db, recipe, previous_source)
+                    self.jobs.enqueue_after_commit(db, 'render_source', {'recipe_id': str(recipe.id)})
+                    self.jobs.enqueue_after_commit(db, 'index_duplicates', {'recipe_id': str(recipe.id)})
+
+                    # the commit drops the recipe from `recipe_cache`
+                    try:
+                        db.commit()
+                    except IntegrityError:
+                        # an edit of the same version got there first
+                        resp.media = {
+                            'value': None,
+                            'errors': [f'The recipe has been edited since version {base_version}.']
+                        }
+                        resp.status = falcon.HTTP_409
+                        return
+
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
 
                 resp.media = {
-                    'value': RecipeData(
-                        id=recipe.id,
-                        source=recipe.source,
-                        author_id=recipe.author_id,
-                        date_created=falcon.dt_to_http(recipe.date_created),
-                        date_edited=falcon.dt_to_http(recipe.date_edited),
-                        rating=recipe.rating,
-                        status=recipe.status,
-                        bookmarked=bookmark_record is not None,
-                        user_score=rating_record.score if rating_record is not None else None,
-                    ).serialize(),
+                    'value': viewer_recipe_data(db, bookmarks, user_id, [recipe])[0].serialize(),
                     'errors': None
                 }
                 resp.status = falcon.HTTP_200
@@ -208,6 +735,51 @@ class RecipeResource:
             resp.status = falcon.HTTP_500
             logging.exception(e)
 
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_200=RecipeListResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        query=SimilarRecipesParams,
+        path_parameter_descriptions={
+            '_id': 'A UUID that corresponds to a recipe.'
+        }
+    )
+    @falcon.before(check_auth)
+    def on_get_similar(self, req: Request, resp: Response, _id: UUID):
+        try:
+            n: int = req.context.query.n
+            output_format: str = req.context.query.format
+            include: str | None = req.context.query.include
+            user_id: UUID = req.context.user_id
+
+            with self.db_session() as db:
+                # precomputed by `recipe.similar`; empty until it has run
+                recipes = db.scalars(select(Recipe)
+                                     .join(RecipeNeighbour, RecipeNeighbour.neighbour_id == Recipe.id)
+                                     .where((RecipeNeighbour.recipe_id == _id) & (Recipe.status == Status.APPROVED))
+                                     .order_by(RecipeNeighbour.rank)
+                                     .limit(n)).all()
+
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
+                html = rendered_html(db, self.html_cache, recipes) if output_format == 'html' else None
+                res_data = viewer_recipe_data(db, bookmarks, user_id, recipes, html)
+
+                resp.media = {
+                    'value': [d.serialize() for d in res_data],
+                    'errors': None
+                }
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, res_data)
+                resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
+
     @api.validate(
         resp=SpecResponse(
             HTTP_200=RecipeResponse,
@@ -241,27 +813,27 @@ class RecipeResource:
                 c = StatusChange(status=status)
                 recipe.status = c.status
 
+                # created before the rendering, and not rendered by `recipe.render` yet
+                if recipe.status == Status.APPROVED and recipe.source_hash is None:
+                    recipe.source_hash = source_hash(recipe.source)
+                    self.jobs.enqueue_after_commit(db, 'render_source', {'recipe_id': str(recipe.id)})
+                    self.jobs.enqueue_after_commit(db, 'index_duplicates', {'recipe_id': str(recipe.id)})
+
+                # the review is over
+                recipe.lease_owner_id = None
+                recipe.lease_expires_at = None
+
+                # the commit drops the recipe from `recipe_cache`
                 db.add(recipe)
                 db.commit()
                 db.refresh(recipe)
 
-                bookmark_record = db.scalar(select(BookmarkedRecipe)
-                                            .where((BookmarkedRecipe.user_id == user_id) & (BookmarkedRecipe.recipe_id == recipe.id)))
-                rating_record = db.scalar(select(RatedRecipe)
-                                          .where((RatedRecipe.user_id == user_id) & (RatedRecipe.recipe_id == recipe.id)))
+                MODERATION_DECISIONS.labels(STATUS_NAMES[recipe.status]).inc()
+
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
 
                 resp.media = {
-                    'value': RecipeData(
-                        id=recipe.id,
-                        source=recipe.source,
-                        author_id=recipe.author_id,
-                        date_created=falcon.dt_to_http(recipe.date_created),
-                        date_edited=falcon.dt_to_http(recipe.date_edited),
-                        rating=recipe.rating,
-                        status=recipe.status,
-                        bookmarked=bookmark_record is not None,
-                        user_score=rating_record.score if rating_record is not None else None,
-                    ).serialize(),
+                    'value': viewer_recipe_data(db, bookmarks, user_id, [recipe])[0].serialize(),
                     'errors': None
                 }
                 resp.status = falcon.HTTP_200
@@ -271,6 +843,59 @@ class RecipeResource:
             resp.status = falcon.HTTP_500
             logging.exception(e)
 
+    @api.validate(
+        resp=SpecResponse(
+            HTTP_200=RecipeBulkStatusResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_500=ErrorResponse
+        ),
+        json=RecipeBulkStatusRequest
+    )
+    @falcon.before(check_auth, Authority.MODERATOR | Authority.ADMIN)
+    def on_patch_status(self, req: Request, resp: Response):
+        try:
+            # if a recipe is listed twice, the last status wins
+            statuses: dict[UUID, int] = {item.id: item.status for item in req.context.json.items}
+
+            by_status: dict[int, list[UUID]] = {}
+            for recipe_id, status in statuses.items():
+                by_status.setdefault(status, []).append(recipe_id)
+
+            with self.db_session() as db:
+                updated = set_statuses(db, by_status)
+
+                # created before the rendering, and not rendered by `recipe.render` yet
+                approved = [recipe_id for recipe_id in by_status.get(Status.APPROVED, []) if recipe_id in updated]
+                for recipe_id in hash_unrendered_sources(db, approved):
+                    self.jobs.enqueue_after_commit(db, 'render_source', {'recipe_id': str(recipe_id)})
+                    self.jobs.enqueue_after_commit(db, 'index_duplicates', {'recipe_id': str(recipe_id)})
+
+                # Core statements, so the recipes are dropped from the cache explicitly
+                invalidate_after_commit(db, self.recipe_cache, updated)
+                db.commit()
+
+            for status, ids in by_status.items():
+                MODERATION_DECISIONS.labels(STATUS_NAMES[status]).inc(sum(1 for recipe_id in ids if recipe_id in updated))
+
+            resp.media = {
+                'value': [
+                    {
+                        'id': str(recipe_id),
+                        'status': status,
+                        'updated': recipe_id in updated
+                    }
+                    for recipe_id, status in statuses.items()
+                ],
+                'errors': None
+            }
+            resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
+
     @api.validate(
         resp=SpecResponse(
             HTTP_200=PaginatedRecipeResponse,
@@ -286,6 +911,8 @@ class RecipeResource:
             page: int = req.context.query.page
             elements: int = req.context.query.elements
             search_query: str = req.context.query.q
+            output_format: str = req.context.query.format
+            include: str | None = req.context.query.include
             user_id: UUID = req.context.user_id
 
             tags = search_query.split()
@@ -296,10 +923,16 @@ class RecipeResource:
                 return
 
             with self.db_session() as db:
-                results = db.scalars(select(Tag)
-                                     .where(Tag.text.in_(tags)))
-                
-                tag_ids = [tag.id for tag in results]
+                tag_ids_by_text = self.tag_cache.get_many(tags)
+
+                missing = [tag for tag in tags if tag not in tag_ids_by_text]
+                if missing:
+                    # the unknown tags are not cached: they may be created later
+                    found = {tag.text: tag.id for tag in db.scalars(select(Tag).where(Tag.text.in_(missing)))}
+                    self.tag_cache.set_many(found)
+                    tag_ids_by_text.update(found)
+
+                tag_ids = list(tag_ids_by_text.values())
 
                 results = db.scalars(select(RecipesTags)
                                      .where(RecipesTags.tag_id.in_(tag_ids)))
@@ -312,24 +945,9 @@ class RecipeResource:
                                          .offset((page - 1) * elements)
                                          .limit(elements)).all()
 
-                res_data = []
-                for recipe in recipes:
-                    bookmark_record = db.execute(select(BookmarkedRecipe).where((BookmarkedRecipe.recipe_id == recipe.id) & (BookmarkedRecipe.user_id == user_id))).scalar()
-                    rating_record = db.execute(select(RatedRecipe).where((RatedRecipe.recipe_id == recipe.id) & (RatedRecipe.user_id == user_id))).scalar()
-
-                    data = RecipeData(
-                        id=recipe.id,
-                        source=recipe.source,
-                        author_id=recipe.author_id,
-                        date_created=falcon.dt_to_http(recipe.date_created),
-                        date_edited=falcon.dt_to_http(recipe.date_edited),
-                        rating=recipe.rating,
-                        status=recipe.status,
-                        bookmarked=bookmark_record is not None,
-                        user_score=rating_record.score if rating_record is not None else None,
-                    )
-
-                    res_data.append(data)
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
+                html = rendered_html(db, self.html_cache, recipes) if output_format == 'html' else None
+                res_data = viewer_recipe_data(db, bookmarks, user_id, recipes, html)
 
                 query = select(func.count()).select_from(Recipe).where(Recipe.id.in_(recipe_ids) & (Recipe.status == Status.APPROVED))
                 total_records: int = db.scalar(query)
@@ -341,6 +959,8 @@ class RecipeResource:
                     },
                     'errors': None
                 }
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, res_data)
                 resp.status = falcon.HTTP_200
 
         except Exception as e:
@@ -355,13 +975,15 @@ class RecipeResource:
             HTTP_403=ErrorResponse,
             HTTP_500=ErrorResponse
         ),
-        query=PaginationParams
+        query=RecipePageParams
     )
     @falcon.before(check_auth)
     def on_get_my(self, req: Request, resp: Response):
         try:
             page: int = req.context.query.page
             elements: int = req.context.query.elements
+            output_format: str = req.context.query.format
+            include: str | None = req.context.query.include
             user_id: UUID = req.context.user_id
 
             with self.db_session() as db:
@@ -371,24 +993,9 @@ class RecipeResource:
                                      .offset((page - 1) * elements)
                                      .limit(elements)).all()
 
-                res_data = []
-                for recipe in recipes:
-                    bookmark_record = db.scalar(select(BookmarkedRecipe).where((BookmarkedRecipe.recipe_id == recipe.id) & (BookmarkedRecipe.user_id == user_id)))
-                    rating_record = db.scalar(select(RatedRecipe).where((RatedRecipe.recipe_id == recipe.id) & (RatedRecipe.user_id == user_id)))
-
-                    data = RecipeData(
-                        id=recipe.id,
-                        source=recipe.source,
-                        author_id=recipe.author_id,
-                        date_created=falcon.dt_to_http(recipe.date_created),
-                        date_edited=falcon.dt_to_http(recipe.date_edited),
-                        rating=recipe.rating,
-                        status=recipe.status,
-                        bookmarked=bookmark_record is not None,
-                        user_score=rating_record.score if rating_record is not None else None,
-                    )
-
-                    res_data.append(data)
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
+                html = rendered_html(db, self.html_cache, recipes) if output_format == 'html' else None
+                res_data = viewer_recipe_data(db, bookmarks, user_id, recipes, html)
 
                 query = select(func.count()).select_from(Recipe).where(Recipe.author_id == user_id)
                 total_records: int = db.scalar(query)
@@ -400,7 +1007,9 @@ class RecipeResource:
                     },
                     'errors': None
                 }
-                resp.status = falcon.HTTP_200             
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, res_data)
+                resp.status = falcon.HTTP_200
             
         except Exception as e:
             resp.media = INTERNAL_ERROR_RESPONSE
@@ -414,13 +1023,15 @@ class RecipeResource:
             HTTP_403=ErrorResponse,
             HTTP_500=ErrorResponse
         ),
-        query=PaginationParams
+        query=RecipePageParams
     )
     @falcon.before(check_auth, Authority.MODERATOR | Authority.ADMIN)
     def on_get_pending(self, req: Request, resp: Response):
         try:
             page: int = req.context.query.page
             elements: int = req.context.query.elements
+            output_format: str = req.context.query.format
+            include: str | None = req.context.query.include
             user_id: UUID = req.context.user_id
 
             with self.db_session() as db:
@@ -430,24 +1041,13 @@ class RecipeResource:
                                      .offset((page - 1) * elements)
                                      .limit(elements)).all()
 
-                res_data = []
-                for recipe in recipes:
-                    bookmark_record = db.scalar(select(BookmarkedRecipe).where((BookmarkedRecipe.recipe_id == recipe.id) & (BookmarkedRecipe.user_id == user_id)))
-                    rating_record = db.scalar(select(RatedRecipe).where((RatedRecipe.recipe_id == recipe.id) & (RatedRecipe.user_id == user_id)))
-
-                    data = RecipeData(
-                        id=recipe.id,
-                        source=recipe.source,
-                        author_id=recipe.author_id,
-                        date_created=falcon.dt_to_http(recipe.date_created),
-                        date_edited=falcon.dt_to_http(recipe.date_edited),
-                        rating=recipe.rating,
-                        status=recipe.status,
-                        bookmarked=bookmark_record is not None,
-                        user_score=rating_record.score if rating_record is not None else None,
-                    )
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
+                html = rendered_html(db, self.html_cache, recipes) if output_format == 'html' else None
+                res_data = viewer_recipe_data(db, bookmarks, user_id, recipes, html)
 
-                    res_data.append(data)
+                duplicates = near_duplicates(db, [recipe.id for recipe in recipes])
+                for data in res_data:
+                    data.near_duplicates = [NearDuplicate(**duplicate) for duplicate in duplicates[data.id]]
 
                 query = select(func.count()).select_from(Recipe).where(Recipe.status == Status.APPROVED)
                 total_records: int = db.scalar(query)
@@ -459,6 +1059,8 @@ class RecipeResource:
                     },
                     'errors': None
                 }
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, res_data)
                 resp.status = falcon.HTTP_200
 
         except Exception as e:
@@ -473,13 +1075,15 @@ class RecipeResource:
             HTTP_403=ErrorResponse,
             HTTP_500=ErrorResponse
         ),
-        query=PaginationParams
+        query=RecipePageParams
     )
     @falcon.before(check_auth, Authority.MODERATOR | Authority.ADMIN)
     def on_get_denied(self, req: Request, resp: Response):
         try:
             page: int = req.context.query.page
             elements: int = req.context.query.elements
+            output_format: str = req.context.query.format
+            include: str | None = req.context.query.include
             user_id: UUID = req.context.user_id
 
             with self.db_session() as db:
@@ -489,24 +1093,9 @@ class RecipeResource:
                                      .offset((page - 1) * elements)
                                      .limit(elements)).all()
 
-                res_data = []
-                for recipe in recipes:
-                    bookmark_record = db.scalar(select(BookmarkedRecipe).where((BookmarkedRecipe.recipe_id == recipe.id) & (BookmarkedRecipe.user_id == user_id)))
-                    rating_record = db.scalar(select(RatedRecipe).where((RatedRecipe.recipe_id == recipe.id) & (RatedRecipe.user_id == user_id)))
-
-                    data = RecipeData(
-                        id=recipe.id,
-                        source=recipe.source,
-                        author_id=recipe.author_id,
-                        date_created=falcon.dt_to_http(recipe.date_created),
-                        date_edited=falcon.dt_to_http(recipe.date_edited),
-                        rating=recipe.rating,
-                        status=recipe.status,
-                        bookmarked=bookmark_record is not None,
-                        user_score=rating_record.score if rating_record is not None else None,
-                    )
-
-                    res_data.append(data)
+                bookmarks = bookmark_set(db, self.bookmark_cache, user_id)
+                html = rendered_html(db, self.html_cache, recipes) if output_format == 'html' else None
+                res_data = viewer_recipe_data(db, bookmarks, user_id, recipes, html)
 
                 query = select(func.count()).select_from(Recipe).where(Recipe.status == Status.APPROVED)
                 total_records: int = db.scalar(query)
@@ -518,6 +1107,8 @@ class RecipeResource:
                     },
                     'errors': None
                 }
+                if include == 'author':
+                    resp.media['authors'] = included_authors(db, self.user_cache, res_data)
                 resp.status = falcon.HTTP_200
 
         except Exception as e:
@@ -8,26 +8,48 @@ from ..util import check_auth
 
 from ..database.models import User, Authority
 
+from ..cache import Cache
 from ..log import logging
 from ..spec import api
 
 from ..validation import (
     PaginationParams, PaginatedUserResponse,
-    UserResponse, ErrorResponse
+    UserResponse, ErrorResponse, BatchGetParams, UserBatchResponse
 )
 from ..validation import INTERNAL_ERROR_RESPONSE
 
 from spectree import Response as SpecResponse
 
+from typing import Any, Iterable
 import math
 from uuid import UUID
 
+def load_serialized_user(db: Session, user_id: UUID) -> dict[str, Any] | None:
+    user = db.scalar(select(User).where(User.id == user_id))
+    return None if user is None else user.serialize()
+
+def serialized_users(db: Session, cache: Cache, user_ids: Iterable[UUID]) -> dict[UUID, dict[str, Any]]:
+    """The serialized users of those ids that exist, from `cache`, the missing ones in one query"""
+    user_ids = list(user_ids)
+    found = {user_id: user for user_id, user in cache.get_many(user_ids).items() if user is not None}
+
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    if missing:
+        versions = cache.versions(missing)
+        loaded = {user.id: user.serialize() for user in db.scalars(select(User).where(User.id.in_(missing)))}
+        cache.set_many(loaded, versions={user_id: versions[user_id] for user_id in loaded})
+        found.update(loaded)
+
+    return found
+
 class UserResource:
 
     db_session: sessionmaker[Session]
+    user_cache: Cache # user id -> the serialized user
 
-    def __init__(self, db_sessionmaker: sessionmaker):
+    def __init__(self, db_sessionmaker: sessionmaker, user_cache: Cache):
         self.db_session = db_sessionmaker
+        self.user_cache = user_cache
 
     @api.validate(
         resp=SpecResponse(
@@ -43,8 +65,7 @@ class UserResource:
             user_id: UUID = req.context.user_id
 
             with self.db_session() as db:
-                result = db.execute(select(User).where(User.id == user_id))
-                user = result.scalar()
+                user = self.user_cache.get_or_set(user_id, lambda: load_serialized_user(db, user_id))
 
                 if user is None:
                     resp.media = {
@@ -55,7 +76,7 @@ class UserResource:
                     return
 
                 resp.media = {
-                    'value': user.serialize(),
+                    'value': user,
                     'errors': None
                 }
                 resp.status = falcon.HTTP_200
@@ -101,6 +122,37 @@ class UserResource:
             logging.exception(e)
 
 
+    @api.validate(
+        query=BatchGetParams,
+        resp=SpecResponse(
+            HTTP_200=UserBatchResponse,
+            HTTP_401=ErrorResponse,
+            HTTP_403=ErrorResponse,
+            HTTP_500=ErrorResponse
+        )
+    )
+    @falcon.before(check_auth)
+    def on_get_batch(self, req: Request, resp: Response):
+        try:
+            ids = list(dict.fromkeys(req.context.query.ids))
+
+            with self.db_session() as db:
+                users = serialized_users(db, self.user_cache, ids)
+
+                resp.media = {
+                    'value': {
+                        'data': [users[_id] for _id in ids if _id in users],
+                        'missing': [str(_id) for _id in ids if _id not in users]
+                    },
+                    'errors': None
+                }
+                resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            resp.media = INTERNAL_ERROR_RESPONSE
+            resp.status = falcon.HTTP_500
+            logging.exception(e)
+
     @api.validate(
         resp=SpecResponse(
             HTTP_200=UserResponse,
@@ -117,8 +169,7 @@ class UserResource:
     def on_get_by_id(self, req: Request, resp: Response, _id: UUID):
         try:
             with self.db_session() as db:
-                result = db.execute(select(User).where(User.id == _id))
-                user = result.scalar()
+                user = self.user_cache.get_or_set(_id, lambda: load_serialized_user(db, _id))
 
                 if user is None:
                     resp.media = {
@@ -129,7 +180,7 @@ class UserResource:
                     return
 
                 resp.media = {
-                    'value': user.serialize(),
+                    'value': user,
                     'errors': None
                 }
                 resp.status = falcon.HTTP_200
@@ -168,7 +219,7 @@ class UserResource:
 
                 user.role = user.role | Authority.MODERATOR
                 db.add(user)
-                db.commit(user)
+                db.commit()
 
                 resp.media = {
                     'value': user.serialize(),
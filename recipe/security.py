@@ -5,6 +5,7 @@ import jwt
 import os
 
 from .database.models import Authority
+from .metrics import JWT_DURATION
 
 BEARER_TOKEN_EXPIRATION_TIME: int = 60 * 60 * 24 * 30 # sec
 
@@ -16,7 +17,8 @@ def get_admin_token() -> str:
     }
 
     secret: str = os.environ.get('RECIPE_APP_SECRET')
-    token: str = jwt.encode(payload, secret, algorithm="HS256")
+    with JWT_DURATION.labels('encode').time():
+        token: str = jwt.encode(payload, secret, algorithm="HS256")
 
     return token
 
@@ -28,6 +30,7 @@ def authorize_user(id: UUID, role: int) -> str:
     }
 
     secret: str = os.environ.get('RECIPE_APP_SECRET')
-    token: str = jwt.encode(payload, secret, algorithm="HS256")
+    with JWT_DURATION.labels('encode').time():
+        token: str = jwt.encode(payload, secret, algorithm="HS256")
 
     return token
\ No newline at end of file
@@ -0,0 +1,408 @@
+"""
+Bulk data seeding for testing at production scale.
+
+    python -m recipe.seed --users 100000 --recipes 1000000 --ratings 20000000 --bookmarks 20000000
+
+Rows never go through the ORM models. They are generated in streaming
+chunks by a pool of worker processes, and every worker loads its chunks
+over its own connection: with `COPY ... FROM STDIN` on PostgreSQL and
+with a batched `executemany` on SQLite.
+
+The generated data depends only on the sizes and the seed, not on the
+number of workers: ids are derived from the entity ordinals, and every
+chunk has its own random generator.
+"""
+
+from sqlalchemy import Engine, create_engine, select, update, func, text
+
+from .database.models import (
+    User, UserPassword, Recipe, Tag, RecipesTags, BookmarkedRecipe, RatedRecipe,
+    Authority, Status
+)
+from .database.database import database_url_from_env
+from .affinity import rebuild_affinity
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from io import StringIO
+from itertools import accumulate
+from multiprocessing import Pool
+from time import perf_counter
+from typing import Any, Callable, Iterator
+from uuid import UUID
+import argparse
+import math
+import os
+import random
+import sys
+
+import bcrypt
+from dotenv import load_dotenv
+
+SEED_PASSWORD: str = 'seed-password'
+EPOCH: datetime = datetime(2023, 8, 1)
+
+# Entity kinds for `entity_id`
+USER_KIND: int = 1
+RECIPE_KIND: int = 2
+TAG_KIND: int = 3
+
+WORDS = (
+    'flour sugar butter egg milk salt pepper garlic onion tomato basil oregano '
+    'chicken beef pork fish rice pasta potato carrot cream cheese lemon honey '
+    'whisk bake boil fry simmer chop slice stir mix knead roast grill season '
+    'until golden tender smooth crispy fresh warm bowl pan oven minutes gently'
+).split()
+
+@dataclass
+class SeedConfig:
+    users: int = 1000
+    recipes: int = 10000
+    tags: int = 500
+    ratings: int = 100000
+    bookmarks: int = 100000
+    tags_per_recipe: int = 3
+    seed: int = 42
+    chunk_size: int = 50000
+    password_hash: bytes = b''
+
+def entity_id(kind: int, seed: int, index: int) -> UUID:
+    """
+    A deterministic UUIDv4 for the `index`-th entity of the given kind.
+    The low 62 bits hold the index, the high 48 bits the kind and the seed.
+    """
+    prefix = ((kind << 32) | (seed & 0xffffffff)) & 0xffffffffffff
+    return UUID(int=(prefix << 80) | index, version=4)
+
+def recipe_status(index: int) -> int:
+    # 80% approved, 15% pending, 5% denied, spread evenly over the ids
+    position = index % 20
+    if position < 16:
+        return Status.APPROVED
+    if position < 19:
+        return Status.PENDING
+    return Status.DENIED
+
+def approved_recipe_count(recipes: int) -> int:
+    return recipes // 20 * 16 + min(recipes % 20, 16)
+
+def approved_recipe_index(ordinal: int) -> int:
+    """Index of the `ordinal`-th approved recipe (see `recipe_status`)"""
+    return ordinal // 16 * 20 + ordinal % 16
+
+def random_markdown(rng: random.Random) -> str:
+    # Recipe sizes are roughly log-normal: most are a couple of kilobytes,
+    # but a long tail of very detailed ones reaches tens of kilobytes.
+    target_length = min(int(rng.lognormvariate(math.log(1500), 0.8)), 40000)
+
+    lines = [f'# {" ".join(rng.choices(WORDS, k=3)).capitalize()}', '', '## Ingredients']
+    lines += [f'- {rng.randint(1, 500)} g {rng.choice(WORDS)}' for _ in range(rng.randint(3, 12))]
+    lines += ['', '## Steps']
+
+    length = sum(len(line) + 1 for line in lines)
+    step = 1
+    while length < target_length:
+        line = f'{step}. ' + ' '.join(rng.choices(WORDS, k=rng.randint(8, 30))) + '.'
+        lines.append(line)
+        length += len(line) + 1
+        step += 1
+
+    return '\n'.join(lines)
+
+def _skewed_distinct(rng: random.Random, n: int, k: int, skew: float = 2.0) -> set[int]:
+    """`k` distinct ordinals in `0..n-1`, low ordinals being the most popular"""
+    k = min(k, n)
+    chosen: set[int] = set()
+    while len(chosen) < k:
+        chosen.add(int(n * rng.random() ** skew))
+    return chosen
+
+def _per_user(total: int, users: int, user: int) -> int:
+    return total // users + (1 if user < total % users else 0)
+
+# Row generators. Every one of them produces the rows of one chunk,
+# `start..end` being a range of users, recipes or tags.
+
+def _users(c: SeedConfig, rng: random.Random, start: int, end: int) -> Iterator[tuple]:
+    for i in range(start, end):
+        yield (
+            entity_id(USER_KIND, c.seed, i), f'seed_user_{i}', 'Seed', f'User {i}',
+            EPOCH - timedelta(minutes=rng.randrange(60 * 24 * 1000)), Authority.USER
+        )
+
+def _user_passwords(c: SeedConfig, rng: random.Random, start: int, end: int) -> Iterator[tuple]:
+    for i in range(start, end):
+        yield (entity_id(USER_KIND, c.seed, i), c.password_hash)
+
+def _tags(c: SeedConfig, rng: random.Random, start: int, end: int) -> Iterator[tuple]:
+    for i in range(start, end):
+        yield (entity_id(TAG_KIND, c.seed, i), f'tag{i}')
+
+def _recipes(c: SeedConfig, rng: random.Random, start: int, end: int) -> Iterator[tuple]:
+    for i in range(start, end):
+        created = EPOCH - timedelta(minutes=rng.randrange(60 * 24 * 1000))
+        yield (
+            entity_id(RECIPE_KIND, c.seed, i), random_markdown(rng),
+            entity_id(USER_KIND, c.seed, rng.randrange(c.users)),
+            created, created, 0.0, recipe_status(i)
+        )
+
+def _recipes_tags(c: SeedConfig, rng: random.Random, start: int, end: int) -> Iterator[tuple]:
+    # Zipfian tag popularity: a few tags are on most recipes
+    cumulative = list(accumulate(1 / (rank + 1) for rank in range(c.tags)))
+    for i in range(start, end):
+        recipe_id = entity_id(RECIPE_KIND, c.seed, i)
+        count = rng.randint(1, c.tags_per_recipe * 2 - 1)
+        for tag in set(rng.choices(range(c.tags), cum_weights=cumulative, k=count)):
+            yield (recipe_id, entity_id(TAG_KIND, c.seed, tag))
+
+def _rated_recipes(c: SeedConfig, rng: random.Random, start: int, end: int) -> Iterator[tuple]:
+    approved = approved_recipe_count(c.recipes)
+    for user in range(start, end):
+        user_id = entity_id(USER_KIND, c.seed, user)
+        for ordinal in _skewed_distinct(rng, approved, _per_user(c.ratings, c.users, user)):
+            yield (user_id, entity_id(RECIPE_KIND, c.seed, approved_recipe_index(ordinal)), float(rng.randint(1, 5)))
+
+def _bookmarked_recipes(c: SeedConfig, rng: random.Random, start: int, end: int) -> Iterator[tuple]:
+    approved = approved_recipe_count(c.recipes)
+    for user in range(start, end):
+        user_id = entity_id(USER_KIND, c.seed, user)
+        for ordinal in _skewed_distinct(rng, approved, _per_user(c.bookmarks, c.users, user)):
+            yield (
+                user_id, entity_id(RECIPE_KIND, c.seed, approved_recipe_index(ordinal)),
+                EPOCH - timedelta(minutes=rng.randrange(60 * 24 * 365))
+            )
+
+@dataclass
+class TableSpec:
+    table: Any
+    columns: list[str]
+    generate: Callable[[SeedConfig, random.Random, int, int], Iterator[tuple]]
+    entities: Callable[[SeedConfig], int] # how many users/recipes/tags are split into chunks
+    rows_per_entity: Callable[[SeedConfig], float]
+
+TABLES: dict[str, TableSpec] = {
+    spec.table.name: spec for spec in [
+        TableSpec(User.__table__, ['id', 'username', 'first_name', 'last_name', 'date_registered', 'role'],
+                  _users, lambda c: c.users, lambda c: 1),
+        TableSpec(UserPassword.__table__, ['user_id', 'hashed_password'],
+                  _user_passwords, lambda c: c.users, lambda c: 1),
+        TableSpec(Tag.__table__, ['id', 'text'],
+                  _tags, lambda c: c.tags, lambda c: 1),
+        TableSpec(Recipe.__table__, ['id', 'source', 'author_id', 'date_created', 'date_edited', 'rating', 'status'],
+                  _recipes, lambda c: c.recipes, lambda c: 1),
+        TableSpec(RecipesTags.__table__, ['recipe_id', 'tag_id'],
+                  _recipes_tags, lambda c: c.recipes, lambda c: c.tags_per_recipe),
+        TableSpec(RatedRecipe.__table__, ['user_id', 'recipe_id', 'score'],
+                  _rated_recipes, lambda c: c.users, lambda c: c.ratings / max(c.users, 1)),
+        TableSpec(BookmarkedRecipe.__table__, ['user_id', 'recipe_id', 'date_added'],
+                  _bookmarked_recipes, lambda c: c.users, lambda c: c.bookmarks / max(c.users, 1)),
+    ]
+}
+
+# Loading
+
+def _copy_value(value: Any) -> str:
+    """A value in the text format of PostgreSQL `COPY`"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    if isinstance(value, bytes):
+        return '\\\\x' + value.hex()
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return str(value)
+
+def _sqlite_value(value: Any) -> Any:
+    """A value as SQLAlchemy stores it in SQLite"""
+    if isinstance(value, UUID):
+        return value.hex
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+    return value
+
+def load_rows(engine: Engine, spec: TableSpec, rows: Iterator[tuple]) -> int:
+    count = 0
+    raw = engine.raw_connection()
+
+    try:
+        cursor = raw.cursor()
+
+        if engine.dialect.name == 'postgresql':
+            buffer = StringIO()
+            for row in rows:
+                buffer.write('\t'.join([_copy_value(value) for value in row]))
+                buffer.write('\n')
+                count += 1
+            buffer.seek(0)
+            cursor.copy_expert(f'COPY {spec.table.name} ({", ".join(spec.columns)}) FROM STDIN', buffer)
+        else:
+            statement = f'INSERT INTO {spec.table.name} ({", ".join(spec.columns)}) VALUES ({", ".join("?" * len(spec.columns))})'
+            batch = [tuple([_sqlite_value(value) for value in row]) for row in rows]
+            cursor.executemany(statement, batch)
+            count = len(batch)
+
+        raw.commit()
+    finally:
+        raw.close()
+
+    return count
+
+_engines: dict[str, Engine] = {}
+
+def _worker_engine(db_url: str) -> Engine:
+    engine = _engines.get(db_url)
+    if engine is None:
+        engine = create_engine(db_url, connect_args={'timeout': 60} if db_url.startswith('sqlite') else {})
+        _engines[db_url] = engine
+    return engine
+
+def load_chunk(task: tuple[str, str, int, int, SeedConfig]) -> tuple[str, int]:
+    db_url, table_name, start, end, config = task
+    spec = TABLES[table_name]
+
+    rng = random.Random(f'{config.seed}:{table_name}:{start}')
+    count = load_rows(_worker_engine(db_url), spec, spec.generate(config, rng, start, end))
+
+    return table_name, count
+
+def plan_chunks(db_url: str, config: SeedConfig, tables: list[str]) -> list[tuple[str, str, int, int, SeedConfig]]:
+    """Splits every table into chunks of about `chunk_size` rows, interleaving the tables"""
+    per_table = []
+    for name in tables:
+        spec = TABLES[name]
+        entities = spec.entities(config)
+        step = max(int(config.chunk_size / max(spec.rows_per_entity(config), 1)), 1)
+        per_table.append([(db_url, name, start, min(start + step, entities), config) for start in range(0, entities, step)])
+
+    tasks = []
+    for i in range(max((len(chunks) for chunks in per_table), default=0)):
+        tasks += [chunks[i] for chunks in per_table if i < len(chunks)]
+    return tasks
+
+def update_recipe_counters(engine: Engine, tables: list[str]):
+    """
+    Set the average rating and the popularity counters of the recipes
+    from the seeded rows, with one aggregate per table rather than a
+    count per recipe.
+    """
+    recipes = Recipe.__table__
+
+    with engine.begin() as conn:
+        if 'recipes' in tables or 'rated_recipes' in tables:
+            ratings = (select(RatedRecipe.recipe_id, func.avg(RatedRecipe.score).label('rating'), func.count().label('rating_count'))
+                       .group_by(RatedRecipe.recipe_id)
+                       .subquery())
+            conn.execute(update(recipes).values(rating=0, rating_count=0))
+            conn.execute(update(recipes)
+                         .where(recipes.c.id == ratings.c.recipe_id)
+                         .values(rating=ratings.c.rating, rating_count=ratings.c.rating_count))
+
+        if 'recipes' in tables or 'bookmarked_recipes' in tables:
+            bookmarks = (select(BookmarkedRecipe.recipe_id, func.count().label('bookmark_count'))
+                         .group_by(BookmarkedRecipe.recipe_id)
+                         .subquery())
+            conn.execute(update(recipes).values(bookmark_count=0))
+            conn.execute(update(recipes)
+                         .where(recipes.c.id == bookmarks.c.recipe_id)
+                         .values(bookmark_count=bookmarks.c.bookmark_count))
+
+def truncate(engine: Engine, tables: list[str]):
+    with engine.begin() as conn:
+        for name in tables:
+            if engine.dialect.name == 'postgresql':
+                conn.execute(text(f'TRUNCATE {name}'))
+            else:
+                conn.execute(text(f'DELETE FROM {name}'))
+
+def seed(db_url: str, config: SeedConfig, workers: int, tables: list[str] | None = None, log: Callable[[str], None] = print) -> dict[str, int]:
+    tables = tables or list(TABLES)
+
+    if config.password_hash == b'':
+        config.password_hash = bcrypt.hashpw(SEED_PASSWORD.encode('utf-8'), bcrypt.gensalt())
+
+    engine = create_engine(db_url)
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+
+    counts = {name: 0 for name in tables}
+    tasks = plan_chunks(db_url, config, tables)
+
+    start = perf_counter()
+    if workers == 1:
+        results = map(load_chunk, tasks)
+    else:
+        pool = Pool(workers)
+        results = pool.imap_unordered(load_chunk, tasks)
+
+    for table_name, count in results:
+        counts[table_name] += count
+        total = sum(counts.values())
+        log(f'{table_name:<20} +{count:>9} rows   total {total:>11} rows   {total / (perf_counter() - start) * 60:>13,.0f} rows/min')
+
+    if workers != 1:
+        pool.close()
+        pool.join()
+
+    if 'recipes' in tables or 'rated_recipes' in tables or 'bookmarked_recipes' in tables:
+        step = perf_counter()
+        update_recipe_counters(engine, tables)
+        log(f'recipe counters updated in {perf_counter() - step:.1f} s')
+
+    if 'rated_recipes' in tables or 'bookmarked_recipes' in tables or 'recipes_tags' in tables:
+        step = perf_counter()
+        rebuild_affinity(engine)
+        log(f'tag affinity rebuilt in {perf_counter() - step:.1f} s')
+
+    engine.dispose()
+    return counts
+
+def main(argv: list[str]) -> int:
+    load_dotenv()
+
+    defaults = SeedConfig()
+    parser = argparse.ArgumentParser(prog='python -m recipe.seed', description='Fill the database with synthetic data.')
+
+    parser.add_argument('--db-url', help='defaults to the database configured with the `RECIPE_DATABASE_*` variables')
+    parser.add_argument('--users', type=int, default=defaults.users)
+    parser.add_argument('--recipes', type=int, default=defaults.recipes)
+    parser.add_argument('--tags', type=int, default=defaults.tags)
+    parser.add_argument('--ratings', type=int, default=defaults.ratings, help='total number of `rated_recipes` rows')
+    parser.add_argument('--bookmarks', type=int, default=defaults.bookmarks, help='total number of `bookmarked_recipes` rows')
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--chunk-size', type=int, default=defaults.chunk_size, help='rows per chunk')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--table', action='append', choices=list(TABLES), help='seed only the given table (may be repeated)')
+    parser.add_argument('--truncate', action='store_true', help='delete the existing rows of the seeded tables first')
+
+    args = parser.parse_args(argv)
+    db_url = args.db_url or database_url_from_env()
+
+    config = SeedConfig(
+        users=args.users,
+        recipes=args.recipes,
+        tags=args.tags,
+        ratings=args.ratings,
+        bookmarks=args.bookmarks,
+        seed=args.seed,
+        chunk_size=args.chunk_size
+    )
+
+    tables = args.table or list(TABLES)
+
+    if args.truncate:
+        truncate(create_engine(db_url), tables)
+
+    start = perf_counter()
+    counts = seed(db_url, config, args.workers, tables, log=lambda line: print(line, file=sys.stderr))
+    elapsed = perf_counter() - start
+
+    total = sum(counts.values())
+    print(f'Seeded {total} rows in {elapsed:.1f} s ({total / elapsed * 60:,.0f} rows/min).', file=sys.stderr)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
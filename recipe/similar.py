@@ -0,0 +1,186 @@
+"""
+Similar recipes: "people who bookmarked this also bookmarked...".
+
+An offline job, to be run periodically (e.g. nightly from cron):
+
+    python -m recipe.similar --neighbours 20 --max-memory-mb 256
+
+It builds a sparse user x recipe matrix from the bookmarks and the
+ratings of the approved recipes, and finds the `k` recipes with the
+highest cosine similarity of their columns for every recipe. The
+similarities are computed for a chunk of recipes at a time, sized so
+that a dense chunk x recipes block fits into `max_memory_mb`.
+
+The neighbours are written to `recipe_neighbours`, which serves
+`GET /recipe/{id}/similar` with a single primary key range read.
+
+Needs `numpy` and `scipy`, both in `requirements.txt`.
+"""
+
+from dotenv import load_dotenv
+
+from sqlalchemy import create_engine, select, insert, delete, Engine
+
+from .database.database import database_url_from_env
+from .database.models import Recipe, BookmarkedRecipe, RatedRecipe, RecipeNeighbour, Status
+from .trending import BOOKMARK_WEIGHT, rating_weight
+
+import numpy as np
+from scipy import sparse
+
+from datetime import datetime
+from time import perf_counter
+from typing import Callable, Iterator
+from uuid import UUID
+import argparse
+import sys
+
+# recipes per delete/insert, to stay under the parameter limits of the databases
+WRITE_BATCH_SIZE: int = 500
+
+def load_interactions(engine: Engine) -> tuple[sparse.csr_matrix, list[UUID]]:
+    """
+    The user x recipe matrix of the approved recipes, and the recipe id
+    of every column. A bookmark and a rating of the same recipe add up.
+    """
+    users: dict[UUID, int] = {}
+    recipes: dict[UUID, int] = {}
+    rows: list[int] = []
+    columns: list[int] = []
+    weights: list[float] = []
+
+    approved = select(Recipe.id).where(Recipe.status == Status.APPROVED)
+
+    with engine.connect() as conn:
+        bookmarks = conn.execute(select(BookmarkedRecipe.user_id, BookmarkedRecipe.recipe_id)
+                                 .where(BookmarkedRecipe.recipe_id.in_(approved)))
+        for user_id, recipe_id in bookmarks:
+            rows.append(users.setdefault(user_id, len(users)))
+            columns.append(recipes.setdefault(recipe_id, len(recipes)))
+            weights.append(BOOKMARK_WEIGHT)
+
+        ratings = conn.execute(select(RatedRecipe.user_id, RatedRecipe.recipe_id, RatedRecipe.score)
+                               .where(RatedRecipe.recipe_id.in_(approved)))
+        for user_id, recipe_id, score in ratings:
+            rows.append(users.setdefault(user_id, len(users)))
+            columns.append(recipes.setdefault(recipe_id, len(recipes)))
+            weights.append(rating_weight(score))
+
+    # the duplicates are summed up
+    matrix = sparse.csr_matrix(
+        (np.array(weights, dtype=np.float32), (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64))),
+        shape=(len(users), len(recipes))
+    )
+    return matrix, list(recipes)
+
+def top_neighbours(matrix: sparse.csr_matrix, k: int, chunk_size: int) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+    """
+    For every chunk of columns of `matrix`, yields the index of its first
+    column, and the indices and cosine similarities of the `k` most
+    similar other columns of every column in it, the most similar first.
+    Columns with a similarity of zero are never neighbours: their index is -1.
+    """
+    n = matrix.shape[1]
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    normalized = (matrix @ sparse.diags(1 / np.maximum(norms, 1e-12))).tocsc().astype(np.float32)
+    items = normalized.T.tocsr()
+
+    k = min(k, n - 1)
+    if k <= 0:
+        return
+
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        similarities = (items[start:end] @ normalized).toarray()
+
+        # not a neighbour of itself
+        similarities[np.arange(end - start), np.arange(start, end)] = 0
+
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-scores, axis=1)
+
+        top = np.take_along_axis(top, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        top[scores <= 0] = -1
+
+        yield start, top, scores
+
+def write_neighbours(engine: Engine, recipe_ids: list[UUID], start: int, top: np.ndarray, scores: np.ndarray, now: datetime):
+    table = RecipeNeighbour.__table__
+
+    for offset in range(0, len(top), WRITE_BATCH_SIZE):
+        batch = range(offset, min(offset + WRITE_BATCH_SIZE, len(top)))
+        rows = [
+            {
+                'recipe_id': recipe_ids[start + i],
+                'rank': rank,
+                'neighbour_id': recipe_ids[neighbour],
+                'score': float(scores[i, rank]),
+                'date_computed': now
+            }
+            for i in batch
+            for rank, neighbour in enumerate(top[i].tolist()) if neighbour >= 0
+        ]
+
+        # the old neighbours are replaced at once, the readers never see a partial list
+        with engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.recipe_id.in_([recipe_ids[start + i] for i in batch])))
+            if rows:
+                conn.execute(insert(table), rows)
+
+def compute_similar(engine: Engine, k: int = 20, max_memory_mb: float = 256, log: Callable[[str], None] = lambda line: None) -> dict[str, float]:
+    """Recompute the neighbours of every approved recipe. Returns the timings, in seconds"""
+    now = datetime.utcnow()
+    timings = {}
+
+    start = perf_counter()
+    matrix, recipe_ids = load_interactions(engine)
+    timings['load'] = perf_counter() - start
+    log(f'loaded {matrix.nnz} interactions of {matrix.shape[0]} users with {matrix.shape[1]} recipes')
+
+    # a dense float32 block of `chunk_size` x recipes
+    chunk_size = max(int(max_memory_mb * 2 ** 20 // (max(len(recipe_ids), 1) * 4)), 1)
+
+    compute = write = 0.0
+    start = perf_counter()
+    for chunk_start, top, scores in top_neighbours(matrix, k, chunk_size):
+        compute += perf_counter() - start
+
+        start = perf_counter()
+        write_neighbours(engine, recipe_ids, chunk_start, top, scores, now)
+        write += perf_counter() - start
+
+        log(f'{chunk_start + len(top)} / {len(recipe_ids)} recipes')
+        start = perf_counter()
+
+    # the recipes that are not approved anymore, or lost all their interactions
+    start = perf_counter()
+    with engine.begin() as conn:
+        conn.execute(delete(RecipeNeighbour.__table__).where(RecipeNeighbour.date_computed < now))
+    write += perf_counter() - start
+
+    timings['compute'] = compute
+    timings['write'] = write
+    return timings
+
+def main(argv: list[str]) -> int:
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(prog='python -m recipe.similar', description='Recompute the similar recipes.')
+    parser.add_argument('--db-url', help='defaults to the database configured with the `RECIPE_DATABASE_*` variables')
+    parser.add_argument('--neighbours', type=int, default=20, help='similar recipes stored per recipe')
+    parser.add_argument('--max-memory-mb', type=float, default=256, help='for a chunk of the similarity matrix')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.db_url or database_url_from_env())
+
+    timings = compute_similar(engine, args.neighbours, args.max_memory_mb, log=lambda line: print(line, file=sys.stderr))
+    print(', '.join(f'{phase} {seconds:.1f} s' for phase, seconds in timings.items()), file=sys.stderr)
+
+    engine.dispose()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
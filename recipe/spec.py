@@ -1,5 +1,14 @@
 from spectree import SpecTree, SecurityScheme
 
+import falcon
+from falcon import Request, Response
+
+from importlib.metadata import version
+from threading import Lock
+import hashlib
+import os
+import tempfile
+
 api = SpecTree(
     'falcon',
     title='Recipe Sharing Platform API',
@@ -19,5 +28,85 @@ api = SpecTree(
     ],
     security={
         'auth_jwt': []
-    }
-)
\ No newline at end of file
+    },
+    # only the routes validated by `api`, not `/metrics` and alike
+    mode='strict'
+)
+
+# The spec is generated by inspecting every route and validation model,
+# which is slow. Instead of `api.register(app)`, which does it eagerly,
+# the spec is generated on the first request to it, and it is cached on
+# disk (keyed by the source code it was generated from) so that other
+# workers and later restarts can skip the generation altogether.
+
+DEFAULT_SPEC_CACHE_DIR: str = os.path.join(tempfile.gettempdir(), 'recipe-openapi')
+
+def _source_fingerprint() -> str:
+    digest = hashlib.sha256(f'spectree {version("spectree")} pydantic {version("pydantic")}'.encode('utf-8'))
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+
+    for root, dirs, files in os.walk(package_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, package_dir).encode('utf-8'))
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+
+    return digest.hexdigest()[:16]
+
+class OpenAPISpecResource:
+    cache_dir: str
+
+    def __init__(self, spec_tree: SpecTree, cache_dir: str):
+        self.spec_tree = spec_tree
+        self.cache_dir = cache_dir
+        self._data: bytes | None = None
+        self._lock = Lock()
+
+    def _load(self) -> bytes:
+        path = os.path.join(self.cache_dir, f'openapi-{_source_fingerprint()}.json')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return f.read()
+
+        data = falcon.media.JSONHandler().serialize(self.spec_tree.spec, falcon.MEDIA_JSON)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        return data
+
+    def on_get(self, req: Request, resp: Response):
+        with self._lock:
+            if self._data is None:
+                self._data = self._load()
+
+        resp.data = self._data
+        resp.content_type = falcon.MEDIA_JSON
+
+def register_docs(app: falcon.App, cache_dir: str | None = None):
+    """Serve the OpenAPI spec and the documentation pages, like `api.register(app)` does"""
+    if cache_dir is None:
+        cache_dir = os.environ.get('RECIPE_OPENAPI_CACHE_DIR', DEFAULT_SPEC_CACHE_DIR)
+
+    api.app = app
+    api.backend.app = app
+
+    config = api.config
+    app.add_route(config.spec_url, OpenAPISpecResource(api, cache_dir))
+
+    for ui, template in config.page_templates.items():
+        app.add_route(
+            f'/{config.path}/{ui}',
+            api.backend.DOC_PAGE_ROUTE_CLASS(
+                template,
+                spec_url=config.filename,
+                spec_path=config.path,
+                **config.swagger_oauth2_config()
+            )
+        )
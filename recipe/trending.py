@@ -0,0 +1,160 @@
+"""
+Trending recipes.
+
+Every bookmark and rating adds `weight * 2 ** ((t - EPOCH) / half_life)`
+to the score of its recipe. Decaying all scores by the same factor
+would not change their order, so instead of decaying the old scores,
+the new events get exponentially larger weights. The scores are stored
+as natural logarithms, which never overflow:
+
+    log_score = log(sum(weight_i * exp(rate * (t_i - EPOCH))))
+
+The handlers only append the events to `recipe_activity`, in the same
+transaction as the bookmark or rating. `process_activity` claims them in
+batches with `DELETE ... RETURNING` (so that concurrent runs never count
+an event twice) and folds them into `recipe_trending`, touching only the
+recipes with new events.
+
+Every worker keeps the ids of the top `size` approved recipes in memory
+and refreshes them every `interval` seconds, with a periodic background
+job (see `recipe.jobs`).
+"""
+
+from sqlalchemy import select, insert, update, delete, bindparam
+from sqlalchemy.orm import Session, sessionmaker
+
+from .database.models import Recipe, RecipeActivity, RecipeTrending, Status
+from .jobs import JobRunner
+from .metrics import TRENDING_EVENTS, TRENDING_REFRESH_DURATION
+
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Iterable
+from uuid import UUID
+import math
+
+EPOCH: datetime = datetime(2023, 1, 1)
+
+BOOKMARK_WEIGHT: float = 1.0
+
+def rating_weight(score: float) -> float:
+    # a 5-star rating weighs as much as a bookmark;
+    # plain arithmetic, so it also builds the SQL expression of a score column
+    return score / 5
+
+def logaddexp(a: float, b: float) -> float:
+    """`log(exp(a) + exp(b))`, without overflowing"""
+    high, low = (a, b) if a > b else (b, a)
+    return high + math.log1p(math.exp(low - high))
+
+def record_activity(db: Session, recipe_ids: Iterable[UUID], weight: float, now: datetime):
+    """Count a bookmark or a rating of every recipe in the trending scores, once committed"""
+    rows = [{'recipe_id': recipe_id, 'weight': weight, 'date_created': now} for recipe_id in recipe_ids]
+    if rows:
+        db.connection().execute(insert(RecipeActivity.__table__), rows)
+
+def process_activity(db_sessionmaker: sessionmaker[Session], half_life: timedelta, batch_size: int = 1000) -> int:
+    """Fold the new events into the scores, a batch per transaction. Returns the number of events"""
+    rate = math.log(2) / half_life.total_seconds()
+    activity = RecipeActivity.__table__
+    trending = RecipeTrending.__table__
+
+    processed = 0
+    while True:
+        with db_sessionmaker() as db:
+            conn = db.connection()
+            now = datetime.utcnow()
+
+            # claiming the events is the first write, so it also takes the SQLite write lock
+            oldest = select(activity.c.id).order_by(activity.c.id).limit(batch_size).scalar_subquery()
+            events = conn.execute(delete(activity)
+                                  .where(activity.c.id.in_(oldest))
+                                  .returning(activity.c.recipe_id, activity.c.weight, activity.c.date_created)).all()
+            if not events:
+                return processed
+
+            increments: dict[UUID, float] = {}
+            for recipe_id, weight, date_created in events:
+                term = rate * (date_created - EPOCH).total_seconds() + math.log(weight)
+                previous = increments.get(recipe_id)
+                increments[recipe_id] = term if previous is None else logaddexp(previous, term)
+
+            scores = dict(conn.execute(select(trending.c.recipe_id, trending.c.log_score)
+                                       .where(trending.c.recipe_id.in_(increments))
+                                       .with_for_update()).all())
+
+            updated = [
+                {'b_recipe_id': recipe_id, 'b_log_score': logaddexp(scores[recipe_id], increment)}
+                for recipe_id, increment in increments.items() if recipe_id in scores
+            ]
+            created = [
+                {'recipe_id': recipe_id, 'log_score': increment, 'date_updated': now}
+                for recipe_id, increment in increments.items() if recipe_id not in scores
+            ]
+
+            if updated:
+                conn.execute(update(trending)
+                             .where(trending.c.recipe_id == bindparam('b_recipe_id'))
+                             .values(log_score=bindparam('b_log_score'), date_updated=now), updated)
+            if created:
+                conn.execute(insert(trending), created)
+
+            db.commit()
+
+        processed += len(events)
+        TRENDING_EVENTS.inc(len(events))
+
+def top_trending(db: Session, size: int) -> list[UUID]:
+    """The ids of the `size` approved recipes with the highest scores"""
+    return db.scalars(select(RecipeTrending.recipe_id)
+                      .join(Recipe, Recipe.id == RecipeTrending.recipe_id)
+                      .where(Recipe.status == Status.APPROVED)
+                      .order_by(RecipeTrending.log_score.desc())
+                      .limit(size)).all()
+
+class TrendingFeed:
+    db_session: sessionmaker[Session]
+    jobs: JobRunner
+    half_life: timedelta
+    interval: float # seconds between the refreshes
+    size: int
+
+    recipe_ids: list[UUID] # the current top, the highest score first
+
+    def __init__(self, db_sessionmaker: sessionmaker[Session], jobs: JobRunner, half_life: timedelta = timedelta(hours=48), interval: float = 60.0, size: int = 500):
+        self.db_session = db_sessionmaker
+        self.jobs = jobs
+        self.half_life = half_life
+        self.interval = interval
+        self.size = size
+
+        self.recipe_ids = []
+
+        self._lock = Lock()
+        self._scheduled = False
+
+        # the next refresh is scheduled anyway, no need to retry
+        jobs.register('trending_refresh', lambda payload: self.refresh(), retries=0)
+
+    def top(self) -> list[UUID]:
+        if not self._scheduled:
+            self._start()
+        return self.recipe_ids
+
+    def refresh(self):
+        with TRENDING_REFRESH_DURATION.time():
+            process_activity(self.db_session, self.half_life)
+            with self.db_session() as db:
+                self.recipe_ids = top_trending(db, self.size)
+
+    def _start(self):
+        # on first use, so that under gunicorn the job runs in the worker, not in the master
+        with self._lock:
+            if self._scheduled:
+                return
+
+            # the first request waits for the initial top
+            self.refresh()
+
+            self.jobs.every(self.interval, 'trending_refresh')
+            self._scheduled = True
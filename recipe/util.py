@@ -8,6 +8,7 @@ import os
 
 from .database.models import Authority
 from .validation import ResponseWrapper
+from .metrics import JWT_DURATION
 
 class FieldsMissing(falcon.HTTPBadRequest):
     fields: list[str]
@@ -63,7 +64,8 @@ def check_auth(req: Request, resp: Response, resource, params, allowed_authoriti
     secret = os.environ.get('RECIPE_APP_SECRET')
 
     try:
-        payload = jwt.decode(token, secret, algorithms=['HS256'])
+        with JWT_DURATION.labels('decode').time():
+            payload = jwt.decode(token, secret, algorithms=['HS256'])
     except jwt.ExpiredSignatureError:
         raise Unauthorized('the authorization token has expired. Please, authorize again')
     except Exception:
@@ -27,9 +27,9 @@ from pydantic.version import VERSION as PYDANTIC_VERSION
 PYDANTIC2 = PYDANTIC_VERSION.startswith("2")
 
 if PYDANTIC2:
-    from pydantic.v1 import BaseModel, Field, constr
+    from pydantic.v1 import BaseModel, Field, constr, validator
 else:
-    from pydantic import BaseModel, Field, constr
+    from pydantic import BaseModel, Field, constr, validator
 
 import falcon
 from datetime import datetime
@@ -37,6 +37,9 @@ from uuid import UUID
 
 DEFAULT_PAGE_SIZE: int = 20
 MAX_PAGE_SIZE: int = 50
+MAX_BULK_STATUS_ITEMS: int = 5000
+MAX_BULK_BOOKMARK_ITEMS: int = 1000
+MAX_BATCH_GET_ITEMS: int = 100
 
 # Database entity creation models
 
@@ -75,7 +78,7 @@ class UserPasswordCreate(BaseModel):
 
 # Request and response models (for `spectree`)
 
-from typing import Any
+from typing import Any, Literal
 
 # Common
 
@@ -98,6 +101,14 @@ class PaginationParams(BaseModel):
     page: int | None = Field(default=1, ge=1)
     elements: int | None = Field(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
 
+class BatchGetParams(BaseModel):
+    ids: list[UUID] = Field(min_items=1, max_items=MAX_BATCH_GET_ITEMS) # `ids=a,b,c` or `ids=a&ids=b&ids=c`
+
+    @validator('ids', pre=True)
+    def split_ids(cls, value):
+        values = value if isinstance(value, list) else [value]
+        return [_id for v in values for _id in str(v).split(',') if _id]
+
 # User
 
 class UserData(BaseModel):
@@ -120,8 +131,24 @@ class UserResponse(BaseModel):
     value: UserData
     errors: list[str] | None
 
+class UserBatchResponseValue(BaseModel):
+    data: list[UserData] # in the order of `ids`
+    missing: list[UUID]
+
+class UserBatchResponse(BaseModel):
+    value: UserBatchResponseValue
+    errors: list[str] | None
+
 # Recipe
 
+class NearDuplicate(BaseModel):
+    id: UUID
+    status: int
+    similarity: float = Field(ge=0, le=1) # the estimated Jaccard similarity of the sources
+
+    def serialize(self) -> dict[str, Any]:
+        return {'id': str(self.id), 'status': self.status, 'similarity': self.similarity}
+
 class RecipeData(BaseModel):
     id: UUID
     source: str
@@ -130,11 +157,14 @@ class RecipeData(BaseModel):
     date_edited: str
     rating: float
     status: int
+    version: int = 1
     bookmarked: bool
     user_score: float | None = Field(default=None, ge=1, le=5)
+    html: str | None = None # the sanitized HTML of `source`, only with `format=html`
+    near_duplicates: list[NearDuplicate] | None = None # only in the moderation queue
 
     def serialize(self) -> dict[str, Any]:
-        return {
+        data = {
             'id': str(self.id),
             'source': self.source,
             'author_id': str(self.author_id),
@@ -142,19 +172,28 @@ class RecipeData(BaseModel):
             'date_edited': self.date_edited,
             'rating': self.rating,
             'status': self.status,
+            'version': self.version,
             'bookmarked': self.bookmarked,
             'user_score': self.user_score
         }
+        if self.html is not None:
+            data['html'] = self.html
+        if self.near_duplicates is not None:
+            data['near_duplicates'] = [duplicate.serialize() for duplicate in self.near_duplicates]
+        return data
 
 class PaginatedRecipeResponseValue(BaseModel):
     totalPages: int
     data: list[RecipeData]
 
-class PaginatedRecipeResponse(BaseModel):
+class IncludedAuthors(BaseModel):
+    authors: dict[UUID, UserData] | None = None # author id -> author, only with `include=author`
+
+class PaginatedRecipeResponse(IncludedAuthors):
     value: PaginatedRecipeResponseValue
     errors: list[str] | None
 
-class RecipeResponse(BaseModel):
+class RecipeResponse(IncludedAuthors):
     value: RecipeData
     errors: list[str] | None
 
@@ -162,14 +201,129 @@ class RecipeAddRequest(BaseModel):
     source: str
     tags: list[str] | None
 
+class RecipeSourceRequest(BaseModel):
+    base_version: int = Field(ge=1) # the version that is edited, it must be the current one
+    source: str | None = None # the new source
+    diff: str | None = None # a unified diff against `base_version` instead of `source`
+
+class RecipeSourceParams(BaseModel):
+    version: int | None = Field(default=None, ge=1) # the current one by default
+
+class RecipeSourceData(BaseModel):
+    version: int
+    source: str
+
+class RecipeSourceResponse(BaseModel):
+    value: RecipeSourceData
+    errors: list[str] | None
+
 class RecipeChangeStatusRequest(BaseModel):
     status: int = Field(ge=0, le=2)
 
-class RecipeSearchRequest(BaseModel):
+class RecipeStatusItem(BaseModel):
+    id: UUID
+    status: int = Field(ge=0, le=2)
+
+class RecipeBulkStatusRequest(BaseModel):
+    items: list[RecipeStatusItem] = Field(min_items=1, max_items=MAX_BULK_STATUS_ITEMS)
+
+class RecipeStatusResult(BaseModel):
+    id: UUID
+    status: int
+    updated: bool # false if there is no such recipe
+
+class RecipeBulkStatusResponse(BaseModel):
+    value: list[RecipeStatusResult]
+    errors: list[str] | None
+
+class RecipeFormatParams(BaseModel):
+    format: Literal['markdown', 'html'] | None = 'markdown' # `html` adds the rendered `source`
+    include: Literal['author'] | None = None # `author` adds the authors of the recipes as `authors`
+
+class RecipePageParams(PaginationParams, RecipeFormatParams):
+    pass
+
+class RecipeListParams(RecipePageParams):
+    sort: Literal['rating', 'newest', 'bookmarks', 'ratings'] | None = 'rating'
+
+class SimilarRecipesParams(RecipeFormatParams):
+    n: int | None = Field(default=10, ge=1, le=MAX_PAGE_SIZE)
+
+class RecipeListResponse(IncludedAuthors):
+    value: list[RecipeData]
+    errors: list[str] | None
+
+class RecipeBatchParams(BatchGetParams, RecipeFormatParams):
+    pass
+
+class RecipeBatchResponseValue(BaseModel):
+    data: list[RecipeData] # in the order of `ids`
+    missing: list[UUID]
+
+class RecipeBatchResponse(IncludedAuthors):
+    value: RecipeBatchResponseValue
+    errors: list[str] | None
+
+class RecipeSearchRequest(RecipeFormatParams):
     page: int | None = Field(default=1, ge=1)
     elements: int | None = Field(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
     q: constr(min_length=1, max_length=512)
 
+# Attachments
+
+class AttachmentData(BaseModel):
+    sha256: str
+    url: str
+    content_type: str
+    size: int
+    date_added: str
+
+class AttachmentResponse(BaseModel):
+    value: AttachmentData
+    errors: list[str] | None
+
+class AttachmentListResponse(BaseModel):
+    value: list[AttachmentData]
+    errors: list[str] | None
+
+# Bookmarks
+
+class BookmarkFeedParams(RecipePageParams):
+    after: str | None = None # the `next` cursor of the previous page, instead of `page`
+    hide_denied: bool | None = False
+
+class BookmarkFeedResponseValue(PaginatedRecipeResponseValue):
+    next: str | None # the cursor of the next page, if there is one
+
+class BookmarkFeedResponse(IncludedAuthors):
+    value: BookmarkFeedResponseValue
+    errors: list[str] | None
+
+class BookmarkBatchRequest(BaseModel):
+    ids: list[UUID] = Field(min_items=1, max_items=MAX_BULK_BOOKMARK_ITEMS)
+
+class BookmarkBatchResult(BaseModel):
+    id: UUID
+    result: str # 'added', 'exists', 'removed' or 'not_found'
+
+class BookmarkBatchResponse(BaseModel):
+    value: list[BookmarkBatchResult]
+    errors: list[str] | None
+
+# Moderation
+
+class ModerationClaimParams(BaseModel):
+    n: int | None = Field(default=10, ge=1, le=MAX_PAGE_SIZE)
+    include: Literal['author'] | None = None
+
+class ModerationClaimResponseValue(BaseModel):
+    expires: str
+    data: list[RecipeData]
+
+class ModerationClaimResponse(IncludedAuthors):
+    value: ModerationClaimResponseValue
+    errors: list[str] | None
+
 # Auth
 
 class LoginRequest(BaseModel):
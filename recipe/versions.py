@@ -0,0 +1,157 @@
+"""
+Version history of the recipe sources (`PATCH /recipe/{id}/source`).
+
+The current source stays in `Recipe.source`, numbered `Recipe.version`.
+The history is kept in `recipe_versions`, one row per version, from the
+first edit on (a recipe that was never edited has no rows). Every
+`SNAPSHOT_INTERVAL`-th version (1, 11, 21, ...) is a full snapshot, the
+others are deltas from the previous version: the lines copied from it as
+ranges, and the new lines as they are. Both are compressed with `zlib`,
+so the history grows with the size of the changes, and rebuilding a
+version applies at most `SNAPSHOT_INTERVAL - 1` deltas to a snapshot.
+
+An edit comes either as the new source or as a unified diff
+(`diff -u`, `git diff`, or any library that makes them) against the
+current version.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .database.models import Recipe, RecipeVersion
+
+from difflib import SequenceMatcher
+from uuid import UUID
+import json
+import re
+import zlib
+
+# a full snapshot every that many versions
+SNAPSHOT_INTERVAL: int = 10
+
+class DiffError(ValueError):
+    pass
+
+def _lines(text: str) -> list[str]:
+    """The lines of `text` with their `\\n`, only `\\n` ends a line"""
+    return re.findall(r'[^\n]*\n|[^\n]+', text)
+
+def is_snapshot(version: int) -> bool:
+    return (version - 1) % SNAPSHOT_INTERVAL == 0
+
+# Deltas
+
+def make_delta(old: str, new: str) -> list:
+    """`new` as `[start, end]` ranges of the lines of `old` and strings of the new lines"""
+    old_lines, new_lines = _lines(old), _lines(new)
+    delta: list = []
+
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j1 < j2:
+            delta.append(''.join(new_lines[j1:j2]))
+
+    return delta
+
+def apply_delta(old: str, delta: list) -> str:
+    old_lines = _lines(old)
+    return ''.join(''.join(old_lines[op[0]:op[1]]) if isinstance(op, list) else op for op in delta)
+
+def _pack(value) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+def _unpack(data: bytes):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+# Unified diffs
+
+_HUNK_HEADER = re.compile(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+def apply_unified_diff(text: str, diff: str) -> str:
+    """Apply a unified diff to `text`, checking every context and removed line"""
+    lines = _lines(text)
+    diff_lines = _lines(diff)
+
+    i = 0
+    while i < len(diff_lines) and not diff_lines[i].startswith('@@'):
+        # `---`, `+++` and the headers of `git diff`
+        i += 1
+    if i == len(diff_lines):
+        raise DiffError('The diff has no hunks.')
+
+    result: list[str] = []
+    position = 0 # the next line of `text`
+
+    while i < len(diff_lines):
+        header = _HUNK_HEADER.match(diff_lines[i])
+        if header is None:
+            raise DiffError(f'Line {i + 1} of the diff is not a hunk header.')
+        i += 1
+
+        old_start, old_length = int(header[1]), 1 if header[2] is None else int(header[2])
+        # a hunk that only adds lines goes after line `old_start`
+        start = old_start if old_length == 0 else old_start - 1
+        if start < position or start > len(lines):
+            raise DiffError(f'The hunk at line {i} of the diff is out of order or out of the text.')
+
+        result += lines[position:start]
+        position = start
+
+        while i < len(diff_lines) and not diff_lines[i].startswith('@@'):
+            line = diff_lines[i]
+            i += 1
+
+            tag, body = (' ', line) if line == '\n' else (line[0], line[1:]) # some editors strip the space of empty context lines
+            if i < len(diff_lines) and diff_lines[i].startswith('\\'):
+                # "\ No newline at end of file"
+                body = body.removesuffix('\n')
+                i += 1
+            elif not body.endswith('\n'):
+                body += '\n'
+
+            if tag == '+':
+                result.append(body)
+            elif tag in (' ', '-'):
+                if position >= len(lines) or lines[position] != body:
+                    raise DiffError(f'Line {position + 1} of the source doesn\'t match line {i} of the diff.')
+                if tag == ' ':
+                    result.append(body)
+                position += 1
+            else:
+                raise DiffError(f'Line {i} of the diff is not a context, added or removed line.')
+
+    result += lines[position:]
+    return ''.join(result)
+
+# History
+
+def record_version(db: Session, recipe: Recipe, previous_source: str):
+    """Add the current version of the edited recipe to its history, `previous_source` being the source of the version before"""
+    if recipe.version == 2:
+        # the first edit: the history starts with the original source
+        db.add(RecipeVersion(recipe_id=recipe.id, version=1, snapshot=True, data=_pack(previous_source), date_created=recipe.date_created))
+
+    snapshot = is_snapshot(recipe.version)
+    db.add(RecipeVersion(
+        recipe_id=recipe.id,
+        version=recipe.version,
+        snapshot=snapshot,
+        data=_pack(recipe.source if snapshot else make_delta(previous_source, recipe.source)),
+        date_created=recipe.date_edited
+    ))
+
+def load_version(db: Session, recipe_id: UUID, version: int) -> str | None:
+    """The source of an earlier version of the recipe, from its snapshot and the deltas after it"""
+    first = version - (version - 1) % SNAPSHOT_INTERVAL
+
+    rows = db.execute(select(RecipeVersion.snapshot, RecipeVersion.data)
+                      .where((RecipeVersion.recipe_id == recipe_id) & RecipeVersion.version.between(first, version))
+                      .order_by(RecipeVersion.version)).all()
+    if len(rows) != version - first + 1 or not rows[0].snapshot:
+        return None
+
+    source = _unpack(rows[0].data)
+    for row in rows[1:]:
+        source = apply_delta(source, _unpack(row.data))
+    return source
@@ -1,10 +1,13 @@
 import os
+import shutil
 import pytest
 
 from sqlalchemy import Engine, create_engine
 
 from recipe.database.database import init_db
 
+from dotenv import load_dotenv
+
 def pytest_sessionstart(session):
     db_url = 'sqlite:///db/test.db'
 
@@ -16,7 +19,19 @@ def pytest_sessionfinish(session):
     if os.path.exists('./db/test.db'):
         os.remove('./db/test.db')
 
+    shutil.rmtree('./db/attachments', ignore_errors=True)
+
 def pytest_configure():
+    load_dotenv()
+
+    # fail loudly on N+1 queries instead of logging a warning
+    os.environ['RECIPE_SQL_REPEAT_RAISE'] = '1'
+
+    # run the background jobs right after the commit, so that the responses that follow see their results
+    os.environ['RECIPE_JOBS_WORKERS'] = '0'
+
+    os.environ['RECIPE_ATTACHMENT_DIR'] = './db/attachments'
+
     pytest.user_token = None
     pytest.recipe_id = None
     pytest.user_id = None
\ No newline at end of file
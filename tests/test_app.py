@@ -0,0 +1,77 @@
+import pytest
+import falcon
+from falcon.testing import TestClient
+
+from recipe.app import create_app
+from recipe.spec import register_docs, api
+import recipe.app
+import recipe.spec
+
+import json
+import os
+import subprocess
+import sys
+
+def test_import_has_no_side_effects():
+    # a fresh interpreter without any configuration: nothing is built, loaded or logged
+    env = {key: value for key, value in os.environ.items() if not key.startswith('RECIPE_')}
+    result = subprocess.run(
+        [sys.executable, '-c', (
+            'import sys, json, recipe.app; '
+            'print(json.dumps({"modules": sorted(m for m in sys.modules if m.startswith(("recipe", "sqlalchemy"))), '
+            '"built": recipe.app._default_app is not None}))'
+        )],
+        capture_output=True, text=True, env=env, check=True
+    )
+
+    loaded = json.loads(result.stdout)
+    assert loaded['built'] is False
+    assert not any(module.startswith(('recipe.resources', 'recipe.database', 'sqlalchemy')) for module in loaded['modules'])
+    assert result.stderr == ''
+
+def test_default_app_is_built_once(monkeypatch):
+    built = []
+
+    def create_default_app() -> falcon.App:
+        built.append(falcon.App())
+        return built[-1]
+
+    monkeypatch.setattr(recipe.app, 'create_default_app', create_default_app)
+    monkeypatch.setattr(recipe.app, '_default_app', None)
+
+    assert recipe.app.app is recipe.app.app
+    assert built == [recipe.app.app]
+
+    with pytest.raises(AttributeError):
+        recipe.app.application
+
+def test_docs_are_cached_by_fingerprint(tmp_path, monkeypatch):
+    app = create_app('sqlite:///db/test.db')
+    register_docs(app, cache_dir=str(tmp_path))
+
+    resp = TestClient(app).simulate_get(api.config.spec_url)
+    assert resp.status_code == 200
+    assert '/recipe/{_id}' in resp.json['paths']
+    assert '/metrics' not in resp.json['paths']
+
+    cached = os.listdir(tmp_path)
+    assert cached == [f'openapi-{recipe.spec._source_fingerprint()}.json']
+
+    # another worker serves the cached spec without generating it
+    def fail(self):
+        raise AssertionError('the spec was generated again')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(type(api), 'spec', property(fail))
+
+        app = create_app('sqlite:///db/test.db')
+        register_docs(app, cache_dir=str(tmp_path))
+        assert TestClient(app).simulate_get(api.config.spec_url).json == resp.json
+
+    # a change of the source is a new fingerprint, and the spec is generated again
+    monkeypatch.setattr(recipe.spec, '_source_fingerprint', lambda: 'changed')
+
+    app = create_app('sqlite:///db/test.db')
+    register_docs(app, cache_dir=str(tmp_path))
+    assert TestClient(app).simulate_get(api.config.spec_url).json == resp.json
+    assert sorted(os.listdir(tmp_path)) == sorted(cached + ['openapi-changed.json'])
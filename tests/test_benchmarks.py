@@ -0,0 +1,61 @@
+import pytest
+
+from benchmarks.run import main
+
+import json
+
+SCENARIOS = ['recipe_feed', 'recipe_by_id', 'bookmark_post', 'auth_login']
+
+@pytest.mark.parametrize('driver', [[], ['--http']], ids=['in-process', 'http'])
+def test_benchmark_run(tmp_path, driver: list[str]):
+    output = tmp_path / 'results.json'
+
+    code = main([
+        '--db-url', f'sqlite:///{tmp_path / "benchmark.db"}',
+        '--users', '5',
+        '--recipes', '30',
+        '--tags', '10',
+        '--ratings-per-user', '3',
+        '--bookmarks-per-user', '3',
+        '--requests', '10',
+        '--warmup', '2',
+        '--concurrency', '2',
+        '--startup-runs', '0',
+        '--output', str(output),
+        *[arg for name in SCENARIOS for arg in ('--scenario', name)],
+        *driver
+    ])
+
+    assert code == 0
+
+    results = json.loads(output.read_text())
+    assert results['meta']['driver'] == ('http' if driver else 'in-process')
+    assert set(results['scenarios']) == set(SCENARIOS)
+
+    for summary in results['scenarios'].values():
+        assert summary['requests'] == 10
+        assert summary['errors'] == 0
+        assert 0 < summary['p50_ms'] <= summary['p95_ms'] <= summary['p99_ms']
+
+def test_benchmark_baseline(tmp_path):
+    args = [
+        '--db-url', f'sqlite:///{tmp_path / "benchmark.db"}',
+        '--users', '3',
+        '--recipes', '10',
+        '--tags', '5',
+        '--ratings-per-user', '2',
+        '--bookmarks-per-user', '2',
+        '--requests', '5',
+        '--warmup', '0',
+        '--startup-runs', '0',
+        '--scenario', 'recipe_feed'
+    ]
+
+    assert main([*args, '--output', str(tmp_path / 'baseline.json')]) == 0
+
+    # a baseline that is impossibly fast is a regression
+    baseline = json.loads((tmp_path / 'baseline.json').read_text())
+    baseline['scenarios']['recipe_feed'].update(p95_ms=1e-6, p99_ms=1e-6, throughput_rps=1e9)
+    (tmp_path / 'baseline.json').write_text(json.dumps(baseline))
+
+    assert main([*args, '--output', str(tmp_path / 'results.json'), '--baseline', str(tmp_path / 'baseline.json')]) == 1
@@ -0,0 +1,200 @@
+import pytest
+
+from recipe.cache import Cache, MemoryCache, SQLiteCache, RedisCache, InvalidationBus
+from recipe.cache.bus import FileTransport
+
+from threading import Barrier, Lock, Thread
+from time import monotonic, sleep
+from uuid import uuid4
+import os
+
+REDIS_URL: str = os.environ.get('RECIPE_TEST_REDIS_URL', 'redis://localhost:6379/15')
+
+def _redis_cache(name: str, **kwargs) -> RedisCache:
+    redis = pytest.importorskip('redis')
+    try:
+        redis.Redis.from_url(REDIS_URL, socket_connect_timeout=0.5).ping()
+    except redis.RedisError:
+        pytest.skip(f'no Redis server at {REDIS_URL}')
+    return RedisCache(name, REDIS_URL, **kwargs)
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def new_cache(request, tmp_path):
+    """
+    Makes the caches of one test. The caches with the same name share
+    the backend, like the workers do, except for `memory`.
+    """
+    made: list[Cache] = []
+    suffix = uuid4().hex[:8]
+
+    def new_cache(name: str = 'test', **kwargs) -> Cache:
+        name = f'{name}-{suffix}'
+        if request.param == 'memory':
+            cache = MemoryCache(name, **kwargs)
+        elif request.param == 'sqlite':
+            cache = SQLiteCache(name, str(tmp_path / 'cache.db'), **kwargs)
+        else:
+            cache = _redis_cache(name, **kwargs)
+        made.append(cache)
+        return cache
+
+    yield new_cache
+
+    for cache in made:
+        cache.clear()
+
+def test_get_set(new_cache):
+    cache = new_cache()
+
+    assert cache.get('a') is None
+    assert cache.get('a', 'default') == 'default'
+
+    cache.set('a', {'value': 1})
+    cache.set_many({'b': [2], 'c': None})
+
+    assert cache.get('a') == {'value': 1}
+    assert cache.get_many(['a', 'b', 'c', 'd']) == {'a': {'value': 1}, 'b': [2], 'c': None}
+
+    cache.invalidate('a')
+    assert cache.get_many(['a', 'b']) == {'b': [2]}
+
+    cache.set('short', 1, ttl=0.05)
+    sleep(0.1)
+    assert cache.get('short') is None
+
+def test_stale_writes_are_rejected(new_cache):
+    cache = new_cache()
+    other = cache if not cache.shared else new_cache()
+
+    # a reader takes the version, a writer invalidates the key, the reader stores an old value
+    version = cache.version('a')
+    other.invalidate('a')
+    cache.set('a', 'stale', version=version)
+    assert cache.get('a') is None
+
+    cache.set('a', 'fresh', version=cache.version('a'))
+    assert cache.get('a') == 'fresh'
+
+    versions = cache.versions(['b', 'c'])
+    other.invalidate('c')
+    cache.set_many({'b': 'fresh', 'c': 'stale'}, versions=versions)
+    assert cache.get_many(['b', 'c']) == {'b': 'fresh'}
+
+def test_clear(new_cache):
+    cache = new_cache()
+    neighbour = new_cache('neighbour')
+
+    cache.set_many({'a': 1, 'b': 2})
+    neighbour.set('a', 'kept')
+    versions = cache.versions(['a', 'b'])
+
+    cache.clear()
+
+    assert cache.get_many(['a', 'b']) == {}
+    assert neighbour.get('a') == 'kept'
+
+    # the versions taken before `clear` are stale
+    cache.set_many({'a': 'stale', 'b': 'stale'}, versions=versions)
+    assert cache.get_many(['a', 'b']) == {}
+
+def test_get_or_set_is_single_flight(new_cache):
+    # the threads of one worker and, for the shared backends, the other workers
+    caches = [new_cache(lock_timeout=5)]
+    if caches[0].shared:
+        caches.append(new_cache(lock_timeout=5))
+
+    calls = []
+    calls_lock = Lock()
+
+    def compute():
+        with calls_lock:
+            calls.append(1)
+        sleep(0.2)
+        return 'computed'
+
+    threads_per_cache = 4
+    barrier = Barrier(threads_per_cache * len(caches))
+    results = []
+
+    def run(cache: Cache):
+        barrier.wait()
+        results.append(cache.get_or_set('key', compute))
+
+    threads = [Thread(target=run, args=(cache,)) for cache in caches for _ in range(threads_per_cache)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ['computed'] * len(threads)
+    assert caches[-1].get('key') == 'computed'
+
+def test_get_or_set_keeps_no_stale_value(new_cache):
+    cache = new_cache()
+
+    def compute():
+        # the key is invalidated while the value is computed
+        cache.invalidate('key')
+        return 'stale'
+
+    assert cache.get_or_set('key', compute) == 'stale'
+    assert cache.get('key') is None
+
+def _wait_until(condition, timeout: float = 5) -> bool:
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() > deadline:
+            return False
+        sleep(0.01)
+    return True
+
+@pytest.fixture
+def buses(tmp_path):
+    """Two workers, each with its cache, subscribed to the same bus"""
+    workers = []
+    for _ in range(2):
+        cache = MemoryCache('bus-test')
+        bus = InvalidationBus(FileTransport(str(tmp_path / 'bus.log'), poll_interval=0.01), fallback_ttl=5)
+        bus.register(cache)
+        assert cache.ttl_limit == 5
+        workers.append((cache, bus))
+
+    for _, bus in workers:
+        bus.start()
+    assert _wait_until(lambda: all(cache.ttl_limit is None for cache, _ in workers))
+
+    yield workers
+
+    for _, bus in workers:
+        bus.stop()
+
+def test_bus_invalidation(buses):
+    (first, first_bus), (second, _) = buses
+
+    for cache in (first, second):
+        cache.set_many({'a': 1, 'b': 2, 'c': 3})
+
+    first.invalidate('a')
+    first_bus.publish(first.name, ['a'])
+    assert _wait_until(lambda: second.get('a') is None)
+    assert second.get_many(['b', 'c']) == {'b': 2, 'c': 3}
+
+    first_bus.publish(first.name, all=True)
+    assert _wait_until(lambda: second.get_many(['b', 'c']) == {})
+
+    # the publisher ignores its own messages
+    assert first.get_many(['b', 'c']) == {'b': 2, 'c': 3}
+
+def test_bus_lost_messages(buses):
+    (first, first_bus), (second, _) = buses
+
+    second.set_many({'a': 1, 'other': 2})
+    first_bus.publish(first.name, ['other'])
+    assert _wait_until(lambda: second.get('other') is None)
+    assert second.get('a') == 1
+
+    # a gap in the sequence numbers drops the whole cache
+    next(first_bus._sequence)
+    first_bus.publish(first.name, ['other'])
+    assert _wait_until(lambda: second.get('a') is None)
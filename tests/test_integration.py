@@ -2,10 +2,12 @@ import pytest
 import falcon
 from falcon.testing import TestClient
 
-from uuid import uuid4
+from uuid import UUID, uuid4
+import time
 
 from recipe.app import create_app
-from recipe.security import get_admin_token
+from recipe.security import get_admin_token, authorize_user
+from recipe.database.models import Authority
 
 @pytest.fixture
 def client() -> TestClient:
@@ -413,4 +415,860 @@ def test_rate_recipe(client: TestClient):
     assert resp.status_code == 200
     assert resp.json['errors'] == None
     assert resp.json['value']['user_score'] == 3
-    assert resp.json['value']['rating'] == (3 + 5) / 2
\ No newline at end of file
+    assert resp.json['value']['rating'] == (3 + 5) / 2
+
+def test_query_instrumentation_headers(client: TestClient):
+    resp = client.simulate_get(
+        '/recipe/my',
+        headers={
+            'Authorization': 'Bearer ' + pytest.user_token
+        }
+    )
+
+    assert resp.status_code == 200
+    assert int(resp.headers['X-DB-Queries']) > 0
+    assert resp.headers['Server-Timing'].startswith('db;dur=')
+
+def test_metrics(client: TestClient):
+    resp = client.simulate_get(
+        '/user/my',
+        headers={
+            'Authorization': 'Bearer ' + pytest.user_token
+        }
+    )
+
+    assert resp.status_code == 200
+
+    resp = client.simulate_get('/metrics')
+
+    assert resp.status_code == 200
+    assert 'recipe_http_requests_total{method="GET",route="/user/my",status="200"}' in resp.text
+    assert 'recipe_jwt_duration_seconds_count{operation="decode"}' in resp.text
+
+def test_recipe_cache(client: TestClient):
+    superuser_token = get_admin_token()
+
+    for _ in range(2):
+        resp = client.simulate_get(
+            f'/recipe/{pytest.recipe_id}',
+            headers={
+                'Authorization': 'Bearer ' + pytest.user_token
+            }
+        )
+
+        assert resp.status_code == 200
+        assert resp.json['value']['status'] == 2
+
+    resp = client.simulate_get('/metrics')
+
+    assert 'recipe_cache_requests_total{cache="recipe",result="hit"}' in resp.text
+
+    # a moderator's change is visible right away
+    resp = client.simulate_patch(
+        f'/recipe/{pytest.recipe_id}',
+        json={
+            'status': 0 # Status.DENIED
+        },
+        headers={
+            'Authorization': 'Bearer ' + superuser_token
+        }
+    )
+
+    assert resp.status_code == 200
+
+    resp = client.simulate_get(
+        f'/recipe/{pytest.recipe_id}',
+        headers={
+            'Authorization': 'Bearer ' + pytest.user_token
+        }
+    )
+
+    assert resp.status_code == 200
+    assert resp.json['value']['status'] == 0
+    assert resp.json['value']['user_score'] == 3
+
+    # approve it back for the other tests
+    resp = client.simulate_patch(
+        f'/recipe/{pytest.recipe_id}',
+        json={
+            'status': 2
+        },
+        headers={
+            'Authorization': 'Bearer ' + superuser_token
+        }
+    )
+
+    assert resp.status_code == 200
+
+def test_cache_invalidation_bus(monkeypatch, tmp_path):
+    # two workers with their own in-process caches
+    monkeypatch.setenv('RECIPE_CACHE_BUS', f'file://{tmp_path}/bus.log')
+    first = TestClient(create_app('sqlite:///db/test.db'))
+    second = TestClient(create_app('sqlite:///db/test.db'))
+
+    superuser_token = get_admin_token()
+    headers = {
+        'Authorization': 'Bearer ' + pytest.user_token
+    }
+
+    resp = second.simulate_get(f'/recipe/{pytest.recipe_id}', headers=headers)
+
+    assert resp.status_code == 200
+    assert resp.json['value']['status'] == 2
+
+    resp = first.simulate_patch(
+        f'/recipe/{pytest.recipe_id}',
+        json={
+            'status': 1 # Status.PENDING
+        },
+        headers={
+            'Authorization': 'Bearer ' + superuser_token
+        }
+    )
+
+    assert resp.status_code == 200
+
+    # the second worker drops its copy once the message arrives
+    deadline = time.monotonic() + 5
+    while True:
+        resp = second.simulate_get(f'/recipe/{pytest.recipe_id}', headers=headers)
+        if resp.json['value']['status'] == 1 or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+
+    assert resp.json['value']['status'] == 1
+
+    resp = first.simulate_patch(
+        f'/recipe/{pytest.recipe_id}',
+        json={
+            'status': 2
+        },
+        headers={
+            'Authorization': 'Bearer ' + superuser_token
+        }
+    )
+
+    assert resp.status_code == 200
+
+def test_moderation_claim(client: TestClient):
+    # every admin token belongs to a different virtual user
+    first_moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    second_moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+
+    resp = client.simulate_post('/moderation/claim', params={'n': 5}, headers=first_moderator)
+
+    assert resp.status_code == 200
+    assert resp.json['errors'] == None
+
+    claimed = [recipe['id'] for recipe in resp.json['value']['data']]
+    assert len(claimed) == 1 # the other recipe has been approved
+    assert all(recipe['status'] == 1 for recipe in resp.json['value']['data'])
+
+    # the recipe is leased to the first moderator
+    resp = client.simulate_post('/moderation/claim', params={'n': 5}, headers=second_moderator)
+
+    assert resp.status_code == 200
+    assert resp.json['value']['data'] == []
+
+    # claiming again renews the lease
+    resp = client.simulate_post('/moderation/claim', params={'n': 5}, headers=first_moderator)
+
+    assert [recipe['id'] for recipe in resp.json['value']['data']] == claimed
+
+    # a status change releases the lease
+    resp = client.simulate_patch(f'/recipe/{claimed[0]}', json={'status': 1}, headers=first_moderator)
+
+    assert resp.status_code == 200
+
+    resp = client.simulate_post('/moderation/claim', params={'n': 5}, headers=second_moderator)
+
+    assert [recipe['id'] for recipe in resp.json['value']['data']] == claimed
+
+    # users can't claim anything
+    resp = client.simulate_post('/moderation/claim', headers={'Authorization': 'Bearer ' + pytest.user_token})
+
+    assert resp.status_code == 403
+
+def test_bulk_status_change(client: TestClient):
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+    missing_id = str(uuid4())
+
+    # cache the recipe
+    resp = client.simulate_get(f'/recipe/{pytest.recipe_id}', headers=user)
+
+    assert resp.json['value']['status'] == 2
+
+    resp = client.simulate_patch(
+        '/recipe/status',
+        json={
+            'items': [
+                {'id': pytest.recipe_id, 'status': 0},
+                {'id': missing_id, 'status': 2}
+            ]
+        },
+        headers=moderator
+    )
+
+    assert resp.status_code == 200
+    assert resp.json['errors'] == None
+    assert resp.json['value'] == [
+        {'id': pytest.recipe_id, 'status': 0, 'updated': True},
+        {'id': missing_id, 'status': 2, 'updated': False}
+    ]
+
+    resp = client.simulate_get(f'/recipe/{pytest.recipe_id}', headers=user)
+
+    assert resp.json['value']['status'] == 0
+
+    resp = client.simulate_patch(
+        '/recipe/status',
+        json={
+            'items': [{'id': pytest.recipe_id, 'status': 2}]
+        },
+        headers=user
+    )
+
+    assert resp.status_code == 403
+
+    resp = client.simulate_patch(
+        '/recipe/status',
+        json={
+            'items': [{'id': pytest.recipe_id, 'status': 2}]
+        },
+        headers=moderator
+    )
+
+    assert resp.json['value'][0]['updated'] == True
+
+def test_bulk_approve_unrendered(client: TestClient):
+    from sqlalchemy import create_engine, select, update, delete
+    from recipe.database.models import Recipe, RenderedSource, RecipeSignature
+    from recipe.render import source_hash
+
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    sources = [f'# Old recipe {i}\n\nFrom before the rendering.' for i in range(2)]
+
+    recipe_ids = []
+    for source in sources:
+        resp = client.simulate_post('/recipe', json={'source': source}, headers=moderator)
+        recipe_ids.append(UUID(resp.headers['location'].split('/')[-1]))
+
+    # recipes from before the rendering and the near-duplicate index
+    engine = create_engine('sqlite:///db/test.db')
+    with engine.connect() as conn:
+        conn.execute(update(Recipe).where(Recipe.id.in_(recipe_ids)).values(source_hash=None))
+        conn.execute(delete(RenderedSource).where(RenderedSource.source_hash.in_([source_hash(source) for source in sources])))
+        conn.execute(delete(RecipeSignature).where(RecipeSignature.recipe_id.in_(recipe_ids)))
+        conn.commit()
+
+    resp = client.simulate_patch(
+        '/recipe/status',
+        json={'items': [{'id': str(recipe_id), 'status': 2} for recipe_id in recipe_ids]},
+        headers=moderator
+    )
+
+    assert resp.status_code == 200
+
+    with engine.connect() as conn:
+        hashes = dict(conn.execute(select(Recipe.id, Recipe.source_hash).where(Recipe.id.in_(recipe_ids))).all())
+        assert hashes == {recipe_id: source_hash(source) for recipe_id, source in zip(recipe_ids, sources)}
+
+        rendered = conn.execute(select(RenderedSource.source_hash).where(RenderedSource.source_hash.in_(hashes.values()))).scalars().all()
+        assert sorted(rendered) == sorted(hashes.values())
+
+        indexed = conn.execute(select(RecipeSignature.recipe_id).where(RecipeSignature.recipe_id.in_(recipe_ids))).scalars().all()
+        assert sorted(indexed) == sorted(recipe_ids)
+
+def test_bookmark_batch(client: TestClient):
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+    missing_id = str(uuid4())
+
+    # cache the user's bookmark set
+    resp = client.simulate_get(f'/recipe/{pytest.recipe_id}', headers=user)
+
+    assert resp.json['value']['bookmarked'] == False
+
+    resp = client.simulate_post(
+        '/bookmark/batch',
+        json={'ids': [pytest.recipe_id, missing_id, pytest.recipe_id]},
+        headers=user
+    )
+
+    assert resp.status_code == 200
+    assert resp.json['errors'] == None
+    assert resp.json['value'] == [
+        {'id': pytest.recipe_id, 'result': 'added'},
+        {'id': missing_id, 'result': 'not_found'}
+    ]
+
+    resp = client.simulate_get(f'/recipe/{pytest.recipe_id}', headers=user)
+
+    assert resp.json['value']['bookmarked'] == True
+
+    resp = client.simulate_get('/recipe', headers=user)
+
+    assert [r['bookmarked'] for r in resp.json['value']['data'] if r['id'] == pytest.recipe_id] == [True]
+
+    resp = client.simulate_post('/bookmark/batch', json={'ids': [pytest.recipe_id]}, headers=user)
+
+    assert resp.json['value'] == [{'id': pytest.recipe_id, 'result': 'exists'}]
+
+    resp = client.simulate_delete(
+        '/bookmark/batch',
+        json={'ids': [pytest.recipe_id, missing_id]},
+        headers=user
+    )
+
+    assert resp.status_code == 200
+    assert resp.json['value'] == [
+        {'id': pytest.recipe_id, 'result': 'removed'},
+        {'id': missing_id, 'result': 'not_found'}
+    ]
+
+    resp = client.simulate_get(f'/recipe/{pytest.recipe_id}', headers=user)
+
+    assert resp.json['value']['bookmarked'] == False
+
+def test_bookmark_feed(client: TestClient):
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+
+    recipe_ids = []
+    for i in range(3):
+        resp = client.simulate_post('/recipe', json={'source': f'# Feed recipe {i}'}, headers=moderator)
+        recipe_ids.append(resp.headers['location'].split('/')[-1])
+
+    client.simulate_patch(
+        '/recipe/status',
+        json={'items': [{'id': recipe_id, 'status': 2} for recipe_id in recipe_ids]},
+        headers=moderator
+    )
+
+    # bookmarked one at a time, so the feed order is known
+    for recipe_id in recipe_ids:
+        resp = client.simulate_post(f'/recipe/{recipe_id}/bookmark', headers=user)
+        assert resp.status_code == 201
+
+    resp = client.simulate_get('/bookmark', params={'elements': 2}, headers=user)
+
+    assert resp.status_code == 200
+    assert resp.json['value']['totalPages'] == 2
+    assert [r['id'] for r in resp.json['value']['data']] == recipe_ids[:0:-1]
+    assert resp.json['value']['next'] != None
+
+    resp = client.simulate_get(
+        '/bookmark',
+        params={'elements': 2, 'after': resp.json['value']['next']},
+        headers=user
+    )
+
+    assert [r['id'] for r in resp.json['value']['data']] == recipe_ids[:1]
+    assert resp.json['value']['next'] == None
+
+    client.simulate_patch(f'/recipe/{recipe_ids[1]}', json={'status': 0}, headers=moderator)
+
+    resp = client.simulate_get('/bookmark', params={'hide_denied': 'true'}, headers=user)
+
+    assert [r['id'] for r in resp.json['value']['data']] == [recipe_ids[2], recipe_ids[0]]
+    assert resp.json['value']['totalPages'] == 1
+
+    resp = client.simulate_get('/bookmark', params={'after': 'not-a-cursor'}, headers=user)
+
+    assert resp.status_code == 400
+
+def test_popularity_counters(client: TestClient):
+    from sqlalchemy import create_engine, select, update
+    from recipe.counters import repair_counters
+    from recipe.database.models import Recipe
+
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+
+    resp = client.simulate_post('/recipe', json={'source': '# Popular recipe'}, headers=moderator)
+    recipe_id = resp.headers['location'].split('/')[-1]
+    client.simulate_patch(f'/recipe/{recipe_id}', json={'status': 2}, headers=moderator)
+
+    client.simulate_post('/bookmark/batch', json={'ids': [recipe_id]}, headers=user)
+    client.simulate_post(f'/recipe/{recipe_id}/bookmark', headers=moderator)
+    client.simulate_post(f'/recipe/{recipe_id}/rating', json={'score': 5}, headers=user)
+    client.simulate_post(f'/recipe/{recipe_id}/rating', json={'score': 4}, headers=user)
+
+    resp = client.simulate_get('/recipe', params={'sort': 'bookmarks'}, headers=user)
+
+    assert resp.status_code == 200
+    assert resp.json['value']['data'][0]['id'] == recipe_id
+
+    resp = client.simulate_get('/recipe', params={'sort': 'popular'}, headers=user)
+
+    assert resp.status_code == 422
+
+    engine = create_engine('sqlite:///db/test.db')
+    counts = select(Recipe.bookmark_count, Recipe.rating_count).where(Recipe.id == UUID(recipe_id))
+
+    with engine.begin() as conn:
+        assert conn.execute(counts).one() == (2, 1)
+        conn.execute(update(Recipe).where(Recipe.id == UUID(recipe_id)).values(bookmark_count=7))
+
+    assert repair_counters(engine, batch_size=2) == 1
+
+    with engine.begin() as conn:
+        assert conn.execute(counts).one() == (2, 1)
+
+def test_trending(client: TestClient):
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+
+    recipe_ids = []
+    for i in range(2):
+        resp = client.simulate_post('/recipe', json={'source': f'# Trending recipe {i}'}, headers=moderator)
+        recipe_ids.append(resp.headers['location'].split('/')[-1])
+        client.simulate_patch(f'/recipe/{recipe_ids[-1]}', json={'status': 2}, headers=moderator)
+
+    quiet, popular = recipe_ids
+
+    client.simulate_post(f'/recipe/{quiet}/rating', json={'score': 1}, headers=user)
+    client.simulate_post('/bookmark/batch', json={'ids': [popular]}, headers=user)
+    client.simulate_post(f'/recipe/{popular}/bookmark', headers=moderator)
+
+    resp = client.simulate_get('/recipe/trending', params={'elements': 50}, headers=user)
+
+    assert resp.status_code == 200
+    assert resp.json['errors'] == None
+
+    ids = [r['id'] for r in resp.json['value']['data']]
+
+    assert ids.index(popular) < ids.index(quiet)
+    assert [r['bookmarked'] for r in resp.json['value']['data'] if r['id'] == popular] == [True]
+
+def test_trending_rerate(client: TestClient):
+    from sqlalchemy import create_engine, select
+    from recipe.database.models import RecipeActivity
+
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+
+    resp = client.simulate_post('/recipe', json={'source': '# Re-rated recipe'}, headers=moderator)
+    recipe_id = resp.headers['location'].split('/')[-1]
+
+    # the same score again and a lower one add nothing, a higher one adds the difference
+    for score in (3, 3, 5, 1):
+        resp = client.simulate_post(f'/recipe/{recipe_id}/rating', json={'score': score}, headers=user)
+        assert resp.status_code == 201
+
+    with create_engine('sqlite:///db/test.db').connect() as conn:
+        weights = conn.scalars(select(RecipeActivity.weight)
+                               .where(RecipeActivity.recipe_id == UUID(recipe_id))
+                               .order_by(RecipeActivity.id)).all()
+
+    assert weights == pytest.approx([0.6, 0.4])
+
+def test_concurrent_first_rating(client: TestClient, monkeypatch):
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import Session
+    from recipe.database.models import RatedRecipe, Recipe
+    from recipe.validation import RatedRecipeCreate
+    from recipe.counters import bump_counter
+    import recipe.resources.rating
+
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+
+    resp = client.simulate_post('/recipe', json={'source': '# Concurrently rated recipe'}, headers=moderator)
+    recipe_id = UUID(resp.headers['location'].split('/')[-1])
+    user_id = UUID(pytest.user_id)
+
+    engine = create_engine('sqlite:///db/test.db')
+    raced = []
+
+    def bump_counter_after_another_request(db, column, recipe_ids, delta):
+        # another request of the same user adds the rating after this one has found none
+        if not raced:
+            raced.append(True)
+            with Session(engine) as other:
+                other.add(RatedRecipe(RatedRecipeCreate(user_id=user_id, recipe_id=recipe_id, score=1)))
+                bump_counter(other, 'rating_count', [recipe_id], 1)
+                other.commit()
+        bump_counter(db, column, recipe_ids, delta)
+
+    monkeypatch.setattr(recipe.resources.rating, 'bump_counter', bump_counter_after_another_request)
+
+    resp = client.simulate_post(f'/recipe/{recipe_id}/rating', json={'score': 5}, headers=user)
+
+    assert resp.status_code == 201
+    assert raced == [True]
+
+    with Session(engine) as db:
+        assert db.scalars(select(RatedRecipe.score).where(RatedRecipe.recipe_id == recipe_id)).all() == [5]
+        assert db.scalar(select(Recipe.rating_count).where(Recipe.id == recipe_id)) == 1
+
+def test_similar_recipes(client: TestClient):
+    from sqlalchemy import create_engine
+    from recipe.similar import compute_similar
+
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+
+    recipe_ids = []
+    for i in range(3):
+        resp = client.simulate_post('/recipe', json={'source': f'# Similar recipe {i}'}, headers=moderator)
+        recipe_ids.append(resp.headers['location'].split('/')[-1])
+        client.simulate_patch(f'/recipe/{recipe_ids[-1]}', json={'status': 2}, headers=moderator)
+
+    # both users bookmark the first two recipes, only one of them the third
+    client.simulate_post('/bookmark/batch', json={'ids': recipe_ids}, headers=user)
+    client.simulate_post('/bookmark/batch', json={'ids': recipe_ids[:2]}, headers=moderator)
+
+    compute_similar(create_engine('sqlite:///db/test.db'), k=5)
+
+    resp = client.simulate_get(f'/recipe/{recipe_ids[0]}/similar', headers=user)
+
+    assert resp.status_code == 200
+    assert resp.json['errors'] == None
+
+    ids = [r['id'] for r in resp.json['value']]
+
+    assert recipe_ids[0] not in ids
+    assert ids.index(recipe_ids[1]) < ids.index(recipe_ids[2])
+    assert resp.json['value'][0]['bookmarked'] == True
+
+def test_for_you(client: TestClient):
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+
+    # a fresh user, with no bookmarks or ratings
+    user = {'Authorization': 'Bearer ' + authorize_user(uuid4(), Authority.USER)}
+
+    # the tags are new, so only these recipes have them
+    soup, spicy, other = (f'{name}_{uuid4().hex[:8]}' for name in ('soup', 'spicy', 'other'))
+
+    recipe_ids = []
+    for i, tags in enumerate([[soup, spicy], [soup, spicy], [soup], [other]]):
+        resp = client.simulate_post('/recipe', json={'source': f'# For you recipe {i}', 'tags': tags}, headers=moderator)
+        recipe_ids.append(resp.headers['location'].split('/')[-1])
+        client.simulate_patch(f'/recipe/{recipe_ids[-1]}', json={'status': 2}, headers=moderator)
+
+    liked, both_tags, one_tag, unrelated = recipe_ids
+
+    # nothing is known about the user yet
+    resp = client.simulate_get('/recipe/for-you', headers=user)
+    assert resp.status_code == 200
+    assert resp.json['value']['totalPages'] > 0
+
+    # the cached affinity is dropped by the bookmark
+    client.simulate_post(f'/recipe/{liked}/bookmark', headers=user)
+
+    resp = client.simulate_get('/recipe/for-you', params={'elements': 50}, headers=user)
+
+    assert resp.status_code == 200
+    assert resp.json['errors'] == None
+
+    ids = [r['id'] for r in resp.json['value']['data']]
+
+    assert ids[:2] == [both_tags, one_tag]
+    assert liked not in ids
+    assert unrelated not in ids
+
+    # a high rating adds the tags of the recipe
+    client.simulate_post(f'/recipe/{unrelated}/rating', json={'score': 5}, headers=user)
+    client.simulate_delete(f'/recipe/{liked}/bookmark', headers=user)
+
+    resp = client.simulate_get('/recipe/for-you', params={'elements': 50}, headers=user)
+    ids = [r['id'] for r in resp.json['value']['data']]
+
+    assert ids == [unrelated]
+
+def test_job_runner():
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import sessionmaker
+    from recipe.database.models import JobOutbox
+    from recipe.jobs import JobRunner
+
+    db_session = sessionmaker(create_engine('sqlite:///db/test.db'))
+    runner = JobRunner(db_session, workers=2, outbox=True, sweep_interval=0.05)
+
+    calls = []
+
+    def flaky(payload):
+        calls.append(payload['n'])
+        if len(calls) == 1:
+            raise RuntimeError('the first attempt fails')
+
+    def broken(payload):
+        raise RuntimeError('always fails')
+
+    runner.register('flaky', flaky, retries=2, backoff=0.01)
+    runner.register('broken', broken, retries=1, backoff=0.01)
+
+    # a rolled back job is never run
+    with db_session() as db:
+        runner.enqueue_after_commit(db, 'flaky', {'n': 0})
+        db.rollback()
+
+    with db_session() as db:
+        runner.enqueue_after_commit(db, 'flaky', {'n': 1})
+        runner.enqueue_after_commit(db, 'broken', {})
+        db.commit()
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with db_session() as db:
+            jobs = db.scalars(select(JobOutbox)).all()
+        if len(calls) == 2 and [job.name for job in jobs] == ['broken'] and jobs[0].date_failed is not None:
+            break
+        time.sleep(0.02)
+
+    runner.stop()
+
+    # retried once, then deleted from the outbox
+    assert calls == [1, 1]
+
+    # out of retries, kept for inspection
+    assert [(job.name, job.attempts) for job in jobs] == [('broken', 2)]
+    assert 'always fails' in jobs[0].last_error
+
+def test_html_format(client: TestClient):
+    from sqlalchemy import create_engine, select, update
+    from recipe.database.models import Recipe, RenderedSource
+    from recipe.render import backfill_rendered, source_hash
+
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    source = '# Pancakes\n\n<script>alert(1)</script>\n\n[more](javascript:alert(1)) and [less](https://example.com)'
+
+    resp = client.simulate_post('/recipe', json={'source': source}, headers=moderator)
+    recipe_id = resp.headers['location'].split('/')[-1]
+
+    resp = client.simulate_get(f'/recipe/{recipe_id}', params={'format': 'html'}, headers=moderator)
+
+    assert resp.status_code == 200
+    html = resp.json['value']['html']
+
+    assert '<h1>Pancakes</h1>' in html
+    assert '<script>' not in html
+    assert 'href="javascript' not in html
+    assert 'href="https://example.com"' in html
+
+    # only on request
+    resp = client.simulate_get(f'/recipe/{recipe_id}', headers=moderator)
+    assert 'html' not in resp.json['value']
+
+    # rendered once, by the hash of the source
+    engine = create_engine('sqlite:///db/test.db')
+    with engine.connect() as conn:
+        assert conn.execute(select(RenderedSource.html).where(RenderedSource.source_hash == source_hash(source))).scalar() == html
+
+        # a recipe from before the rendering
+        conn.execute(update(Recipe).where(Recipe.id == UUID(recipe_id)).values(source_hash=None))
+        conn.commit()
+
+    resp = client.simulate_get('/recipe/my', params={'format': 'html', 'elements': 50}, headers=moderator)
+    assert [r['html'] for r in resp.json['value']['data'] if r['id'] == recipe_id] == [html]
+
+    counts = backfill_rendered(engine, batch_size=2)
+
+    assert counts['rehashed'] >= 1
+    with engine.connect() as conn:
+        assert conn.execute(select(Recipe.source_hash).where(Recipe.id == UUID(recipe_id))).scalar() == source_hash(source)
+
+def test_edit_source(client: TestClient):
+    from difflib import unified_diff
+    from recipe.versions import SNAPSHOT_INTERVAL
+
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+
+    sources = ['# Soup\n\n## Steps\n' + ''.join(f'{i}. Stir.\n' for i in range(1, 30))]
+
+    resp = client.simulate_post('/recipe', json={'source': sources[0]}, headers=moderator)
+    recipe_id = resp.headers['location'].split('/')[-1]
+    client.simulate_patch(f'/recipe/{recipe_id}', json={'status': 2}, headers=moderator)
+
+    # the whole source
+    sources.append(sources[0].replace('# Soup', '# Tomato soup'))
+    resp = client.simulate_patch(f'/recipe/{recipe_id}/source', json={'base_version': 1, 'source': sources[1]}, headers=moderator)
+
+    assert resp.status_code == 200
+    assert resp.json['value']['version'] == 2
+    assert resp.json['value']['source'] == sources[1]
+    assert resp.json['value']['status'] == 1 # moderated again
+
+    # a diff, past a few snapshots
+    for version in range(2, 2 * SNAPSHOT_INTERVAL + 3):
+        sources.append(sources[-1].replace(f'\n{version}. Stir.', f'\n{version}. Stir gently.'))
+        diff = ''.join(unified_diff(sources[-2].splitlines(keepends=True), sources[-1].splitlines(keepends=True), 'a', 'b'))
+
+        resp = client.simulate_patch(f'/recipe/{recipe_id}/source', json={'base_version': version, 'diff': diff}, headers=moderator)
+
+        assert resp.status_code == 200
+        assert resp.json['value']['source'] == sources[-1]
+
+    # every version can be rebuilt
+    for version, source in enumerate(sources, 1):
+        resp = client.simulate_get(f'/recipe/{recipe_id}/source', params={'version': version}, headers=user)
+        assert resp.json['value'] == {'version': version, 'source': source}
+
+    resp = client.simulate_get(f'/recipe/{recipe_id}/source', params={'version': len(sources) + 1}, headers=user)
+    assert resp.status_code == 404
+
+    # a stale version, a diff that doesn't apply, someone else's recipe
+    resp = client.simulate_patch(f'/recipe/{recipe_id}/source', json={'base_version': 1, 'source': 'x'}, headers=moderator)
+    assert resp.status_code == 409
+
+    resp = client.simulate_patch(f'/recipe/{recipe_id}/source', json={'base_version': len(sources), 'diff': diff}, headers=moderator)
+    assert resp.status_code == 400
+
+    resp = client.simulate_patch(f'/recipe/{recipe_id}/source', json={'base_version': len(sources), 'source': 'x'}, headers=user)
+    assert resp.status_code == 403
+
+def test_attachments(client: TestClient):
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+
+    resp = client.simulate_post('/recipe', json={'source': '# Pancakes'}, headers=moderator)
+    recipe_id = resp.headers['location'].split('/')[-1]
+
+    photo = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 40
+
+    resp = client.simulate_post(f'/recipe/{recipe_id}/attachment', body=photo, headers=moderator)
+    assert resp.status_code == 201
+    assert resp.json['value']['content_type'] == 'image/png'
+    assert resp.json['value']['size'] == len(photo)
+    url = resp.headers['location']
+
+    # the same photo again is stored and listed once
+    resp = client.simulate_post(f'/recipe/{recipe_id}/attachment', body=photo, headers=moderator)
+    assert resp.headers['location'] == url
+
+    resp = client.simulate_get(f'/recipe/{recipe_id}/attachment', headers=user)
+    assert [attachment['url'] for attachment in resp.json['value']] == [url]
+
+    # not a photo, someone else's recipe
+    resp = client.simulate_post(f'/recipe/{recipe_id}/attachment', body=b'<script>', headers=moderator)
+    assert resp.status_code == 415
+
+    resp = client.simulate_post(f'/recipe/{recipe_id}/attachment', body=photo, headers=user)
+    assert resp.status_code == 403
+
+    # served without authorization, in parts, and not again
+    resp = client.simulate_get(url)
+    assert resp.status_code == 200
+    assert resp.content == photo
+    assert resp.headers['content-type'] == 'image/png'
+    etag = resp.headers['etag']
+
+    resp = client.simulate_get(url, headers={'Range': 'bytes=8-15'})
+    assert resp.status_code == 206
+    assert resp.content == photo[8:16]
+    assert resp.headers['content-range'] == f'bytes 8-15/{len(photo)}'
+
+    resp = client.simulate_get(url, headers={'Range': 'bytes=-10'})
+    assert resp.content == photo[-10:]
+
+    resp = client.simulate_get(url, headers={'Range': f'bytes={len(photo)}-'})
+    assert resp.status_code == 416
+
+    resp = client.simulate_get(url, headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+
+    resp = client.simulate_get('/attachment/' + '0' * 64)
+    assert resp.status_code == 404
+
+def test_near_duplicates(client: TestClient):
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+
+    original = '# Borscht\n\n## Steps\n' + ''.join(f'{i}. Add the beets, {i * 10} g of cabbage and stir for {i} minutes.\n' for i in range(1, 25))
+    repost = original.replace('# Borscht', '# My borscht').replace('stir for 7 minutes', 'stir for 8 minutes')
+
+    resp = client.simulate_post('/recipe', json={'source': original}, headers=moderator)
+    original_id = resp.headers['location'].split('/')[-1]
+    client.simulate_patch(f'/recipe/{original_id}', json={'status': 2}, headers=moderator)
+
+    resp = client.simulate_post('/recipe', json={'source': repost}, headers=user)
+    repost_id = resp.headers['location'].split('/')[-1]
+
+    resp = client.simulate_post('/recipe', json={'source': '# Tea\n\nBoil the water, add the leaves.'}, headers=user)
+    other_id = resp.headers['location'].split('/')[-1]
+
+    resp = client.simulate_get('/recipe/pending', params={'elements': 2}, headers=moderator)
+    assert resp.status_code == 200
+    pending = {recipe['id']: recipe for recipe in resp.json['value']['data']}
+
+    assert pending[other_id]['near_duplicates'] == []
+
+    [duplicate] = pending[repost_id]['near_duplicates']
+    assert duplicate['id'] == original_id
+    assert duplicate['status'] == 2
+    assert duplicate['similarity'] >= 0.8
+
+def test_near_duplicates_without_words(client: TestClient):
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import Session
+    from recipe.database.models import RecipeSignature, RecipeLshBucket
+    from recipe.duplicates import index_recipe, near_duplicates
+    from recipe.render import source_hash
+
+    moderator = {'Authorization': 'Bearer ' + get_admin_token()}
+
+    recipe_ids = []
+    for source in ('# 🍰🍰🍰', '---\n\n* * *\n'):
+        resp = client.simulate_post('/recipe', json={'source': source}, headers=moderator)
+        recipe_ids.append(UUID(resp.headers['location'].split('/')[-1]))
+
+    with Session(create_engine('sqlite:///db/test.db')) as db:
+        assert near_duplicates(db, recipe_ids) == {recipe_id: [] for recipe_id in recipe_ids}
+
+        # an edit that drops all the words also drops the old index
+        index_recipe(db, recipe_ids[0], '# Cake with words', source_hash('# Cake with words'))
+        index_recipe(db, recipe_ids[0], '# 🍰', source_hash('# 🍰'))
+        db.commit()
+
+        for model in (RecipeSignature, RecipeLshBucket):
+            assert db.scalars(select(model).where(model.recipe_id.in_(recipe_ids))).all() == []
+
+def test_batch_get(client: TestClient):
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+
+    resp = client.simulate_get('/recipe/my', params={'elements': 3}, headers=user)
+    recipe_ids = [recipe['id'] for recipe in resp.json['value']['data']]
+    missing_id = str(uuid4())
+
+    # in the order of `ids`, once each, in a single query of the recipes
+    ids = [recipe_ids[2], missing_id, recipe_ids[0], recipe_ids[2], recipe_ids[1]]
+    resp = client.simulate_get('/recipe/batch', params={'ids': ','.join(ids), 'format': 'html'}, headers=user)
+
+    assert resp.status_code == 200
+    assert [recipe['id'] for recipe in resp.json['value']['data']] == [recipe_ids[2], recipe_ids[0], recipe_ids[1]]
+    assert all('html' in recipe for recipe in resp.json['value']['data'])
+    assert resp.json['value']['missing'] == [missing_id]
+    assert int(resp.headers['X-DB-Queries']) <= 6
+
+    resp = client.simulate_get('/user/batch', params={'ids': [missing_id, pytest.user_id]}, headers=user)
+
+    assert resp.status_code == 200
+    assert [u['id'] for u in resp.json['value']['data']] == [pytest.user_id]
+    assert resp.json['value']['missing'] == [missing_id]
+
+    resp = client.simulate_get('/recipe/batch', params={'ids': ','.join(str(uuid4()) for _ in range(101))}, headers=user)
+    assert resp.status_code == 422
+
+def test_include_author(client: TestClient):
+    user = {'Authorization': 'Bearer ' + pytest.user_token}
+
+    plain = client.simulate_get('/recipe', params={'elements': 10}, headers=user)
+    resp = client.simulate_get('/recipe', params={'elements': 10, 'include': 'author'}, headers=user)
+
+    assert resp.status_code == 200
+    assert 'authors' not in plain.json
+    # the virtual admin, who wrote some of them, is not a user
+    authors = resp.json['authors']
+    assert set(authors) <= {recipe['author_id'] for recipe in resp.json['value']['data']}
+    assert all(authors[author_id]['id'] == author_id for author_id in authors)
+    # at most one more query for the whole page
+    assert int(resp.headers['X-DB-Queries']) <= int(plain.headers['X-DB-Queries']) + 1
+
+    resp = client.simulate_get('/recipe/my', params={'include': 'author'}, headers=user)
+    assert list(resp.json['authors']) == [pytest.user_id]
+
+    recipe = resp.json['value']['data'][0]
+    resp = client.simulate_get(f'/recipe/{recipe["id"]}', params={'include': 'author'}, headers=user)
+    assert list(resp.json['authors']) == [pytest.user_id]
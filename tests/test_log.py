@@ -0,0 +1,89 @@
+import pytest
+import falcon
+from falcon.testing import TestClient
+
+from recipe.app import create_app
+from recipe.log import configure_logging, flush_logging, AccessLogMiddleware, REQUEST_ID_HEADER, logging
+
+from io import StringIO
+from uuid import uuid4
+import json
+
+@pytest.fixture
+def log_stream():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+
+    stream = StringIO()
+    configure_logging(level='INFO', fmt='json', stream=stream)
+
+    yield stream
+
+    flush_logging()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+def _records(stream: StringIO) -> list[dict]:
+    # the records are written by the listener thread, stopping it drains the queue
+    flush_logging()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+class _Resource:
+    def on_get(self, req, resp, name):
+        logging.getLogger('recipe.test').info('handling %s', name)
+        if name == 'broken':
+            try:
+                raise ValueError('broken')
+            except ValueError as e:
+                logging.exception(e)
+            resp.status = falcon.HTTP_500
+        resp.media = {'value': name, 'errors': None}
+
+def test_access_log_line_per_request(log_stream: StringIO):
+    client = TestClient(create_app('sqlite:///db/test.db'))
+
+    resp = client.simulate_get('/metrics', headers={REQUEST_ID_HEADER: 'given-id'})
+    assert resp.headers[REQUEST_ID_HEADER] == 'given-id'
+    resp = client.simulate_get(f'/recipe/{uuid4()}')
+    assert resp.status_code == 401
+    generated_id = resp.headers[REQUEST_ID_HEADER]
+
+    access = [record for record in _records(log_stream) if record['logger'] == 'recipe.access']
+    assert len(access) == 2
+
+    assert access[0]['request_id'] == 'given-id'
+    assert access[0]['route'] == '/metrics'
+    assert access[0]['method'] == 'GET'
+    assert access[0]['status'] == 200
+    assert access[0]['duration_ms'] >= 0
+
+    assert access[1]['request_id'] == generated_id
+    assert access[1]['route'] == '/recipe/{_id:uuid}'
+    assert access[1]['status'] == 401
+
+def test_records_carry_request_context(log_stream: StringIO):
+    app = falcon.App(middleware=[AccessLogMiddleware(sample_rate=0)])
+    app.add_route('/item/{name}', _Resource())
+    client = TestClient(app)
+
+    client.simulate_get('/item/fine', headers={REQUEST_ID_HEADER: 'fine-id'})
+    client.simulate_get('/item/broken', headers={REQUEST_ID_HEADER: 'broken-id'})
+    logging.getLogger('recipe.test').info('outside of requests')
+
+    records = _records(log_stream)
+    assert [(record['logger'], record['request_id'], record['route']) for record in records] == [
+        ('recipe.test', 'fine-id', '/item/{name}'),
+        ('recipe.test', 'broken-id', '/item/{name}'),
+        ('root', 'broken-id', '/item/{name}'),
+        # not sampled, but a server error
+        ('recipe.access', 'broken-id', '/item/{name}'),
+        ('recipe.test', None, None)
+    ]
+
+    assert records[0]['message'] == 'handling fine'
+    assert records[2]['level'] == 'ERROR'
+    assert 'ValueError: broken' in records[2]['exception']
+    assert records[3]['status'] == 500
@@ -0,0 +1,70 @@
+import falcon
+from falcon.testing import TestClient
+
+from recipe.profiling import ProfilingMiddleware, PROFILE_HEADER
+from recipe.security import get_admin_token, authorize_user
+from recipe.database.models import Authority
+
+from uuid import uuid4
+import os
+import pstats
+
+class _Resource:
+    def on_get(self, req, resp, _id):
+        resp.media = {'value': sum(range(1000)), 'errors': None}
+
+def _client(profiler: ProfilingMiddleware) -> TestClient:
+    app = falcon.App(middleware=[profiler])
+    app.add_route('/item/{_id}', _Resource())
+    return TestClient(app)
+
+def _files(directory) -> list[str]:
+    return sorted(os.listdir(directory))
+
+def test_profiles_are_written_on_flush_and_rotation(tmp_path):
+    profiler = ProfilingMiddleware(str(tmp_path), sample_every=1, rotate_after=3, keep=2, flush_interval=3600)
+    client = _client(profiler)
+    current = f'item_{{_id}}.{os.getpid()}.pstats'
+
+    for i in range(2):
+        assert client.simulate_get(f'/item/{i}').status_code == 200
+
+    # nothing is written on the request path
+    assert _files(tmp_path) == []
+
+    profiler.flush()
+    assert _files(tmp_path) == [current]
+    assert any(name == 'on_get' for _, _, name in pstats.Stats(str(tmp_path / current)).stats)
+
+    # the third sample rotates the aggregate, which replaces the current file
+    client.simulate_get('/item/2')
+    files = _files(tmp_path)
+    assert len(files) == 1 and files[0] != current
+
+    # only `keep` rotated files are kept
+    for i in range(9):
+        client.simulate_get(f'/item/{i}')
+    assert len(_files(tmp_path)) == 2
+
+    profiler.flush()
+
+def test_profiles_are_flushed_on_interval(tmp_path):
+    profiler = ProfilingMiddleware(str(tmp_path), sample_every=1, flush_interval=0)
+    client = _client(profiler)
+
+    client.simulate_get('/item/1')
+    assert len(_files(tmp_path)) == 1
+
+def test_profile_header(tmp_path):
+    profiler = ProfilingMiddleware(str(tmp_path), sample_every=0)
+    client = _client(profiler)
+
+    client.simulate_get('/item/1')
+    client.simulate_get('/item/1', headers={PROFILE_HEADER: authorize_user(uuid4(), Authority.USER)})
+    client.simulate_get('/item/1', headers={PROFILE_HEADER: 'not a token'})
+    profiler.flush()
+    assert _files(tmp_path) == []
+
+    client.simulate_get('/item/1', headers={PROFILE_HEADER: get_admin_token()})
+    profiler.flush()
+    assert len(_files(tmp_path)) == 1
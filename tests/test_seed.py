@@ -0,0 +1,66 @@
+import pytest
+
+from sqlalchemy import create_engine, select, func
+
+from recipe.database.database import init_db
+from recipe.database.models import User, UserPassword, Recipe, Tag, RecipesTags, BookmarkedRecipe, RatedRecipe, Status
+from recipe.seed import SeedConfig, seed, approved_recipe_count
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_seed(tmp_path, workers: int):
+    db_url = f'sqlite:///{tmp_path / "seed.db"}'
+    engine = create_engine(db_url)
+    init_db(engine)
+
+    config = SeedConfig(users=20, recipes=100, tags=10, ratings=150, bookmarks=120, chunk_size=40, password_hash=b'unused')
+    counts = seed(db_url, config, workers, log=lambda line: None)
+
+    with engine.connect() as conn:
+        def count(model) -> int:
+            return conn.scalar(select(func.count()).select_from(model))
+
+        assert count(User) == counts['users'] == 20
+        assert count(UserPassword) == counts['user_password'] == 20
+        assert count(Tag) == counts['tags'] == 10
+        assert count(Recipe) == counts['recipes'] == 100
+        assert count(RatedRecipe) == counts['rated_recipes'] == 150
+        assert count(BookmarkedRecipe) == counts['bookmarked_recipes'] == 120
+        assert count(RecipesTags) == counts['recipes_tags'] > 0
+
+        approved = conn.scalar(select(func.count()).select_from(Recipe).where(Recipe.status == Status.APPROVED))
+        assert approved == approved_recipe_count(100)
+
+        # only the approved recipes are rated and bookmarked
+        assert conn.scalar(select(func.count())
+                           .select_from(RatedRecipe)
+                           .join(Recipe, Recipe.id == RatedRecipe.recipe_id)
+                           .where(Recipe.status != Status.APPROVED)) == 0
+
+        # the counters and the ratings match the rows
+        assert conn.scalar(select(func.sum(Recipe.bookmark_count))) == 120
+        assert conn.scalar(select(func.sum(Recipe.rating_count))) == 150
+
+        averages = dict(conn.execute(select(RatedRecipe.recipe_id, func.avg(RatedRecipe.score)).group_by(RatedRecipe.recipe_id)).all())
+        for recipe_id, rating in conn.execute(select(Recipe.id, Recipe.rating)).all():
+            assert rating == pytest.approx(averages.get(recipe_id, 0))
+
+    engine.dispose()
+
+def test_seed_is_deterministic(tmp_path):
+    config = SeedConfig(users=10, recipes=30, tags=5, ratings=40, bookmarks=40, chunk_size=15, password_hash=b'unused')
+
+    contents = []
+    for workers in (1, 2):
+        db_url = f'sqlite:///{tmp_path / f"seed_{workers}.db"}'
+        engine = create_engine(db_url)
+        init_db(engine)
+        seed(db_url, config, workers, log=lambda line: None)
+
+        with engine.connect() as conn:
+            contents.append((
+                conn.execute(select(Recipe.id, Recipe.source, Recipe.author_id).order_by(Recipe.id)).all(),
+                conn.execute(select(RatedRecipe.user_id, RatedRecipe.recipe_id, RatedRecipe.score).order_by(RatedRecipe.user_id, RatedRecipe.recipe_id)).all()
+            ))
+        engine.dispose()
+
+    assert contents[0] == contents[1]